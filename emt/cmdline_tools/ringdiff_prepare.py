@@ -11,6 +11,7 @@ import emt.eva.ring_diff
 parser = argparse.ArgumentParser(description='This tool prepares an emd evaluation file for diffraction ring analysis. The file is created with a blank parental settings group. Evaluation groups for all emdgroups in the given emdfiles are created. The emd evaluation file is meant to be edited with an external hdf5 viewer before the evaluation is executed.')
 parser.add_argument('-i','--input', nargs='*', help='one or more emdfiles with emdgroups to evaluate')
 parser.add_argument('-o','--output', nargs=1, help='path to the output EMD file (will be overwritten)')
+parser.add_argument('-s','--swmr', action='store_true', help='create the output EMD file in the latest HDF5 format, needed to follow results with ringdiff_run -s')
 args = parser.parse_args()
 
 print('{}'.format(args.output))
@@ -19,7 +20,7 @@ print('{}'.format(args.input))
 # open output emdfile
 if os.path.isfile(args.output[0]):
     os.remove(args.output[0])
-femd_out = emt.io.emd.fileEMD(args.output[0])
+femd_out = emt.io.emd.fileEMD(args.output[0], swmr=args.swmr)
 grp_eva = femd_out.file_hdl.create_group('evaluation')
 
 print('Evaluation file {} created.'.format(args.output[0]))
@@ -39,14 +40,14 @@ if not args.input is None:
         
         hdl = grp_eva.create_group(os.path.basename(fname))
         
-        femd_in = emt.io.emd.fileEMD(fname, readonly=True)
-
-        for i in range(len(femd_in.list_emds)):
-        
-            emt.eva.ring_diff.put_sglgroup(hdl, '{}'.format(femd_in.list_emds[i].name.split('/')[-1]), femd_in.list_emds[i])
-            print('.. {}'.format(femd_in.list_emds[i].name))
+        with emt.io.emd.fileEMD(fname, readonly=True) as femd_in:
+            
+            for i in range(len(femd_in.list_emds)):
+                
+                emt.eva.ring_diff.put_sglgroup(hdl, '{}'.format(femd_in.list_emds[i].name.split('/')[-1]), femd_in.list_emds[i])
+                print('.. {}'.format(femd_in.list_emds[i].name))
 
 print('Remember to delete evaluation groups for emdtype groups which are not intended to be evaluated.')
 
-del femd_out, femd_in
+femd_out.close()
 
@@ -13,18 +13,16 @@ parser.add_argument('input', help='path to the emd evaluation file')
 parser.add_argument('-f', action='store_true', help='overwrite existing results')
 parser.add_argument('-v', action='store_true', help='verbose mode')
 parser.add_argument('-p', action='store_true', help='show the plots')
+parser.add_argument('-s', action='store_true', help='switch to SWMR mode once the result groups are created, so results can be read while they are written (file prepared with ringdiff_prepare -s)')
 
 args = parser.parse_args()
 
 
-# open input file
-femd = emt.io.emd.fileEMD(args.input)
-
-# execute
-emt.eva.ring_diff.run_all(femd.file_hdl, femd, args.f, args.v, args.p)
-
-# close output    
-del femd
+# open input file, closed after execution
+with emt.io.emd.fileEMD(args.input, swmr=args.s) as femd:
+    
+    # execute
+    emt.eva.ring_diff.run_all(femd.file_hdl, femd, args.f, args.v, args.p, swmr=args.s)
 
 # wait for plots
 if args.p:
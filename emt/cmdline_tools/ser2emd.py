@@ -1,16 +1,79 @@
 '''
 Command line tool to convert a SER file to an EMD file.
+
+With --batch, all SER files found in the given files, glob patterns or directories are converted into the output directory 
+using a pool of processes. Outputs newer than their SER and EMI files are skipped.
 '''
 
 import argparse
+import os
+import time
+import concurrent.futures
 import emt.io.ser
+import emt.io.emd
+
+
+def run_batch(args):
+    '''Convert several SER files in parallel and print a summary.'''
+    
+    filenames = emt.io.ser.findSER(args.input, recursive=args.recursive)
+    if len(filenames) == 0:
+        print('No SER files found.')
+        return
+    
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    
+    # one output per SER file, named after it
+    outputs = [ os.path.join(args.output, os.path.splitext(os.path.basename(filename))[0]+'.emd') for filename in filenames ]
+    if len(set(outputs)) < len(outputs):
+        raise RuntimeError('SER files with the same name would be converted to the same output')
+    
+    kwargs = {'batchsize': args.batchsize, 'workers': args.workers, 'native': args.native, 'compression': args.compression}
+    
+    t0 = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = [ executor.submit(emt.io.ser.convertSER, filename, output, overwrite=args.overwrite, **kwargs) for filename, output in zip(filenames, outputs) ]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['status'] == 'failed':
+                print('failed "{}": {}'.format(result['filename'], result['error']))
+            elif result['status'] == 'skipped':
+                print('skipped "{}", up to date'.format(result['filename']))
+            else:
+                print('converted "{}" in {:.1f} s'.format(result['filename'], result['seconds']))
+    seconds = time.perf_counter()-t0
+    
+    # summary
+    nbytes = sum(result['nbytes'] for result in results)
+    counts = {status: sum(1 for result in results if result['status'] == status) for status in ('converted', 'skipped', 'failed')}
+    print('{converted} converted, {skipped} skipped, {failed} failed'.format(**counts))
+    print('{:.1f} MB in {:.1f} s, {:.1f} MB/s'.format(nbytes/1e6, seconds, nbytes/1e6/seconds if seconds > 0 else 0.0))
 
-# parse the commandline arguments
-parser = argparse.ArgumentParser(description='Tool to convert a SER file to an EMD file.')
-parser.add_argument('input', help='path to the input SER file')
-parser.add_argument('--emi', help='path to corresponding EMI file')
-parser.add_argument('output', help='path to the output EMD file')
-args = parser.parse_args()
 
-fser = emt.io.ser.fileSER(args.input, emifile=args.emi)
-fser.writeEMD(args.output)
+if __name__ == '__main__':
+    # parse the commandline arguments
+    parser = argparse.ArgumentParser(description='Tool to convert a SER file to an EMD file.')
+    parser.add_argument('input', nargs='+', help='path to the input SER file, with --batch SER files, glob patterns or directories')
+    parser.add_argument('--emi', help='path to corresponding EMI file')
+    parser.add_argument('output', help='path to the output EMD file, with --batch the output directory')
+    parser.add_argument('--batchsize', type=int, help='number of datasets converted at once to limit memory usage')
+    parser.add_argument('--workers', type=int, default=1, help='number of threads reading batches while the previous ones are written (use with --batchsize)')
+    parser.add_argument('--native', action='store_true', help='write datasets in the order stored in the SER file, oriented when reading')
+    parser.add_argument('--compression', choices=sorted(emt.io.emd.compression_presets), help='filter preset for the dataset')
+    parser.add_argument('--batch', action='store_true', help='convert several SER files, EMI files are found automatically')
+    parser.add_argument('--processes', type=int, help='number of processes for --batch, defaults to the number of cores')
+    parser.add_argument('--recursive', action='store_true', help='search directories and ** patterns recursively for --batch')
+    parser.add_argument('--overwrite', action='store_true', help='convert with --batch even if the output is up to date')
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch(args)
+    else:
+        if len(args.input) > 1:
+            parser.error('several inputs need --batch')
+        
+        with emt.io.ser.fileSER(args.input[0], emifile=args.emi) as fser:
+            fser.writeEMD(args.output, batchsize=args.batchsize, workers=args.workers, native=args.native, compression=args.compression)
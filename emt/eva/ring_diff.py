@@ -7,6 +7,7 @@ import emt.algo.distortion
 import emt.algo.radial_profile
 import emt.algo.math
 import emt.io.emd
+import emt.io.prefetch
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -233,13 +234,39 @@ def put_sglgroup(parent, label, data_grp):
     return grp
     
 
-def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False):
+def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False, depth=4, pool=None):
     '''
     Run evaluation on a single group.
     
     input:
     - group         handle to evaluation group to execute
     - outfile       emdfile for output
+    - depth         number of frames read ahead while evaluating series
+    - pool          emt.io.emd.filePool to get the data file from, opened and closed for this group if None
+    '''
+
+    if pool is None:
+        with emt.io.emd.filePool() as pool:
+            return run_sglgroup(group, outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, depth=depth, pool=pool)
+    
+    job = start_sglgroup(group, outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, pool=pool)
+    finish_sglgroup(job, showplots=showplots, depth=depth)
+
+
+def start_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False, pool=None):
+    '''
+    Start evaluation of a single group, creating all its result groups.
+    
+    Single images are evaluated completely. Of series the first frame is evaluated to lay out the result groups, 
+    the remaining frames are appended by finish_sglgroup. Nothing is created in outfile afterwards, so it can be switched to SWMR in between.
+    
+    input:
+    - group         handle to evaluation group to execute
+    - outfile       emdfile for output
+    - pool          emt.io.emd.filePool to get the data file from
+    
+    return:
+    - job           dict with the state to finish series or None if done
     '''
 
     try:
@@ -247,6 +274,7 @@ def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False
         assert( group.attrs['type'] == np.string_(cur_eva_vers) )
         
         assert(isinstance(outfile, emt.io.emd.fileEMD))
+        assert(isinstance(pool, emt.io.emd.filePool))
     except:
         raise TypeError('Something wrong with the input.')
         
@@ -258,9 +286,9 @@ def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False
     # get the emdgroup
     if verbose:
         print('.. getting data from {}:{}'.format(group.attrs['filename'].decode('utf-8'), group.attrs['internal_path'].decode('utf-8')))
-    readfile = emt.io.emd.fileEMD( group.attrs['filename'].decode('utf-8'), readonly=True )
-    data, dims = readfile.get_emdgroup(readfile.file_hdl[group.attrs['internal_path'].decode('utf-8')])
-    
+    readfile = pool.get( group.attrs['filename'].decode('utf-8') )
+    data, dims = readfile.get_emdgroup(readfile.file_hdl[group.attrs['internal_path'].decode('utf-8')], lazy=True)
+
     # find the settings moving upwards in hierarchy
     if verbose:
         print('.. searching for settings.')
@@ -283,44 +311,28 @@ def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False
             print('.. loading settings from {}.'.format(grp_set.name))
         settings = get_settings(grp_set)
     
-    # what data to collect
-    profiles = None
-    centers = None
-    distss = None
-    fits = None
-    rawprofiles = None
-    fits_back = None
+    job = None
     
     # run evaluation with settings
     if len(data.shape) == 3:
-        for i in range(data.shape[2]):
-            profile, res, center, dists, rawprofile, res_back, myset = emt.algo.radial_profile.run_singleImage( data[:,:,i], dims[0:2], settings,  show=showplots)
-    
-            # after first run I know the size
-            if profiles is None:
-                profiles = np.zeros( (profile.shape[0], data.shape[2]) )
-                fits = np.zeros( (res.shape[0], data.shape[2]) )
-                centers = np.zeros( (2, data.shape[2]) )
-                distss = np.zeros( (dists.shape[0], data.shape[2]) )
-                rawprofiles = np.zeros( (rawprofile.shape[0], data.shape[2]) )
-                fits_back = np.zeros( (res_back.shape[0], data.shape[2]) )
-                
-            # assign data    
-            profiles[:,i] = profile[:,1]
-            fits[:,i] = res[:]
-            centers[:,i] = center[:]
-            distss[:,i] = dists[:]
-            rawprofiles[:,i] = rawprofile[:,1]
-            fits_back[:,i] = res_back[:]
-
+        # results are appended frame by frame, the first one lays them out
+        number = (np.zeros(0, dtype=dims[2][0].dtype), dims[2][1], dims[2][2])
+        
+        profile, res, center, dists, rawprofile, res_back, myset = emt.algo.radial_profile.run_singleImage( data[:,:,0], dims[0:2], settings,  show=showplots)
+        
+        results = [ outfile.create_appendable('radial_profile', 'f8', ( (profile[:,0], 'radial distance', dims[0][2]) , number), parent=group, overwrite=overwrite),
+                    outfile.create_appendable('fit_results', 'f8', ( ( np.array(range(res.shape[0])), 'parameters', '[]') , number), parent=group, overwrite=overwrite),
+                    outfile.create_appendable('centers', 'f8', ( ( np.array(range(2)), 'dimension', dims[0][2]) , number), parent=group, overwrite=overwrite),
+                    outfile.create_appendable('distortions', 'f8', ( ( np.array(range(dists.shape[0])), 'parameters', '[]') , number), parent=group, overwrite=overwrite),
+                    outfile.create_appendable('radial_profile_noback', 'f8', ( (rawprofile[:,0], 'radial distance', dims[0][2]) , number), parent=group, overwrite=overwrite),
+                    outfile.create_appendable('back_results', 'f8', ( ( np.array(range(res_back.shape[0])), 'background parameters', '[]') , number), parent=group, overwrite=overwrite) ]
+        
         # save results in this group
-        outfile.put_emdgroup('radial_profile', profiles, ( (profile[:,0], 'radial distance', dims[0][2]) , dims[2]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('fit_results', fits, ( ( np.array(range(fits.shape[0])), 'parameters', '[]') , dims[2]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('centers', centers, ( ( np.array(range(2)), 'dimension', dims[0][2]) , dims[2]), parent=group, overwrite=overwrite)    
-        outfile.put_emdgroup('distortions', distss, ( ( np.array(range(distss.shape[0])), 'parameters', '[]') , dims[2]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('radial_profile_noback', rawprofiles, ( (rawprofile[:,0], 'radial distance', dims[0][2]) , dims[2]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('back_results', fits_back, ( ( np.array(range(fits_back.shape[0])), 'background parameters', '[]') , dims[2]), parent=group, overwrite=overwrite)
-    
+        for app, result in zip(results, (profile[:,1], res, center, dists, rawprofile[:,1], res_back)):
+            if app is not None:
+                app.append(result, values=dims[2][0][0])
+        
+        job = {'outfile': outfile, 'data': data, 'dims': dims, 'settings': settings, 'results': results}
 
     elif len(data.shape) == 2:
         profile, res, center, dists, rawprofile, res_back, myset = emt.algo.radial_profile.run_singleImage( data[:,:], dims, settings,  show=showplots)
@@ -340,18 +352,64 @@ def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False
     # save a log comment
     outfile.put_comment('Evaluated "{}" using ring diffraction analysis.'.format(group.name))
     
+    return job
+
+
+def finish_sglgroup(job, showplots=False, depth=4):
+    '''
+    Evaluate the remaining frames of a series started by start_sglgroup.
+    
+    If outfile is in SWMR mode, results are flushed frame by frame, so readers can follow them, see emt.io.emd.fileEMD.follow_emdgroup.
+    
+    input:
+    - job           as returned by start_sglgroup, nothing is done for None
+    - depth         number of frames read ahead while evaluating series
+    '''
+    
+    if job is None:
+        return
+    
+    data = job['data']
+    dims = job['dims']
+    results = job['results']
+    live = job['outfile'].file_hdl.swmr_mode
+    
+    # frames are read ahead while evaluating, into reused buffers
+    for i, frame in emt.io.prefetch.framePrefetcher(data, indices=range(1, data.shape[2]), depth=depth, reuse=True):
+        profile, res, center, dists, rawprofile, res_back, myset = emt.algo.radial_profile.run_singleImage( frame, dims[0:2], job['settings'],  show=showplots)
+        
+        # save results in this group
+        for app, result in zip(results, (profile[:,1], res, center, dists, rawprofile[:,1], res_back)):
+            if app is not None:
+                app.append(result, values=dims[2][0][i])
+                if live:
+                    app.flush()
+    
+    for app in results:
+        if app is not None:
+            app.close()
+    
 
-def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False):
+def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False, depth=4, pool=None, swmr=False):
     '''
     Run on a set-up emd file to do evaluations and save results.
     
-    All evaluations within parent are run.
+    All evaluations within parent are run. Data files are opened once and shared by all evaluations referring to them.
+    With swmr, the result groups of all evaluations are created first and outfile is switched to SWMR, 
+    so the results of series can be followed by readers while they are evaluated. outfile needs to be opened with swmr then.
     
     input:
     - parent        handle to parent group
     - outfile       emdfile to save evaluations
+    - depth         number of frames read ahead while evaluating series
+    - pool          emt.io.emd.filePool to get the data files from, one is used for this run if None
+    - swmr (bool)   True to switch outfile to SWMR mode after creating all result groups
     '''
     
+    if pool is None:
+        with emt.io.emd.filePool() as pool:
+            return run_all(parent, outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, depth=depth, pool=pool, swmr=swmr)
+    
     # get all groups with evaluations to do
     todo = []
     
@@ -370,7 +428,14 @@ def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False):
     proc_group(parent, todo)
     
     # run through all evaluations
-    for i in range(len(todo)):
-        run_sglgroup(todo[i], outfile, overwrite=overwrite, verbose=verbose, showplots=showplots)
-    
-
+    if swmr:
+        # no groups can be created after switching
+        jobs = [start_sglgroup(todo[i], outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, pool=pool) for i in range(len(todo))]
+        outfile.start_swmr()
+        if verbose:
+            print('Switched "{}" to SWMR mode.'.format(outfile.file_hdl.filename))
+        for job in jobs:
+            finish_sglgroup(job, showplots=showplots, depth=depth)
+    else:
+        for i in range(len(todo)):
+            run_sglgroup(todo[i], outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, depth=depth, pool=pool)
@@ -10,6 +10,8 @@ import copy
 import h5py
 
 import emt.io.emd
+import emt.io.prefetch
+import emt.io.cache
 import emt.algo.local_max
 import emt.algo.distortion
 import emt.algo.radial_profile
@@ -33,7 +35,7 @@ class MaskDialog(QtGui.QDialog):
         self.setModal(True)
         
         self.imgview = pg.ImageView()
-        self.imgview.setImage(parent.data[:,:,parent.idx])
+        self.imgview.setImage(parent.get_image())
         self.imgview.ui.roiBtn.hide()
         self.imgview.ui.menuBtn.hide()
         
@@ -63,7 +65,7 @@ class MaskDialog(QtGui.QDialog):
         
     def getResult(self):
         
-        im = QtGui.QImage(self.parent.data[:,:,self.parent.idx].shape[0], self.parent.data[:,:,self.parent.idx].shape[1], QtGui.QImage.Format_ARGB32) 
+        im = QtGui.QImage(self.parent.get_image().shape[0], self.parent.get_image().shape[1], QtGui.QImage.Format_ARGB32) 
         im.fill(1)
                 
         p = QtGui.QPainter(im)
@@ -92,6 +94,7 @@ class Main(QtGui.QMainWindow):
         
         self.gui_file = {}
         self.femd_in = None
+        self.cache = emt.io.cache.frameCache()
         self.gui_localmax = {}
         self.gui_polar = {}
         self.gui_radprof = {}
@@ -115,6 +118,8 @@ class Main(QtGui.QMainWindow):
         
     def reset(self):
         self.data = None
+        self.grp_in = None
+        self.data_minmax = None
         self.dims = None
         self.settings = {}
         self.points = None
@@ -524,28 +529,30 @@ class Main(QtGui.QMainWindow):
         '''
         fname, _ = QtGui.QFileDialog.getOpenFileName(self, 'Open EMD file', filter='EMD files (*.emd);;All files (*.*)')
         try:
-            self.femd_in = emt.io.emd.fileEMD(fname, readonly=True)
+            self.femd_in = emt.io.emd.fileEMD(fname, readonly=True, cache=self.cache)
             
             self.gui_file['in_txt'].setText(fname)
             
             self.log('Opening file "{}" ..'.format(fname))
             
-            # get and save data
-            data, dims = self.femd_in.get_emdgroup(self.femd_in.list_emds[0])
+            # get data, series are read frame by frame when needed
+            data, dims = self.femd_in.get_emdgroup(self.femd_in.list_emds[0], lazy=True)
             self.log('.. found EMD type group at "{}".'.format(self.femd_in.list_emds[0].name))
             
             if len(data.shape)==2:
-                data = data[:,:,np.newaxis]
+                self.grp_in = None
+                data = data[:,:][:,:,np.newaxis]
                 self.log('.. single image.')
             elif len(data.shape)==3:
+                self.grp_in = self.femd_in.list_emds[0]
                 self.log('.. series of {:d} images.'.format(data.shape[2])) 
             
-            self.data = np.copy(data)
+            self.data = data
+            self.idx = 0
+            self.data_minmax = self.get_minmax(data)
             self.dims = copy.deepcopy(dims)
             
             # configure index slider
-            self.idx = 0
-            
             if len(data.shape)==3:
                 self.gui_file['idx_slider'].setMinimum(0)
                 self.gui_file['idx_slider'].setMaximum(self.data.shape[2]-1)
@@ -561,8 +568,7 @@ class Main(QtGui.QMainWindow):
             self.mask = None
             
             # configure intensity sliders
-            min_data = np.min(self.data)
-            max_data = np.max(self.data)
+            min_data, max_data = self.data_minmax
             
             self.gui_localmax['min_slider'].setMinimum(min_data)
             self.gui_localmax['min_slider'].setMaximum(max_data)
@@ -580,6 +586,40 @@ class Main(QtGui.QMainWindow):
             raise TypeError()
     
     
+    def get_image(self):
+        '''
+        Get the current image, images of series are kept in the cache.
+        '''
+        if self.grp_in is None:
+            return self.data[:,:,self.idx]
+        
+        return self.femd_in.get_emdframe(self.grp_in, self.idx)
+    
+    
+    def get_minmax(self, data, samples=16):
+        '''
+        Get minimum and maximum of the data, of series from evenly spaced sample frames.
+        
+        The sampled frames depend only on the length of the series, so the range and the relative levels saved in the settings are reproduced on reopening.
+        '''
+        if isinstance(data, np.ndarray):
+            return np.min(data), np.max(data)
+        
+        indices = np.unique(np.linspace(0, data.shape[-1]-1, min(samples, data.shape[-1])).astype(int))
+        
+        min_data = None
+        max_data = None
+        for i, frame in emt.io.prefetch.framePrefetcher(data, indices=indices, reuse=True):
+            if min_data is None:
+                min_data = np.min(frame)
+                max_data = np.max(frame)
+            else:
+                min_data = min(min_data, np.min(frame))
+                max_data = max(max_data, np.max(frame))
+        
+        return min_data, max_data
+    
+    
     def on_reopen(self):
     
         fname, _ = QtGui.QFileDialog.getOpenFileName( self, 'Open EMD evaluation file', filter='EMD files (*.emd);;All files (*.*)')
@@ -607,26 +647,28 @@ class Main(QtGui.QMainWindow):
             grp_eva = todo[0]
             self.log('.. found evaluation group at "{}".'.format(grp_eva.name))
             
-            self.femd_in = emt.io.emd.fileEMD(grp_eva.attrs['filename'].decode('utf-8'), readonly=True)
+            self.femd_in = emt.io.emd.fileEMD(grp_eva.attrs['filename'].decode('utf-8'), readonly=True, cache=self.cache)
             self.gui_file['in_txt'].setText(grp_eva.attrs['filename'].decode('utf-8'))
             
-            # get and save data
-            data, dims = self.femd_in.get_emdgroup(self.femd_in.list_emds[0])
+            # get data, series are read frame by frame when needed
+            data, dims = self.femd_in.get_emdgroup(self.femd_in.list_emds[0], lazy=True)
             
             self.log('.. loading data from "{}"-"{}".'.format(self.femd_in.file_hdl.filename, self.femd_in.list_emds[0].name))
             
             if len(data.shape)==2:
-                data = data[:,:,np.newaxis]
+                self.grp_in = None
+                data = data[:,:][:,:,np.newaxis]
                 self.log('.. single image.')
             elif len(data.shape)==3:
+                self.grp_in = self.femd_in.list_emds[0]
                 self.log('.. series of {:d} images.'.format(data.shape[2])) 
             
-            self.data = np.copy(data)
+            self.data = data
+            self.idx = 0
+            self.data_minmax = self.get_minmax(data)
             self.dims = copy.deepcopy(dims)
                 
             # configure index slider
-            self.idx = 0
-                
             if len(data.shape)==3:
                 self.gui_file['idx_slider'].setMinimum(0)
                 self.gui_file['idx_slider'].setMaximum(self.data.shape[2]-1)
@@ -675,8 +717,7 @@ class Main(QtGui.QMainWindow):
                 
                 
             # configure intensity sliders
-            min_data = np.min(self.data)
-            max_data = np.max(self.data)
+            min_data, max_data = self.data_minmax
             
             new_min = int(min_data + self.settings['plt_imgminmax'][0]*(max_data - min_data) )
             new_max = int(min_data + self.settings['plt_imgminmax'][1]*(max_data - min_data) )
@@ -823,8 +864,7 @@ class Main(QtGui.QMainWindow):
             self.plt_localmax_img.setLevels( (min_val, max_val) )
         
         # update settings
-        min_data = np.min(self.data)
-        max_data = np.max(self.data)
+        min_data, max_data = self.data_minmax
         self.settings['plt_imgminmax'] = ( (min_val-min_data)/(max_data - min_data) , (max_val-min_data)/(max_data - min_data) )
 
 
@@ -868,7 +908,7 @@ class Main(QtGui.QMainWindow):
             axis2.setLabel(self.dims[1][1], self.dims[1][2])
            
             # plot image
-            self.plt_localmax_img = pg.ImageItem(self.data[:,:,self.idx].astype('float64'), levels=(self.gui_localmax['min_slider'].value(), self.gui_localmax['max_slider'].value()))
+            self.plt_localmax_img = pg.ImageItem(self.get_image().astype('float64'), levels=(self.gui_localmax['min_slider'].value(), self.gui_localmax['max_slider'].value()))
             self.plt_localmax_img.setZValue(-100)
             self.plt_localmax_img.setRect(pg.QtCore.QRectF( self.dims[0][0][0],self.dims[1][0][0],self.dims[0][0][-1]-self.dims[0][0][0],self.dims[1][0][-1]-self.dims[1][0][0]))
             self.plt_localmax.addItem(self.plt_localmax_img)
@@ -921,7 +961,7 @@ class Main(QtGui.QMainWindow):
         self.settings['lmax_range'] = rrange
             
         # find local max
-        points = emt.algo.local_max.local_max(self.data[:,:,self.idx], self.settings['lmax_r'], self.settings['lmax_thresh'])
+        points = emt.algo.local_max.local_max(self.get_image(), self.settings['lmax_r'], self.settings['lmax_thresh'])
         points = emt.algo.local_max.points_todim(points, self.dims)
                 
         self.log('.. found {:d} candidate points.'.format(points.shape[0]))
@@ -1181,7 +1221,7 @@ class Main(QtGui.QMainWindow):
         
         # save settings
         if len(pars) == 0:
-            self.settings['rad_rmax'] = np.abs(self.dims[0][0][0]-self.dims[0][0][1])*np.min(self.data[:,:,self.idx].shape)/2.0
+            self.settings['rad_rmax'] = np.abs(self.dims[0][0][0]-self.dims[0][0][1])*np.min(self.get_image().shape)/2.0
             self.settings['rad_dr'] = np.abs(self.dims[0][0][0]-self.dims[0][0][1])/10.
             self.settings['rad_sigma'] = np.abs(self.dims[0][0][0]-self.dims[0][0][1])
             self.log('.. calculating adaptive defaults: r_max: {:g}, dr: {:g}, sigma: {:g}'.format(self.settings['rad_rmax'], self.settings['rad_dr'], self.settings['rad_sigma']))
@@ -1202,7 +1242,7 @@ class Main(QtGui.QMainWindow):
             self.log('.. calculating coordinate system, not correcting distortions.')
         
         # get the radial profile
-        R, I = emt.algo.radial_profile.calc_radialprofile( self.data[:,:,self.idx], rs, self.settings['rad_rmax'], self.settings['rad_dr'], self.settings['rad_sigma'], self.mask )
+        R, I = emt.algo.radial_profile.calc_radialprofile( self.get_image(), rs, self.settings['rad_rmax'], self.settings['rad_dr'], self.settings['rad_sigma'], self.mask )
         
         # save in main
         self.radprof[self.idx] = np.array([R,I]).transpose()
@@ -1472,7 +1512,7 @@ class Main(QtGui.QMainWindow):
                  
                     self.log('.. correcting image {:d}/{:d}.'.format(self.idx+1, self.data.shape[2]))
                         
-                    data_corr[:,:,self.idx] = emt.algo.radial_profile.correct_distortion( self.data[:,:,self.idx], self.dims, self.center[self.idx], self.settings['ns'], self.dists[self.idx])
+                    data_corr[:,:,self.idx] = emt.algo.radial_profile.correct_distortion( self.get_image(), self.dims, self.center[self.idx], self.settings['ns'], self.dists[self.idx])
                 else:
                     self.log('.. skipping image {:d}/{:d} for missing results.'.format(self.idx+1, self.data.shape[2]))
             
@@ -0,0 +1,135 @@
+'''
+This module provides a cache for frames read from SER and EMD files.
+
+Frames are kept up to a budget of bytes, the least recently used ones are dropped first.
+One cache can be shared by several fileSER and fileEMD objects as well as threads.
+'''
+
+import threading
+import collections
+
+
+class frameCache:
+    '''
+    Least recently used cache of frames, limited by the bytes held.
+
+    Keys are tuples starting with the name of the file, followed by what identifies the frame in it.
+    Frames handed out are shared between all callers, so they are made read-only.
+    '''
+
+    def __init__(self, maxbytes=268435456):
+        '''Init an empty cache.
+
+        input:
+        - maxbytes (int)        maximum number of bytes of frames held
+        '''
+
+        # check input
+        if not isinstance(maxbytes, int) or maxbytes < 0:
+            raise TypeError('maxbytes needs to be a non-negative integer!')
+
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # most recently used at the end
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def __len__(self):
+        '''Number of cached frames.'''
+        return len(self.items)
+
+
+    def __contains__(self, key):
+        return key in self.items
+
+
+    def get(self, key):
+        '''Get a cached item.
+
+        input:
+        - key           tuple identifying the frame
+
+        return:
+        - item          cached item or None if not cached
+        '''
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+
+            self.misses += 1
+            return None
+
+
+    def put(self, key, item, nbytes):
+        '''Put an item into the cache, dropping the least recently used ones to stay within maxbytes.
+
+        Numpy arrays in item are made read-only. Items larger than maxbytes are not cached.
+
+        input:
+        - key           tuple identifying the frame
+        - item          frame as numpy array or tuple containing it, e.g. (dataset, meta)
+        - nbytes (int)  size of the item in bytes
+        '''
+
+        if nbytes > self.maxbytes:
+            return
+
+        for part in (item if isinstance(item, tuple) else (item,)):
+            if hasattr(part, 'flags'):
+                part.flags.writeable = False
+
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.items.pop(key)[1]
+
+            self.items[key] = (item, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.maxbytes:
+                old_key, (old_item, old_nbytes) = self.items.popitem(last=False)
+                self.nbytes -= old_nbytes
+                self.evictions += 1
+
+
+    def discard(self, prefix):
+        '''Drop all cached items with keys starting with prefix, e.g. after their file changed.
+
+        input:
+        - prefix        tuple of leading key components, e.g. (filename,)
+        '''
+
+        prefix = tuple(prefix)
+
+        with self.lock:
+            for key in [key for key in self.items if key[:len(prefix)] == prefix]:
+                self.nbytes -= self.items.pop(key)[1]
+
+
+    def clear(self):
+        '''Drop all cached items, statistics are kept.'''
+
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+
+    def stats(self):
+        '''Get the statistics of the cache.
+
+        return:
+        - stats         dict with hits, misses, hit ratio, evictions, number of frames, bytes held and maxbytes
+        '''
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'ratio': self.hits/lookups if lookups > 0 else 0.0,
+                    'evictions': self.evictions, 'frames': len(self.items), 'nbytes': self.nbytes, 'maxbytes': self.maxbytes}
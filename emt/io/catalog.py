@@ -0,0 +1,370 @@
+'''
+This module provides a catalog of SER and EMD files in large acquisition directories.
+
+The header essentials of each file are recorded into an index file (JSON).
+Files can then be found by shape, date or microscope conditions without opening any data file.
+Rescanning only touches files that changed in size or modification time.
+'''
+
+import os
+import json
+import datetime
+import numpy as np
+import h5py
+
+import emt.io.ser
+import emt.io.emd
+
+
+# used to indicate the index format
+cur_cat_vers = 'emt_catalog_vers0.1'
+
+
+def jsonable(value):
+    '''Auxiliary function to convert metadata values to something JSON can store.
+
+    input:
+    - value         metadata value, e.g. numpy scalar, array or bytes
+
+    return:
+    - value         int, float, string or list
+    '''
+
+    if isinstance(value, (bytes, np.bytes_)):
+        return value.decode('utf-8', errors='ignore')
+    if isinstance(value, np.ndarray):
+        return [jsonable(v) for v in value.tolist()]
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def parse_date(value):
+    '''Auxiliary function to parse an acquisition date as written by TIA or in ISO format.
+
+    input:
+    - value         date string, datetime or None
+
+    return:
+    - date          datetime or None, if not parseable
+    '''
+
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+
+    value = jsonable(value)
+    for fmt in ('%a %b %d %H:%M:%S %Y', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt)
+        except:
+            pass
+
+    return None
+
+
+class fileCatalog:
+    '''
+    Class to represent a catalog of SER and EMD files stored in an index file.
+    '''
+
+    def __init__(self, filename):
+        '''Init loading the index file, if it exists.
+
+        input:
+        - filename (string)     name of the index file
+        '''
+
+        # check for string
+        if not isinstance(filename, str):
+            raise TypeError('Filename is supposed to be a string!')
+
+        self.filename = filename
+        self.entries = {}               # entries keyed by absolute path
+
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                index = json.load(f)
+            if not index.get('type') == cur_cat_vers:
+                raise RuntimeError('Don\'t know the format of index file "{}"'.format(filename))
+            self.entries = index['entries']
+
+
+    def save(self):
+        '''Write the index file.'''
+
+        index = {'type': cur_cat_vers, 'entries': self.entries}
+
+        # write to a temporary file first to never leave a broken index
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmpname, self.filename)
+
+
+    def index_ser(self, filename):
+        '''Create the catalog entry for a SER file.
+
+        input:
+        - filename (string)     name of the SER file
+
+        return:
+        - entry                 dict of header essentials
+        '''
+
+        head = emt.io.ser.probe(filename, element=True)
+
+        entry = {'format': 'ser'}
+        entry['DataTypeID'] = int(head['DataTypeID'])
+        entry['TagTypeID'] = int(head['TagTypeID'])
+        entry['TotalNumberElements'] = int(head['TotalNumberElements'])
+        entry['ValidNumberElements'] = int(head['ValidNumberElements'])
+        entry['Dimensions'] = [ {key: jsonable(dim[key]) for key in dim} for dim in head['Dimensions'] ]
+        entry['dtype'] = head.get('DataType')
+
+        # shape as converted to EMD
+        shape = list(head.get('ArrayShape', []))
+        if len(head['Dimensions']) == 1:
+            shape.append(int(head['ValidNumberElements']))
+        else:
+            shape.extend( int(dim['DimensionSize']) for dim in head['Dimensions'] )
+        entry['shape'] = shape
+
+        # microscope conditions from the EMI file
+        entry['emi'] = None
+        entry['microscope'] = {}
+        emifile = emt.io.ser.findEMI(filename)
+        if emifile:
+            stat = os.stat(emifile)
+            entry['emi'] = os.path.abspath(emifile)
+            entry['emi_size'] = stat.st_size
+            entry['emi_mtime'] = stat.st_mtime_ns
+            with emt.io.ser.fileSER(filename, probe=True) as fser:
+                try:
+                    emi = fser.readEMI(emifile, cache=True)
+                    entry['microscope'] = {key: jsonable(emi[key]) for key in emi}
+                except RuntimeError:
+                    pass
+
+        entry['date'] = entry['microscope'].get('AcquireDate')
+
+        return entry
+
+
+    def index_emd(self, filename):
+        '''Create the catalog entry for an EMD file.
+
+        input:
+        - filename (string)     name of the EMD file
+
+        return:
+        - entry                 dict of header essentials
+        '''
+
+        entry = {'format': 'emd'}
+
+        with h5py.File(filename, 'r') as f:
+            if 'version_major' in f.attrs and 'version_minor' in f.attrs:
+                entry['version'] = [jsonable(f.attrs['version_major']), jsonable(f.attrs['version_minor'])]
+
+            # emd groups with shape and dims, no data is read
+            entry['emds'] = []
+            for grp in emt.io.emd.fileEMD.find_emdgroups(f):
+                if not 'data' in grp:
+                    continue
+                emd = {'name': grp.name, 'shape': list(grp['data'].shape), 'dtype': grp['data'].dtype.str, 'dims': []}
+                for i in range(len(grp['data'].shape)):
+                    label = 'dim{}'.format(i+1)
+                    if label in grp:
+                        emd['dims'].append( [jsonable(grp[label].attrs.get('name')), jsonable(grp[label].attrs.get('units'))] )
+                entry['emds'].append(emd)
+
+            # microscope conditions
+            entry['microscope'] = {}
+            if 'microscope' in f:
+                entry['microscope'] = {key: jsonable(f['microscope'].attrs[key]) for key in f['microscope'].attrs}
+
+        entry['date'] = entry['microscope'].get('AcquireDate')
+
+        return entry
+
+
+    def uptodate(self, path):
+        '''Check whether the entry for path is still valid.
+
+        input:
+        - path (string)         absolute path of the file
+
+        return:
+        - uptodate (bool)       True if the file and its EMI file did not change
+        '''
+
+        if not path in self.entries:
+            return False
+        entry = self.entries[path]
+
+        stat = os.stat(path)
+        if not (entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns):
+            return False
+
+        if entry['format'] == 'ser':
+            emifile = emt.io.ser.findEMI(path)
+            if not entry['emi'] == (os.path.abspath(emifile) if emifile else None):
+                return False
+            if emifile:
+                stat = os.stat(emifile)
+                if not (entry['emi_size'] == stat.st_size and entry['emi_mtime'] == stat.st_mtime_ns):
+                    return False
+
+        return True
+
+
+    def scan(self, paths, recursive=True, verbose=False):
+        '''Scan files and directories and update the catalog.
+
+        Only new or changed files are opened. Entries of files which vanished from scanned directories are removed.
+        The index file is not written, use save.
+
+        input:
+        - paths                 file or directory name or list of them
+        - recursive (bool)      True to descend into subdirectories
+        - verbose (bool)        True to get extensive output while scanning
+
+        return:
+        - n                     number of files (re)indexed
+        '''
+
+        if isinstance(paths, str):
+            paths = [paths]
+
+        # collect candidates
+        files = []
+        roots = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                roots.append(path)
+                for dirpath, dirnames, filenames in os.walk(path):
+                    for fname in sorted(filenames):
+                        if os.path.splitext(fname)[1].lower() in ('.ser', '.emd'):
+                            files.append(os.path.join(dirpath, fname))
+                    if not recursive:
+                        break
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                raise IOError('No such file or directory: "{}"'.format(path))
+
+        n = 0
+        for path in files:
+            if self.uptodate(path):
+                continue
+
+            if verbose:
+                print('Indexing "{}".'.format(path))
+
+            stat = os.stat(path)
+            try:
+                if os.path.splitext(path)[1].lower() == '.ser':
+                    entry = self.index_ser(path)
+                else:
+                    entry = self.index_emd(path)
+            except Exception as e:
+                # keep a record to not retry unchanged broken files
+                print('Could not index "{}": {}'.format(path, e))
+                entry = {'format': 'unknown', 'error': str(e), 'microscope': {}, 'date': None}
+
+            entry['path'] = path
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime_ns
+            if entry['date'] is None or parse_date(entry['date']) is None:
+                entry['date'] = datetime.datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%dT%H:%M:%S')
+            else:
+                entry['date'] = parse_date(entry['date']).strftime('%Y-%m-%dT%H:%M:%S')
+
+            self.entries[path] = entry
+            n += 1
+
+        # remove vanished files
+        seen = set(files)
+        recursive_roots = [root if root.endswith(os.sep) else root+os.sep for root in roots]
+        for path in list(self.entries):
+            if path in seen:
+                continue
+            if recursive:
+                inside = any(path.startswith(root) for root in recursive_roots)
+            else:
+                inside = os.path.dirname(path) in roots
+            if inside:
+                if verbose:
+                    print('Removing vanished "{}".'.format(path))
+                del self.entries[path]
+
+        return n
+
+
+    def query(self, format=None, shape=None, after=None, before=None, **conditions):
+        '''Find catalog entries matching all given criteria.
+
+        input:
+        - format (string)       'ser' or 'emd'
+        - shape                 shape of the data, matches any emd group for EMD files, None in shape matches any size
+        - after                 earliest acquisition date, datetime or string
+        - before                latest acquisition date, datetime or string
+        - conditions            microscope conditions, either values or functions returning True for matching values
+
+        return:
+        - entries               list of matching entries
+        '''
+
+        after = parse_date(after)
+        before = parse_date(before)
+
+        def match_shape(candidate):
+            if not len(candidate) == len(shape):
+                return False
+            return all(s is None or s == c for s, c in zip(shape, candidate))
+
+        result = []
+        for path in sorted(self.entries):
+            entry = self.entries[path]
+
+            if format and not entry['format'] == format:
+                continue
+
+            if not shape is None:
+                if entry['format'] == 'ser':
+                    shapes = [entry['shape']]
+                elif entry['format'] == 'emd':
+                    shapes = [emd['shape'] for emd in entry['emds']]
+                else:
+                    shapes = []
+                if not any(match_shape(s) for s in shapes):
+                    continue
+
+            date = parse_date(entry['date'])
+            if after and (date is None or date < after):
+                continue
+            if before and (date is None or date > before):
+                continue
+
+            ok = True
+            for key in conditions:
+                if not key in entry['microscope']:
+                    ok = False
+                    break
+                if callable(conditions[key]):
+                    ok = conditions[key](entry['microscope'][key])
+                else:
+                    ok = entry['microscope'][key] == conditions[key]
+                if not ok:
+                    break
+            if not ok:
+                continue
+
+            result.append(entry)
+
+        return result
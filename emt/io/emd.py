@@ -6,7 +6,560 @@ See https://emdatasets.com/ for more details.
 
 import numpy as np
 import h5py
+import os
 import datetime
+import time
+import bisect
+
+
+# filter presets for datasets, passed to h5py's create_dataset
+# scaleoffset stores integers with the minimum number of bits needed, it is lossless only for integer data
+compression_presets = { 'none': {},
+                        'lzf': {'compression': 'lzf', 'shuffle': True},
+                        'gzip': {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+                        'gzip1': {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True},
+                        'gzip9': {'compression': 'gzip', 'compression_opts': 9, 'shuffle': True},
+                        'scaleoffset': {'scaleoffset': 0, 'compression': 'lzf', 'shuffle': True},
+                        'scaleoffset_gzip': {'scaleoffset': 0, 'compression': 'gzip', 'compression_opts': 4, 'shuffle': True} }
+
+
+def get_filters(compression, dtype):
+    '''Get the filter options for a dataset.
+    
+    input:
+    - compression           name of a preset in compression_presets, dict of create_dataset options or None
+    - dtype                 datatype of the dataset
+    
+    return:
+    - filters               dict of options for create_dataset
+    '''
+    
+    if compression is None:
+        return {}
+    
+    if isinstance(compression, str):
+        if not compression in compression_presets:
+            raise ValueError('Unknown compression preset "{}", use one of {}'.format(compression, sorted(compression_presets)))
+        filters = dict(compression_presets[compression])
+    elif isinstance(compression, dict):
+        filters = dict(compression)
+    else:
+        raise TypeError('compression needs to be a preset name or a dict!')
+    
+    if 'scaleoffset' in filters and not np.issubdtype(np.dtype(dtype), np.integer):
+        raise ValueError('scaleoffset is only lossless for integer data')
+    
+    return filters
+
+
+# frames per chunk along resizable axes, whole chunks are allocated even when trimmed, so small results must not get large chunks
+append_frames = 8
+
+
+def frame_chunks(shape, itemsize, frame_ndim=None, maxbytes=1048576):
+    '''Get a chunk shape aligned to frame access.
+    
+    Chunks hold complete frames, the leading frame_ndim axes, and as many frames along the following axes as fit into maxbytes.
+    By default the last axis is the series axis, frames are images for three or more axes, e.g. spectra for a (channels, number) series.
+    
+    input:
+    - shape                 shape of the dataset
+    - itemsize (int)        size of a single value in bytes
+    - frame_ndim (int)      number of axes forming a frame, derived from the number of axes if None
+    - maxbytes (int)        maximum size of a chunk in bytes, unless a single frame is larger
+    
+    return:
+    - chunks                chunk shape
+    '''
+    
+    shape = tuple(int(n) for n in shape)
+    if frame_ndim is None:
+        frame_ndim = min(2, len(shape)-1)
+    frame_ndim = max(0, min(frame_ndim, len(shape)))
+    
+    chunks = list(shape[:frame_ndim])
+    k = max(1, maxbytes//max(1, int(np.prod(chunks))*itemsize))
+    for n in shape[frame_ndim:]:
+        c = max(1, min(k, n))
+        chunks.append(c)
+        k = max(1, k//c)
+    
+    return tuple(max(1, c) for c in chunks)
+
+
+def benchmark_compression(data, presets=None, chunks=True, repeat=1):
+    '''Measure compression ratio and throughput of filter presets on data.
+    
+    The data is written to and read from an HDF5 file held in memory, so the results do not depend on the disk.
+    
+    input:
+    - data                  numpy array of the data, e.g. a representative part of a series
+    - presets               list of preset names or dict mapping names to create_dataset options, None for all applicable presets
+    - chunks                chunk shape of the dataset, True for chunks of complete frames
+    - repeat (int)          number of repetitions, the fastest is reported
+    
+    return:
+    - results               dict mapping preset names to dicts with ratio, write and read throughput in MB/s
+    '''
+    
+    # check input
+    if not isinstance(data, np.ndarray):
+        raise TypeError('data needs to be a numpy.ndarray!')
+    
+    if presets is None:
+        presets = [name for name in compression_presets if not ('scaleoffset' in compression_presets[name] and not np.issubdtype(data.dtype, np.integer))]
+    if not isinstance(presets, dict):
+        presets = {name: name for name in presets}
+    
+    if chunks is True:
+        chunks = frame_chunks(data.shape, data.dtype.itemsize)
+    
+    results = {}
+    for name in presets:
+        filters = get_filters(presets[name], data.dtype)
+        
+        t_write = float('inf')
+        t_read = float('inf')
+        for i in range(repeat):
+            with h5py.File('benchmark_{}.h5'.format(name), 'w', driver='core', backing_store=False) as f:
+                t0 = time.perf_counter()
+                dset = f.create_dataset('data', shape=data.shape, dtype=data.dtype, chunks=chunks, **filters)
+                dset[...] = data
+                f.flush()
+                t_write = min(t_write, time.perf_counter()-t0)
+                
+                t0 = time.perf_counter()
+                dset[...]
+                t_read = min(t_read, time.perf_counter()-t0)
+                
+                stored = dset.id.get_storage_size()
+        
+        results[name] = {'ratio': data.nbytes/stored if stored > 0 else float('nan'), 
+                         'write': data.nbytes/t_write/1e6, 'read': data.nbytes/t_read/1e6}
+    
+    return results
+
+
+class orientedDataset:
+    '''
+    Thin wrapper of an HDF5 dataset applying axis_order and flip on slicing, see fileEMD.orient_emdgroup.
+    
+    Indexing with integers and slices reads only the selected part of the dataset.
+    '''
+    
+    def __init__(self, dset, axis_order, flip=()):
+        '''Init wrapping dset.
+        
+        input:
+        - dset          HDF5 dataset as stored
+        - axis_order    stored axis for each axis of the oriented view
+        - flip          axes of the oriented view reversed
+        '''
+        
+        if not sorted(axis_order) == list(range(len(dset.shape))):
+            raise ValueError('axis_order needs to be a permutation of the dataset axes')
+        
+        self.dset = dset
+        self.axis_order = [int(i) for i in axis_order]
+        self.flip = [int(i) for i in flip]
+        
+        self.shape = tuple(dset.shape[i] for i in self.axis_order)
+        self.dtype = dset.dtype
+        self.ndim = len(self.shape)
+        self.size = dset.size
+        self.nbytes = dset.nbytes
+        
+        # stored frame reused by read_into
+        self.scratch = None
+    
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    
+    def __array__(self, dtype=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+    
+    
+    def __getitem__(self, key):
+        '''Read the part of the dataset selected by integers and slices.'''
+        
+        # normalize key to one entry per axis
+        if not isinstance(key, tuple):
+            key = (key,)
+        if sum(1 for k in key if k is Ellipsis) > 1:
+            raise IndexError('Only a single ellipsis allowed')
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(self.ndim-len(key)+1) + key[i+1:]
+        if len(key) > self.ndim:
+            raise IndexError('Too many indices for array of {} dimensions'.format(self.ndim))
+        key = key + (slice(None),)*(self.ndim-len(key))
+        
+        # translate to the stored axes, HDF5 only takes positive steps
+        stored_key = [None]*self.ndim
+        reverse = []
+        for axis, k in enumerate(key):
+            n = self.shape[axis]
+            if isinstance(k, slice):
+                positions = range(*k.indices(n))
+                if axis in self.flip:
+                    positions = range(n-1-positions.start, n-1-positions.start-len(positions)*positions.step, -positions.step)
+                if len(positions) == 0:
+                    stored_key[self.axis_order[axis]] = slice(0, 0)
+                elif positions.step > 0:
+                    stored_key[self.axis_order[axis]] = slice(positions[0], positions[-1]+1, positions.step)
+                else:
+                    stored_key[self.axis_order[axis]] = slice(positions[-1], positions[0]+1, -positions.step)
+                    reverse.append(self.axis_order[axis])
+            elif isinstance(k, (int, np.integer)):
+                i = int(k)
+                if i < 0:
+                    i += n
+                if i < 0 or i >= n:
+                    raise IndexError('Index {} out of range for axis {} of size {}'.format(k, axis, n))
+                if axis in self.flip:
+                    i = n-1-i
+                stored_key[self.axis_order[axis]] = i
+            else:
+                raise TypeError('Only integers and slices are supported for indexing')
+        
+        data = self.dset[tuple(stored_key)]
+        
+        # stored axes remaining in data
+        remaining = [i for i in range(self.ndim) if isinstance(stored_key[i], slice)]
+        for i in reverse:
+            data = np.flip(data, remaining.index(i))
+        
+        # back to the oriented order
+        perm = [remaining.index(self.axis_order[axis]) for axis in range(self.ndim) if isinstance(stored_key[self.axis_order[axis]], slice)]
+        
+        return np.transpose(data, perm)
+    
+    
+    def read_into(self, out, index):
+        '''Read the frame at index along the last axis into out, see fileEMD.read_into.
+        
+        The frame is read in stored order into a buffer kept for the next call and copied into out in oriented order.
+        
+        input:
+        - out           numpy array of the frame shape to read into
+        - index (int)   index along the last axis
+        
+        return:
+        - out
+        '''
+        
+        if not isinstance(out, np.ndarray) or not out.shape == self.shape[:-1]:
+            raise TypeError('out needs to be a numpy array of shape {}'.format(self.shape[:-1]))
+        
+        n = self.shape[-1]
+        i = int(index)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('Index {} out of range for axis {} of size {}'.format(index, self.ndim-1, n))
+        if self.ndim-1 in self.flip:
+            i = n-1-i
+        
+        # stored axis of the frames
+        a = self.axis_order[-1]
+        
+        frame_shape = tuple(self.dset.shape[k] for k in range(self.ndim) if not k == a)
+        if self.scratch is None or not self.scratch.shape == frame_shape:
+            self.scratch = np.empty(frame_shape, dtype=self.dtype)
+        self.dset.read_direct(self.scratch, tuple(i if k == a else slice(None) for k in range(self.ndim)))
+        
+        # back to the oriented order
+        frame = np.transpose(self.scratch, [k-1 if k > a else k for k in self.axis_order[:-1]])
+        for axis in self.flip:
+            if axis < self.ndim-1:
+                frame = np.flip(frame, axis)
+        
+        np.copyto(out, frame, casting='unsafe')
+        
+        return out
+
+
+class appendableGroup:
+    '''
+    Emd group growing along its last axis, for writing frames or results while they are produced.
+    
+    Create it with fileEMD.create_appendable. The data is resized in steps of the chunk size along the last axis,
+    the unused part is cut off by flush or close. The last dim grows with every append.
+    In SWMR mode, see fileEMD.start_swmr, flush makes the appended frames visible to readers without cutting.
+    '''
+    
+    def __init__(self, group):
+        '''Init from an emd group created with an unlimited last axis.
+        
+        input:
+        - group         reference to the HDF5 group
+        '''
+        
+        if not isinstance(group, h5py._hl.group.Group) or not 'data' in group:
+            raise TypeError('group is not a emd_group_type group!')
+        
+        self.group = group
+        self.data = group['data']
+        if self.data.maxshape[-1] is not None:
+            raise TypeError('last axis of "{}" is not resizable!'.format(self.data.name))
+        
+        self.dim = group['dim{}'.format(self.data.ndim)]
+        self.frame_shape = self.data.shape[:-1]
+        self.step = self.data.chunks[-1]
+        self.length = self.dim.shape[0]
+    
+    
+    def __del__(self):
+        '''Cut off the unused part on del.'''
+        self.close()
+    
+    
+    def __len__(self):
+        '''Number of frames appended.'''
+        return self.length
+    
+    
+    def append(self, data, values=None):
+        '''Append a frame or several frames stacked along the last axis.
+        
+        input:
+        - data          numpy array with the shape of a frame or with an additional last axis
+        - values        values of the last dim for the appended frames, counting up if None
+        
+        return:
+        - index (int)   index of the first appended frame
+        '''
+        
+        # check input
+        data = np.asarray(data)
+        if data.shape == self.frame_shape:
+            data = data[..., np.newaxis]
+        elif not data.shape[:-1] == self.frame_shape:
+            raise TypeError('data of shape {} does not fit frames of shape {}'.format(data.shape, self.frame_shape))
+        
+        num = data.shape[-1]
+        start = self.length
+        end = start + num
+        
+        if values is None:
+            values = np.arange(start, end)
+        else:
+            values = np.atleast_1d(values)
+            if not values.shape == (num,):
+                raise TypeError('need one value per appended frame')
+        
+        # grow by whole chunks
+        if end > self.data.shape[-1]:
+            self.data.resize( -(-end//self.step)*self.step, axis=self.data.ndim-1 )
+        
+        self.data[..., start:end] = data
+        self.dim.resize( (end,) )
+        self.dim[start:end] = values
+        self.length = end
+        
+        return start
+    
+    
+    def flush(self, trim=None):
+        '''Cut the data to the appended frames and flush the file.
+        
+        input:
+        - trim (bool)   True to cut the unused part, None to cut unless the file is in SWMR mode
+        '''
+        
+        if not self.data.id.valid:
+            return
+        
+        if trim is None:
+            trim = not self.data.file.swmr_mode
+        
+        if trim and self.data.shape[-1] > self.length:
+            self.data.resize( self.length, axis=self.data.ndim-1 )
+        self.data.file.flush()
+    
+    
+    def close(self):
+        '''Finish appending, the group is a regular emd group afterwards.'''
+        
+        if hasattr(self, 'data'):
+            self.flush(trim=True)
+
+
+class linearDim(np.lib.mixins.NDArrayOperatorsMixin):
+    '''
+    Dim vector with linearly spaced values, offset + delta*i, expanded only when needed.
+    
+    Can be used in place of a numpy array in dims. Taking an element computes it, other indexing expands the vector.
+    Slices from the start stay linear, e.g. the valid part of a series.
+    Arithmetic and numpy functions work on the expanded vector and return numpy arrays.
+    '''
+    
+    def __init__(self, offset, delta, size, dtype=None):
+        '''Init from the first value, the spacing and the number of values.
+        
+        input:
+        - offset        first value
+        - delta         difference between values
+        - size (int)    number of values
+        - dtype         datatype of the values, type of offset + delta if None
+        '''
+        
+        self.offset = offset
+        self.delta = delta
+        self.size = int(size)
+        if dtype is None:
+            dtype = np.result_type(offset, delta)
+        self.dtype = np.dtype(dtype)
+        
+        self.shape = (self.size,)
+        self.ndim = 1
+    
+    
+    def __len__(self):
+        return self.size
+    
+    
+    def __array__(self, dtype=None):
+        vec = (self.offset + self.delta*np.arange(self.size)).astype(self.dtype, copy=False)
+        if dtype is not None:
+            vec = vec.astype(dtype, copy=False)
+        return vec
+    
+    
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, linearDim) else x for x in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(x) if isinstance(x, linearDim) else x for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+    
+    
+    def astype(self, dtype, copy=True):
+        return np.asarray(self).astype(dtype, copy=copy)
+    
+    
+    def tolist(self):
+        return np.asarray(self).tolist()
+    
+    
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < -self.size or key >= self.size:
+                raise IndexError('index {} is out of bounds for size {}'.format(key, self.size))
+            return self.dtype.type(self.offset + self.delta*(key % self.size))
+        
+        if isinstance(key, slice) and key.start in (None, 0) and key.step in (None, 1):
+            return linearDim(self.offset, self.delta, len(range(*key.indices(self.size))), self.dtype)
+        
+        return np.asarray(self)[key]
+    
+    
+    @classmethod
+    def from_vector(cls, vec):
+        '''Get the linearDim reproducing vec exactly.
+        
+        input:
+        - vec           numpy array
+        
+        return:
+        - dim           linearDim or None if vec is not linear
+        '''
+        
+        if isinstance(vec, linearDim):
+            return vec
+        if not isinstance(vec, np.ndarray) or not vec.ndim == 1 or vec.shape[0] < 2:
+            return None
+        if not (np.issubdtype(vec.dtype, np.integer) or np.issubdtype(vec.dtype, np.floating)):
+            return None
+        
+        # spacing taken from the values is off by rounding, e.g. for calibrations like 0.01, so try the rounded spacing as well
+        deltas = [vec[1]-vec[0]]
+        if np.issubdtype(vec.dtype, np.floating):
+            deltas.append( (vec[-1]-vec[0])/(vec.shape[0]-1) )
+            deltas += [vec.dtype.type('{:.15g}'.format(delta)) for delta in deltas]
+        
+        for delta in deltas:
+            dim = cls(vec[0], delta, vec.shape[0], vec.dtype)
+            if np.array_equal(np.asarray(dim), vec):
+                return dim
+        
+        return None
+
+
+class filePool:
+    '''
+    Pool of EMD files opened readonly, shared by everyone reading the same file.
+    
+    Files are opened on first request and kept open until the pool is closed, use it in a with block to close them deterministically.
+    '''
+    
+    def __init__(self, cache=None):
+        '''Init an empty pool.
+        
+        input:
+        - cache         emt.io.cache.frameCache passed to the files opened
+        '''
+        
+        self.cache = cache
+        self.files = {}
+    
+    
+    def __del__(self):
+        self.close()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Close all files when leaving the with block.'''
+        self.close()
+    
+    
+    def __len__(self):
+        '''Number of open files.'''
+        return len(self.files)
+    
+    
+    def __contains__(self, filename):
+        return os.path.abspath(filename) in self.files
+    
+    
+    def get(self, filename):
+        '''Get the fileEMD for filename, opening it readonly if not yet open.
+        
+        input:
+        - filename (string)     name of the EMD file
+        
+        return:
+        - femd                  fileEMD shared with other users of the pool
+        '''
+        
+        # check for string
+        if not isinstance(filename, str):
+            raise TypeError('Filename is supposed to be a string!')
+        
+        key = os.path.abspath(filename)
+        if not key in self.files or self.files[key].file_hdl is None:
+            self.files[key] = fileEMD(filename, readonly=True, cache=self.cache)
+        
+        return self.files[key]
+    
+    
+    def close(self):
+        '''Close all files of the pool.'''
+        
+        if not hasattr(self, 'files'):
+            return
+        
+        for femd in self.files.values():
+            femd.close()
+        self.files = {}
 
 
 class fileEMD:
@@ -18,12 +571,17 @@ class fileEMD:
     This means that you will still want to acces fileEMD.file_hdl to manipulate the HDF5 file for not so commonly occuring tasks.
     '''
     
-    def __init__(self, filename, readonly=False):
+    def __init__(self, filename, readonly=False, swmr=False, cache=None):
         '''Init opening/creating the file.
         
+        With swmr, one process can append to the file while others read it.
+        The writer creates its groups first and calls start_swmr, readers open readonly and pick up new frames with refresh_emdgroup.
+        
         input:
         - filename (string)     name of the EMD file
         - readonly (bool)       set to open in read only mode
+        - swmr (bool)           set to open for single writer multiple reader access
+        - cache                 emt.io.cache.frameCache keeping frames read by get_emdframe, can be shared with other files
         '''
         
         ## necessary declarations in case something goes bad
@@ -36,8 +594,11 @@ class fileEMD:
         self.sample = None
         self.user = None
         self.comments = None
-        self.list_emds = []             # list of HDF5 groups with emd_data_type type
-        
+        self._list_emds = None          # list of HDF5 groups with emd_data_type type, found on first access
+        self._emd_keys = None           # their paths split into components, in the same order
+        self.swmr = swmr
+        self.cache = cache
+
         # check for string
         if not isinstance(filename, str):
             raise TypeError('Filename is supposed to be a string!')
@@ -45,17 +606,26 @@ class fileEMD:
         # try opening the file
         if readonly:
             try:
-                self.file_hdl = h5py.File(filename, 'r')
+                if swmr:
+                    self.file_hdl = h5py.File(filename, 'r', libver='latest', swmr=True)
+                else:
+                    self.file_hdl = h5py.File(filename, 'r')
             except:
                 print('Error opening file for readonly: "{}"'.format(filename))
                 raise
         else:
             try:
-                self.file_hdl = h5py.File(filename, 'a')
+                if swmr:
+                    self.file_hdl = h5py.File(filename, 'a', libver='latest')
+                else:
+                    self.file_hdl = h5py.File(filename, 'a')
             except:
                 print('Error opening file for read/write: "{}"'.format(filename))
                 raise
         
+        # cached frames belong to this version of the file, a file rewritten at the same path gets new keys
+        self.cache_id = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+
         
         # if we got a working file
         if self.file_hdl:        
@@ -101,86 +671,221 @@ class fileEMD:
                 self.comments = self.file_hdl.create_group('comments')
             else:
                 self.comments = self.file_hdl['comments']
-                
-            # find emd_data_type groups in the file
-            self.list_emds = self.find_emdgroups(self.file_hdl)
             
 
     def __del__(self):
         '''Destructor for EMD file object'''
+        self.close()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Close the file when leaving the with block.'''
+        self.close()
+    
+    
+    def close(self):
+        '''Close the file, handles to groups and datasets in it become invalid.'''
+        
         # close the file
         if(self.file_hdl):
             self.file_hdl.close()
+        self.file_hdl = None
+        self._list_emds = None
+        self._emd_keys = None
+
+
+    def start_swmr(self):
+        '''Switch the writer to SWMR mode, readers can open the file from now on.
+        
+        No groups, datasets or attributes can be created afterwards, so create all appendable groups before.
+        The file needs to be created with swmr as well, older files cannot be switched.
+        '''
+        
+        if not self.swmr or self.file_hdl.mode == 'r':
+            raise RuntimeError('file needs to be opened with swmr for writing')
+        
+        self.file_hdl.flush()
+        self.file_hdl.swmr_mode = True
+    
+    
+    def refresh_emdgroup(self, group):
+        '''Update a group being appended to by a SWMR writer.
+        
+        input:
+        - group         reference to the HDF5 group
+        
+        returns:
+        - num (int)     number of frames available along the last axis
+        '''
+        
+        # check input
+        self.check_emdgroup(group)
+        
+        data = group['data']
+        dim = group['dim{}'.format(data.ndim)]
+        
+        if self.file_hdl.swmr_mode:
+            data.refresh()
+            dim.refresh()
+        
+        # the writer grows data in whole chunks, the last dim holds the appended frames
+        return min(data.shape[-1], dim.shape[0])
+    
+    
+    def follow_emdgroup(self, group, start=0, interval=1.0, timeout=None):
+        '''Yield frames along the last axis as they are appended by a SWMR writer.
+        
+        Iteration stops when no new frame appeared within timeout.
+        
+        input:
+        - group             reference to the HDF5 group
+        - start (int)       index of first frame to yield
+        - interval (float)  seconds to wait between checks for new frames
+        - timeout (float)   seconds without new frames to stop after, None to wait until the iteration is abandoned
+        
+        yields:
+        - (index, frame)    index and frame as numpy array
+        '''
+        
+        num = self.refresh_emdgroup(group)
+        data = group['data']
+        
+        index = start
+        last = time.monotonic()
+        while True:
+            # hand out all available ones
+            while index < num:
+                yield index, data[..., index]
+                index += 1
+                last = time.monotonic()
+            
+            # wait for new ones, the dataset read from needs its own refresh
+            num = self.refresh_emdgroup(group)
+            if self.file_hdl.swmr_mode:
+                data.refresh()
+            if num <= index:
+                if timeout is not None and time.monotonic() - last > timeout:
+                    return
+                time.sleep(interval)
+    
+    
+    @property
+    def list_emds(self):
+        '''List of HDF5 groups with emd_data_type type in the file, ordered by path.
+        
+        The file is scanned on first access only, groups created by create_emdgroup or put_emdgroup are added to the list.
+        Use rescan_emdgroups after changing the file through file_hdl.
+        '''
+        
+        if self._list_emds is None:
+            if self.file_hdl:
+                self._list_emds = self.find_emdgroups(self.file_hdl)
+            else:
+                self._list_emds = []
+            self._emd_keys = [self.emd_key(grp.name) for grp in self._list_emds]
+        
+        return self._list_emds
+    
+    
+    @list_emds.setter
+    def list_emds(self, emds):
+        self._list_emds = list(emds)
+        self._emd_keys = [self.emd_key(grp.name) for grp in self._list_emds]
+
+
+    def rescan_emdgroups(self):
+        '''Forget the list of emd groups, the file is scanned again on next access of list_emds.'''
+        
+        self._list_emds = None
+        self._emd_keys = None
 
 
-    def find_emdgroups(self, parent):
+    def emd_key(self, name):
+        '''Auxiliary function to get the sort key of a group's path, matching the order of find_emdgroups.'''
+        return tuple(name.strip('/').split('/'))
+
+
+    def add_emdgroup(self, grp):
+        '''Auxiliary function to add a new group to list_emds, if it was already scanned.'''
+        
+        if self._list_emds is None:
+            return
+        
+        key = self.emd_key(grp.name)
+        i = bisect.bisect(self._emd_keys, key)
+        self._emd_keys.insert(i, key)
+        self._list_emds.insert(i, grp)
+
+
+    def remove_emdgroups(self, name):
+        '''Auxiliary function to remove the group at name and all groups below it from list_emds, if it was already scanned.'''
+        
+        key = self.emd_key(name)
+        
+        # frames of removed groups are outdated
+        if self.cache is not None:
+            self.cache.discard( self.cache_id + key )
+        
+        if self._list_emds is None:
+            return
+        
+        keep = [i for i in range(len(self._emd_keys)) if not self._emd_keys[i][:len(key)] == key]
+        self._list_emds = [self._list_emds[i] for i in keep]
+        self._emd_keys = [self._emd_keys[i] for i in keep]
+
+
+    @staticmethod
+    def find_emdgroups(parent):
         '''Find all emd_data_type groups within the group parent and return a list of references to their HDF5 groups.'''
         
         emds = []
         
-        # recursive function to run and retrieve groups with emd_group_type set to 1
-        def proc_group(group, emds):
-            # take a look at each item in the group
-            for item in group:
-                # check if group
-                if group.get(item, getclass=True) == h5py._hl.group.Group:
-                    item = group.get(item)
-                    # check if emd_group_type
-                    if 'emd_group_type' in item.attrs:
-                        if item.attrs['emd_group_type'] == 1:
-                            emds.append(item)
-                    # process subgroups
-                    proc_group(item, emds)
+        # visit all objects below parent and retrieve groups with emd_group_type set to 1
+        def proc_item(name, item):
+            if isinstance(item, h5py._hl.group.Group):
+                if 'emd_group_type' in item.attrs:
+                    if item.attrs['emd_group_type'] == 1:
+                        emds.append(item)
         
         # run
-        proc_group(parent, emds)
+        parent.visititems(proc_item)
         
         return emds
 
 
-    def get_emdgroup(self, group):
+    def get_emdgroup(self, group, orient=True, lazy=False):
         '''Get the emdtype data saved in in group.
         
         input:
         - group         reference to the HDF5 group
+        - orient (bool) True to apply axis_order and flip attributes of the group, see orient_emdgroup
+        - lazy (bool)   True to return the HDF5 dataset instead of reading it, slicing it reads only the selected part
         
         returns:
-        - data
+        - data          numpy array, HDF5 dataset for lazy or orientedDataset for lazy with orientation
+        - dims
         '''
         
         # check input
-        if not isinstance(group, h5py._hl.group.Group):
-            raise TypeError('group needs to refer to a valid HDF5 group!')
-            
-        if not 'emd_group_type' in group.attrs:
-            raise TypeError('group is not a emd_group_type group!')
-        if not group.attrs['emd_group_type'] == 1:
-            raise TypeError('group is not a emd_group_type group!')
+        self.check_emdgroup(group)
 
         # retrieve data
         try:
             # get the data
-            data = group['data'][:]
+            if lazy:
+                data = group['data']
+            else:
+                data = group['data'][:]
             
             # get the dims
-            dims = []
-            for i in range(len(data.shape)):
-                dim = group['dim{}'.format(i+1)]
-                # save them as (vector, name, units)
-                
-                if isinstance(dim.attrs['name'], np.ndarray):
-                    name = dim.attrs['name'][0]
-                else:
-                    name = dim.attrs['name']
-                
-                if isinstance(dim.attrs['units'], np.ndarray):
-                    units = dim.attrs['units'][0]
-                else:
-                    units = dim.attrs['units']
-                    
-                dims.append( (dim[:], name.decode('utf-8'), units.decode('utf-8')) )
+            dims = self.get_emddims(group, lazy=lazy)
             
-            dims = tuple(dims)
+            if orient:
+                data, dims = self.orient_emdgroup(group, data, dims)
             
             return data, dims
             
@@ -190,38 +895,255 @@ class fileEMD:
             
             return None
 
-    def write_dim(self, label, dim, parent):
+
+    def get_emdframe(self, group, index):
+        '''Get a single frame along the last axis of the emdtype data in group.
+        
+        The orientation recorded in the group is applied, see orient_emdgroup.
+        If the file has a cache, frames are kept there and returned read-only.
+        
+        input:
+        - group         reference to the HDF5 group
+        - index (int)   index along the last axis
+        
+        returns:
+        - frame         numpy array
+        '''
+        
+        # check input
+        self.check_emdgroup(group)
+        
+        if self.cache is not None:
+            key = self.cache_id + self.emd_key(group.name) + (int(index),)
+            frame = self.cache.get(key)
+            if frame is not None:
+                return frame
+        
+        data = group['data']
+        if 'axis_order' in group.attrs:
+            data = orientedDataset(data, group.attrs['axis_order'], group.attrs['flip'] if 'flip' in group.attrs else ())
+        
+        frame = np.asarray(data[..., int(index)])
+        
+        if self.cache is not None:
+            self.cache.put(key, frame, frame.nbytes)
+        
+        return frame
+    
+    
+    def read_into(self, group, out, index):
+        '''Read a single frame along the last axis of the emdtype data in group into out.
+        
+        Reading into the same buffer in a loop over many frames avoids allocating an array for each of them.
+        The data is converted to the dtype of out while reading.
+        For groups in native order, see orient_emdgroup, read through the orientedDataset of get_emdgroup with lazy to reuse its buffer as well.
+        
+        input:
+        - group         reference to the HDF5 group
+        - out           C contiguous numpy array of the frame shape to read into
+        - index (int)   index along the last axis
+        
+        returns:
+        - out
+        '''
+        
+        # check input
+        self.check_emdgroup(group)
+        
+        data = group['data']
+        if 'axis_order' in group.attrs:
+            data = orientedDataset(data, group.attrs['axis_order'], group.attrs['flip'] if 'flip' in group.attrs else ())
+            return data.read_into(out, index)
+        
+        if not isinstance(out, np.ndarray) or not out.shape == data.shape[:-1]:
+            raise TypeError('out needs to be a numpy array of shape {}'.format(data.shape[:-1]))
+        if not out.flags.c_contiguous or not out.flags.writeable:
+            raise TypeError('out needs to be C contiguous and writeable')
+        
+        i = int(index)
+        if i < 0:
+            i += data.shape[-1]
+        if i < 0 or i >= data.shape[-1]:
+            raise IndexError('Index {} out of range for axis {} of size {}'.format(index, len(data.shape)-1, data.shape[-1]))
+        
+        data.read_direct(out, np.s_[..., i])
+        
+        return out
+    
+    
+    def check_emdgroup(self, group):
+        '''Auxiliary function to check that group is an emd_group_type group, raises TypeError otherwise.'''
+        
+        if not isinstance(group, h5py._hl.group.Group):
+            raise TypeError('group needs to refer to a valid HDF5 group!')
+            
+        if not 'emd_group_type' in group.attrs:
+            raise TypeError('group is not a emd_group_type group!')
+        if not group.attrs['emd_group_type'] == 1:
+            raise TypeError('group is not a emd_group_type group!')
+
+
+    def orient_emdgroup(self, group, data, dims):
+        '''Apply the orientation recorded in the attributes of group to data and dims.
+        
+        Data written in stored order, e.g. by fileSER.writeEMD with native, carries the attributes
+        axis_order (data is transposed with it) and flip (axes reversed afterwards).
+        Only views are created, no data is copied. HDF5 datasets are wrapped in an orientedDataset.
+        
+        input:
+        - group         reference to the HDF5 group
+        - data          data as stored in group, numpy array or HDF5 dataset
+        - dims          dims as stored in group
+        
+        returns:
+        - data          oriented view of data
+        - dims          dims in the same order
+        '''
+        
+        if not 'axis_order' in group.attrs:
+            return data, dims
+        
+        axis_order = [int(i) for i in group.attrs['axis_order']]
+        flip = [int(i) for i in group.attrs['flip']] if 'flip' in group.attrs else []
+        
+        if isinstance(data, h5py._hl.dataset.Dataset):
+            data = orientedDataset(data, axis_order, flip)
+        else:
+            data = np.transpose(data, axis_order)
+            for i in flip:
+                data = np.flip(data, i)
+        
+        dims = [dims[i] for i in axis_order]
+        for i in flip:
+            dims[i] = (dims[i][0][::-1], dims[i][1], dims[i][2])
+        
+        return data, tuple(dims)
+
+
+    def get_emddims(self, group, lazy=False):
+        '''Get the dims of the emdtype data saved in group without reading the data.
+        
+        Linear dims, marked by offset and delta attributes, are computed instead of read.
+        
+        input:
+        - group         reference to the HDF5 group
+        - lazy (bool)   True to return linear dims as linearDim, expanded only when needed
+        
+        returns:
+        - dims          tuple of (vector, name, units) for each dimension
+        '''
+        
+        # check input
+        self.check_emdgroup(group)
+        
+        dims = []
+        for i in range(len(group['data'].shape)):
+            dim = group['dim{}'.format(i+1)]
+            # save them as (vector, name, units)
+            
+            if isinstance(dim.attrs['name'], np.ndarray):
+                name = dim.attrs['name'][0]
+            else:
+                name = dim.attrs['name']
+            
+            if isinstance(dim.attrs['units'], np.ndarray):
+                units = dim.attrs['units'][0]
+            else:
+                units = dim.attrs['units']
+                
+            if 'offset' in dim.attrs and 'delta' in dim.attrs:
+                vec = linearDim(dim.attrs['offset'], dim.attrs['delta'], dim.shape[0], dim.dtype)
+                if not lazy:
+                    vec = np.asarray(vec)
+            else:
+                vec = dim[:]
+            
+            dims.append( (vec, name.decode('utf-8'), units.decode('utf-8')) )
+        
+        return tuple(dims)
+
+
+    def write_dim(self, label, dim, parent, maxshape=None, chunks=None):
         '''Auxiliary function to write a dim dataset to parent.
         
         Input is not checked for sanity, so handle exceptions in call.
+        Linear dims get offset and delta attributes, so get_emddims computes them instead of reading them.
+        The vector is still written in full, readers not knowing the attributes, including older versions of this module 
+        and plain HDF5 viewers, rely on it. Marking linear dims saves reading them, not storage.
         
         input:
         - label (string)        label for dataset, usually dim1, dim2, dimN
         - dim                   tuple containing (data, name, units)
         - parent                HDF5 parent group
+        - maxshape              maximum shape of the dataset, (None,) for a resizable dim
+        - chunks                chunk shape of a resizable dim, guessed by h5py if None
         
         return:
         - dset                  HDF5 dataset handle referencing this dim
         '''
         
         try:
-            dset = parent.create_dataset(label, data=dim[0])
+            dset = parent.create_dataset(label, data=np.asarray(dim[0]), maxshape=maxshape, chunks=chunks)
             dset.attrs['name'] = np.string_(dim[1])
             dset.attrs['units'] = np.string_(dim[2])
+            
+            # resizable dims are appended to, so they are not marked linear
+            lin = linearDim.from_vector(dim[0]) if maxshape is None else None
+            if lin is not None:
+                dset.attrs['offset'] = lin.dtype.type(lin.offset)
+                dset.attrs['delta'] = lin.dtype.type(lin.delta)
         except:
             raise RuntimeError('Error during writing dim dataset')
         
         return dset
         
         
-    def put_emdgroup(self, label, data, dims, parent=None, overwrite=False):
-        '''Put an emdtype dataset into the EMD file
+    def new_emdgroup(self, label, parent=None, overwrite=False):
+        '''Auxiliary function to create an empty emdtype group, raises RuntimeError if it already exists and overwrite is not set.
+        
+        input:
+        - label (string)        label for the emdtype group
+        - parent                parent for the emdtype group, if None it will be created in /data
+        - overwrite (bool)      set to replace an existing group
+        
+        return:
+        - grp                   the new group
+        '''
+        
+        if not parent:
+            parent = self.data
+        
+        if label in parent:
+            if overwrite:
+                print('overwriting "{}" in "{}"'.format(label, parent.name))
+                self.remove_emdgroups(parent[label].name)
+                del parent[label]
+            else:
+                print('"{}" already exists in "{}"'.format(label, parent.name))
+                raise RuntimeError('"{}" already exists in "{}"'.format(label, parent.name))
+        
+        grp = parent.create_group(label)
+        
+        # add attribute
+        grp.attrs['emd_group_type'] = 1
+        
+        return grp
+    
+    
+    def create_emdgroup(self, label, shape, dtype, dims, parent=None, overwrite=False, chunks=None, compression=None, maxshape=None):
+        '''Create an emdtype group with an empty dataset in the EMD file.
+        
+        The data can be written afterwards using grp['data'], e.g. in batches too large to hold in memory.
         
         input:
         - label (string)        label for the emdtype group containing the dataset
-        - data                  numpy array of the data 
+        - shape                 shape of the dataset
+        - dtype                 datatype of the dataset
         - dims                  tuple containing the necessary dims as ((vec, name, units), (vec, name, units), ...)
         - parent                parent for the emdtype group, if None it will be written to /data
+        - chunks                chunk shape of the dataset, True for chunks of complete frames, None for contiguous storage
+        - compression           name of a preset in compression_presets or dict of create_dataset options, chunked by frames if chunks is None
+        - maxshape              maximum shape of the dataset, None along resizable axes, their dims are resizable as well
         
         return:
         - grp                   group referencing this emdtype dataset or None if failed
@@ -230,14 +1152,21 @@ class fileEMD:
         if not isinstance(label, str):
             raise TypeError('label needs to be string!')
         
-        if not isinstance(data, np.ndarray):
-            raise TypeError('data needs to be a numpy.ndarray!')
-            
+        filters = get_filters(compression, dtype)
+        if maxshape is not None and None in maxshape:
+            # resizable axes need chunks, frames are formed by the leading fixed axes
+            if chunks is None or chunks is True:
+                frame_ndim = list(maxshape).index(None)
+                chunks = frame_chunks([n if n else append_frames for n in maxshape], np.dtype(dtype).itemsize, frame_ndim=frame_ndim)
+        elif chunks is True or (chunks is None and filters):
+            chunks = frame_chunks(shape, np.dtype(dtype).itemsize)
+        
         try:
-            assert len(dims) == len(data.shape)
+            shape = tuple(shape)
+            assert len(dims) == len(shape)
             for i in range(len(dims)):
                 assert len(dims[i]) == 3
-                assert dims[i][0].shape[0] == data.shape[i]
+                assert dims[i][0].shape[0] == shape[i]
         except:
             raise TypeError('Something wrong with the provided dims')
         
@@ -245,39 +1174,20 @@ class fileEMD:
         
         # create group
         try:
-            if parent:
-                if label in parent:
-                    if overwrite:
-                        print('overwriting "{}" in "{}"'.format(label, parent.name))
-                        del parent[label]
-                    else:
-                        print('"{}" already exists in "{}"'.format(label, parent.name))
-                        raise RuntimeError('"{}" already exists in "{}"'.format(label, parent.name))
-                grp = parent.create_group(label)
-                
-            else:
-                if label in self.data:
-                    if overwrite:
-                        print('overwriting "{}" in "{}"'.format(label, self.data.name))
-                        del self.data[label]
-                    else:
-                        print('"{}" already exists in "{}"'.format(label, self.data.name))
-                        raise RuntimeError('"{}" already exists in "{}"'.format(label, self.data.name))
-
-                grp = self.data.create_group(label)
-                
-            # add attribute
-            grp.attrs['emd_group_type'] = 1
-               
+            grp = self.new_emdgroup(label, parent=parent, overwrite=overwrite)
+            
             # create dataset
-            dset = grp.create_dataset('data', data=data)
+            dset = grp.create_dataset('data', shape=shape, dtype=dtype, chunks=chunks, maxshape=maxshape, **filters)
              
             # create dim datasets
             for i in range(len(dims)):
-                self.write_dim('dim{}'.format(i+1), dims[i], grp)
+                if maxshape is not None and maxshape[i] is None:
+                    self.write_dim('dim{}'.format(i+1), dims[i], grp, maxshape=(None,), chunks=(dset.chunks[i],))
+                else:
+                    self.write_dim('dim{}'.format(i+1), dims[i], grp)
                     
             # update emds list
-            self.list_emds = self.find_emdgroups(self.file_hdl)
+            self.add_emdgroup(grp)
                     
             return grp
            
@@ -285,6 +1195,181 @@ class fileEMD:
             print('Something went wrong trying to write the dataset.')
                 
             return None
+        
+        
+    def put_emdgroup(self, label, data, dims, parent=None, overwrite=False, chunks=None, compression=None):
+        '''Put an emdtype dataset into the EMD file
+        
+        input:
+        - label (string)        label for the emdtype group containing the dataset
+        - data                  numpy array of the data 
+        - dims                  tuple containing the necessary dims as ((vec, name, units), (vec, name, units), ...)
+        - parent                parent for the emdtype group, if None it will be written to /data
+        - chunks                chunk shape of the dataset, True for chunks of complete frames, None for contiguous storage
+        - compression           name of a preset in compression_presets or dict of create_dataset options, chunked by frames if chunks is None
+        
+        return:
+        - grp                   group referencing this emdtype dataset or None if failed
+        '''
+        # check input
+        if not isinstance(data, np.ndarray):
+            raise TypeError('data needs to be a numpy.ndarray!')
+        
+        # create the group
+        grp = self.create_emdgroup(label, data.shape, data.dtype, dims, parent=parent, overwrite=overwrite, chunks=chunks, compression=compression)
+        if grp is None:
+            return None
+        
+        # write the data
+        try:
+            grp['data'][...] = data
+        except:
+            print('Something went wrong trying to write the dataset.')
+            
+            return None
+        
+        return grp
+
+
+    def put_virtual_emdgroup(self, label, groups, parent=None, overwrite=False):
+        '''Put an emdtype group stitching the data of several emdtype groups along their last axis without copying it.
+        
+        The data is an HDF5 virtual dataset referring to the data in groups, which can be in other files,
+        e.g. a series converted from several SER files. Other files are referred to relative to this one, so move them together.
+        The last dim and per frame dims like dim3_time are concatenated, the other dims are taken from the first group.
+        
+        input:
+        - label (string)        label for the emdtype group
+        - groups                list of emdtype groups to stitch, in order
+        - parent                parent for the emdtype group, if None it will be written to /data
+        - overwrite (bool)      set to replace an existing group
+        
+        return:
+        - grp                   group referencing the stitched data or None if failed
+        '''
+        # check input
+        if not isinstance(label, str):
+            raise TypeError('label needs to be string!')
+        
+        try:
+            groups = list(groups)
+            assert len(groups) > 0
+        except:
+            raise TypeError('groups needs to be a list of emdtype groups!')
+        
+        for group in groups:
+            self.check_emdgroup(group)
+            if 'axis_order' in group.attrs:
+                raise TypeError('"{}" is stored in native order and cannot be stitched'.format(group.name))
+        
+        first = groups[0]['data']
+        for group in groups[1:]:
+            if not group['data'].shape[:-1] == first.shape[:-1] or not group['data'].dtype == first.dtype:
+                raise TypeError('"{}" does not fit to "{}"'.format(group.name, groups[0].name))
+        
+        ndim = len(first.shape)
+        nums = [group['data'].shape[-1] for group in groups]
+        
+        # map the data of all groups
+        layout = h5py.VirtualLayout(shape=first.shape[:-1] + (sum(nums),), dtype=first.dtype)
+        here = os.path.abspath(self.file_hdl.filename)
+        start = 0
+        for i in range(len(groups)):
+            source = os.path.abspath(groups[i].file.filename)
+            if source == here:
+                source = '.'
+            else:
+                source = os.path.relpath(source, os.path.dirname(here))
+            
+            layout[..., start:start+nums[i]] = h5py.VirtualSource(source, groups[i]['data'].name, shape=groups[i]['data'].shape, dtype=first.dtype)
+            start += nums[i]
+        
+        # concatenate the last dim
+        dims = list(self.get_emddims(groups[0]))
+        dims[-1] = (np.concatenate([group['dim{}'.format(ndim)][:] for group in groups]), dims[-1][1], dims[-1][2])
+        
+        # per frame dims present in all groups
+        tags = []
+        for name in groups[0]:
+            if name.startswith('dim{}_'.format(ndim)):
+                if all(name in group and group[name].shape == (group['data'].shape[-1],) for group in groups):
+                    tags.append(name)
+        
+        try:
+            grp = self.new_emdgroup(label, parent=parent, overwrite=overwrite)
+            
+            grp.create_virtual_dataset('data', layout, fillvalue=0)
+            
+            for i in range(ndim):
+                self.write_dim('dim{}'.format(i+1), dims[i], grp)
+            
+            for name in tags:
+                tag = (np.concatenate([group[name][:] for group in groups]), groups[0][name].attrs['name'], groups[0][name].attrs['units'])
+                self.write_dim(name, tag, grp)
+            
+            # update emds list
+            self.add_emdgroup(grp)
+            
+            return grp
+        
+        except:
+            print('Something went wrong trying to write the dataset.')
+            
+            return None
+    
+    
+    def create_appendable(self, label, dtype, dims, parent=None, overwrite=False, chunks=None, compression=None):
+        '''Create an emdtype group growing along its last axis.
+        
+        The shape of a frame is given by the dims of the leading axes. The last dim holds the values of the appended axis, 
+        give it as an empty vector of the wanted dtype, e.g. (np.zeros(0, dtype=int), 'number', '[]').
+        
+        input:
+        - label (string)        label for the emdtype group containing the dataset
+        - dtype                 datatype of the dataset
+        - dims                  tuple containing the necessary dims as ((vec, name, units), (vec, name, units), ...)
+        - parent                parent for the emdtype group, if None it will be written to /data
+        - chunks                chunk shape of the dataset, up to append_frames complete frames along the last axis if None or True
+        - compression           name of a preset in compression_presets or dict of create_dataset options
+        
+        return:
+        - appendable            appendableGroup to append frames to or None if failed
+        '''
+        # check input
+        try:
+            shape = tuple(dim[0].shape[0] for dim in dims[:-1]) + (0,)
+            assert dims[-1][0].shape == (0,)
+        except:
+            raise TypeError('Something wrong with the provided dims')
+        
+        grp = self.create_emdgroup(label, shape, dtype, dims, parent=parent, overwrite=overwrite, chunks=chunks, compression=compression, maxshape=shape[:-1]+(None,))
+        if grp is None:
+            return None
+        
+        return appendableGroup(grp)
+
+
+    def get_storage(self, group):
+        '''Get the storage details of the data in an emdtype group.
+        
+        input:
+        - group         reference to the HDF5 group
+        
+        returns:
+        - storage       dict with nbytes, stored bytes, compression ratio, chunks and filters
+        '''
+        
+        # check input
+        self.check_emdgroup(group)
+        
+        dset = group['data']
+        stored = dset.id.get_storage_size()
+        
+        storage = {'nbytes': dset.nbytes, 'stored': stored, 'ratio': dset.nbytes/stored if stored > 0 else float('nan'), 
+                   'chunks': dset.chunks, 'compression': dset.compression, 'compression_opts': dset.compression_opts, 
+                   'shuffle': dset.shuffle, 'scaleoffset': dset.scaleoffset}
+        
+        return storage
 
 
     def put_comment(self, msg, timestamp=None):
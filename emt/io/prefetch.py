@@ -0,0 +1,224 @@
+'''
+This module provides an iterator reading frames ahead on a background thread.
+
+While the consumer is computing on one frame, the following frames are already read from disk.
+Works with SER files as well as emd groups in EMD files.
+'''
+
+import threading
+import queue
+import copy
+import numpy as np
+import h5py
+
+import emt.io.ser
+import emt.io.emd
+
+
+class framePrefetcher:
+    '''
+    Iterator over the frames of a fileSER or an emd group, reading up to depth frames ahead.
+
+    Frames of a fileSER are returned as by getDataset, frames of an emd group are slices along its last axis.
+    SER files are read through a file handle of their own, so the fileSER can still be used while iterating.
+    With reuse, frames are read into a fixed set of buffers instead of new arrays, a frame is then only valid until the next one is taken.
+    '''
+    
+    def __init__(self, source, indices=None, depth=4, batch=1, reuse=False):
+        '''Init the prefetcher, the background reader is started when iterating.
+
+        input:
+        - source        fileSER, emd group (HDF5 group), HDF5 dataset or orientedDataset to read frames from
+        - indices       sequence of frame indices to iterate over, all frames if None
+        - depth (int)   maximum number of frames read ahead
+        - batch (int)   number of frames read at once by the background thread
+        - reuse (bool)  True to read into buffers reused for following frames
+        '''
+
+        # check input
+        if isinstance(source, emt.io.ser.fileSER):
+            num = len(source)
+        elif isinstance(source, h5py._hl.group.Group):
+            if not 'data' in source:
+                raise TypeError('group is not a emd_group_type group!')
+            if 'axis_order' in source.attrs:
+                source = emt.io.emd.orientedDataset(source['data'], source.attrs['axis_order'], source.attrs['flip'] if 'flip' in source.attrs else ())
+            else:
+                source = source['data']
+            num = source.shape[-1]
+        elif isinstance(source, (h5py._hl.dataset.Dataset, emt.io.emd.orientedDataset)):
+            num = source.shape[-1]
+        else:
+            raise TypeError('source needs to be a fileSER or an emd group!')
+
+        if not isinstance(depth, int) or depth < 1:
+            raise ValueError('depth needs to be a positive integer!')
+        if not isinstance(batch, int) or batch < 1:
+            raise ValueError('batch needs to be a positive integer!')
+
+        if indices is None:
+            indices = range(num)
+        self.indices = [int(i) for i in indices]
+        for i in self.indices:
+            if i < 0 or i >= num:
+                raise IndexError('Index {} out of range for {} frames'.format(i, num))
+
+        # file position is not shared with other readers, the copy is closed with the prefetcher
+        self.own_source = None
+        if isinstance(source, emt.io.ser.fileSER) and source.memmap is None:
+            source = copy.copy(source)
+            source.file_hdl = open(source.file_hdl.name, 'rb')
+            self.own_source = source
+
+        self.source = source
+        self.depth = depth
+        self.batch = batch
+        
+        # frames handed out, queued and being read must not share a buffer
+        self.pool = None
+        if reuse and len(self.indices) > 0:
+            if isinstance(source, emt.io.ser.fileSER):
+                first = source.getDataset(self.indices[0])[0]
+                frame_shape, dtype = first.shape, first.dtype
+            else:
+                frame_shape, dtype = source.shape[:-1], source.dtype
+            slots = batch*(-(-(depth+1+batch)//batch))
+            self.pool = np.empty((slots,) + tuple(frame_shape), dtype=dtype)
+            self.slot = 0
+
+        # bounded queue blocks the reader when it is depth frames ahead
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+
+        # started by __iter__, so a prefetcher never iterated holds no thread keeping it alive
+        self.thread = None
+
+
+    def __del__(self):
+        '''Stop the background reader on del.'''
+        self.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Stop the background reader when leaving the with block.'''
+        self.close()
+
+
+    def read(self, indices):
+        '''Read a batch of frames from the source.
+
+        input:
+        - indices       list of frame indices
+
+        return:
+        - frames        list of frames
+        '''
+        
+        if self.pool is not None:
+            # batches fill consecutive buffers
+            frames = self.pool[self.slot:self.slot+len(indices)]
+            self.slot = (self.slot + self.batch) % self.pool.shape[0]
+            
+            if isinstance(self.source, emt.io.ser.fileSER):
+                self.source.getDatasets(indices, out=frames)
+            elif isinstance(self.source, emt.io.emd.orientedDataset):
+                for i in range(len(indices)):
+                    self.source.read_into(frames[i], indices[i])
+            else:
+                for i in range(len(indices)):
+                    self.source.read_direct(frames[i], np.s_[..., indices[i]])
+            return list(frames)
+        
+        if isinstance(self.source, emt.io.ser.fileSER):
+            if len(indices) == 1:
+                return [self.source.getDataset(indices[0])[0]]
+            else:
+                return list(self.source.getDatasets(indices))
+        else:
+            # contiguous run read as one slab
+            if indices[-1] - indices[0] == len(indices) - 1:
+                slab = self.source[..., indices[0]:indices[-1]+1]
+                return [slab[..., i] for i in range(len(indices))]
+            else:
+                return [self.source[..., i] for i in indices]
+
+
+    def put(self, item):
+        '''Put an item into the queue, giving up when stopped.
+
+        return:
+        - success (bool)        False if the prefetcher was stopped
+        '''
+
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+    def reader(self):
+        '''Background thread reading frames into the queue.'''
+
+        # the end of the frames or the error is always handed to the consumer, unless it stopped the reader
+        item = None
+        try:
+            for start in range(0, len(self.indices), self.batch):
+                indices = self.indices[start:start+self.batch]
+                frames = self.read(indices)
+                for i in range(len(indices)):
+                    if not self.put( (indices[i], frames[i]) ):
+                        return
+        except BaseException as e:
+            item = e
+        finally:
+            self.put(item)
+
+
+    def __iter__(self):
+        '''Yield (index, frame) tuples in order of indices.
+
+        The prefetcher is stopped when the iteration ends or is abandoned, it can be iterated only once.
+        '''
+
+        if self.thread is not None or self.stop.is_set():
+            raise RuntimeError('framePrefetcher can be iterated only once')
+
+        self.thread = threading.Thread(target=self.reader, name='framePrefetcher', daemon=True)
+        self.thread.start()
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+
+    def __len__(self):
+        '''Number of frames to iterate over.'''
+        return len(self.indices)
+
+
+    def close(self):
+        '''Stop the background reader, wait for it and close the file handle opened for it.'''
+
+        if hasattr(self, 'stop'):
+            self.stop.set()
+        if getattr(self, 'thread', None) is not None:
+            if threading.current_thread() is not self.thread and self.thread.is_alive():
+                self.thread.join()
+
+        if getattr(self, 'own_source', None) is not None:
+            self.own_source.close()
+            self.own_source = None
@@ -7,15 +7,175 @@ import numpy as np
 import h5py
 import os
 import re
+import glob
 import xml.etree.ElementTree as ET
 import datetime
+import copy
+import threading
+import concurrent.futures
+import collections
+import itertools
+import mmap
+import time
 import emt.io.emd
 
+# EMI metadata parsed with cache enabled, keyed by (path, size, modification time)
+# only the emi_cache_size most recently used files are kept, so scans of large trees do not collect all of them
+emi_cache = collections.OrderedDict()
+emi_cache_size = 64
+emi_cache_lock = threading.Lock()
+
+
 class NotSERError(Exception):
     '''Exception if a file is not in SER file format'''
     pass
 
 
+def probe(filename, verbose=False, element=False):
+    '''Read only the fixed header and dimensions of a SER file.
+    
+    Much faster than opening a fileSER for large series, as the offset arrays are skipped.
+    
+    input:
+    - filename (string)     name of the SER file
+    - verbose (bool)        True to get extensive output while reading the file
+    - element (bool)        True to add DataType and ArrayShape of the first dataset to the header
+    
+    return:
+    - head                  the header of the SER file as dict, without offset arrays
+    '''
+    
+    # the file is closed right away
+    with fileSER(filename, verbose=verbose, probe=True) as fser:
+        head = fser.head
+        
+        # layout of the first dataset, only its offset is read
+        if element and head['ValidNumberElements'] > 0:
+            if head['SeriesVersion'] == 0x0210:
+                offset_dtype = '<i4'
+            else:
+                offset_dtype = '<i8'
+            fser.file_hdl.seek(head['OffsetArrayOffset'], 0)
+            head['DataOffsetArray'] = np.fromfile(fser.file_hdl, dtype=offset_dtype, count=1).astype('i8')
+            rec_dtype = fser.getElementDtype(0)
+            del head['DataOffsetArray']
+            
+            head['DataType'] = rec_dtype['data'].base.str
+            head['ArrayShape'] = list(rec_dtype['data'].shape)
+    
+    return head
+
+
+def findEMI(filename):
+    '''Find the EMI file belonging to a SER file.
+    
+    TIA names the SER files of an acquisition "name_1.ser", "name_2.ser", ... next to "name.emi".
+    
+    input:
+    - filename (string)     name of the SER file
+    
+    return:
+    - emifile               name of the EMI file or None, if not found
+    '''
+    
+    matchObj = re.match('(.+)_[0-9]+\\.ser$', filename, flags=re.IGNORECASE)
+    if matchObj:
+        for ext in ('.emi', '.EMI'):
+            if os.path.isfile(matchObj.group(1)+ext):
+                return matchObj.group(1)+ext
+    
+    return None
+
+
+def findSER(paths, recursive=False):
+    '''Find SER files given as file names, glob patterns or directories.
+
+    input:
+    - paths                 file name, glob pattern or directory, or list of them
+    - recursive (bool)      True to search directories and ** patterns recursively
+
+    return:
+    - filenames             sorted list of SER files without duplicates
+    '''
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                pattern = os.path.join(path, '**', '*')
+            else:
+                pattern = os.path.join(path, '*')
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(path, recursive=recursive)
+
+        for candidate in candidates:
+            if os.path.isfile(candidate) and candidate.lower().endswith('.ser'):
+                filenames.add(os.path.normpath(candidate))
+
+    return sorted(filenames)
+
+
+def convertSER(filename, output, emifile=None, overwrite=False, **kwargs):
+    '''Convert a SER file to an EMD file, unless the EMD file is up to date.
+
+    The EMI file is found by findEMI, if not given. The EMD file is written under a temporary name and renamed when complete,
+    so it is up to date if it is newer than the SER and EMI files.
+    Meant to be run in worker processes, errors are returned instead of raised.
+
+    input:
+    - filename (string)     name of the SER file
+    - output (string)       name of the EMD file
+    - emifile (string)      name of the EMI file
+    - overwrite (bool)      True to convert even if the EMD file is up to date
+    - kwargs                passed on to writeEMD
+
+    return:
+    - result                dict with filename, output, status ('converted', 'skipped' or 'failed'), nbytes, seconds and error
+    '''
+
+    result = {'filename': filename, 'output': output, 'status': 'failed', 'nbytes': 0, 'seconds': 0.0, 'error': None}
+    t0 = time.perf_counter()
+
+    try:
+        if emifile is None:
+            emifile = findEMI(filename)
+
+        # check whether up to date
+        sources = [filename] + ([emifile] if emifile else [])
+        if not overwrite and os.path.isfile(output):
+            if os.path.getmtime(output) >= max(os.path.getmtime(source) for source in sources):
+                result['status'] = 'skipped'
+                return result
+
+        tmpname = output + '.tmp'
+        if os.path.isfile(tmpname):
+            os.remove(tmpname)
+
+        with fileSER(filename, emifile=emifile) as fser:
+            fser.writeEMD(tmpname, **kwargs)
+
+        os.replace(tmpname, output)
+
+        result['nbytes'] = os.path.getsize(filename)
+        result['status'] = 'converted'
+
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        
+        # do not leave partial files
+        if os.path.isfile(output + '.tmp'):
+            os.remove(output + '.tmp')
+
+    finally:
+        result['seconds'] = time.perf_counter()-t0
+
+    return result
+
+
 class fileSER:
     '''
     Class to represent SER files (read only).
@@ -26,17 +186,31 @@ class fileSER:
     dictDataTypeID = {0x4120:'1D spectra', 0x4122:'2D images'}
     dictTagTypeID = {0x4152:'time only',0x4142:'time and 2D position'}
     dictDataType = {1:'<u1', 2:'<u2', 3:'<u4', 4:'<i1', 5:'<i2', 6:'<i4', 7:'<f4', 8:'<f8', 9:'<c8', 10:'<c16'}
+    # layout of the element header in front of each dataset, depends on DataTypeID
+    dictElementHeader = {0x4120: np.dtype([('CalibrationOffset', '<f8'), ('CalibrationDelta', '<f8'), ('CalibrationElement', '<i4'),
+                                           ('DataType', '<i2'), ('ArrayLength', '<i4')]),
+                         0x4122: np.dtype([('CalibrationOffsetX', '<f8'), ('CalibrationDeltaX', '<f8'), ('CalibrationElementX', '<i4'),
+                                           ('CalibrationOffsetY', '<f8'), ('CalibrationDeltaY', '<f8'), ('CalibrationElementY', '<i4'),
+                                           ('DataType', '<i2'), ('ArraySizeX', '<i4'), ('ArraySizeY', '<i4')])}
+    # layout of a tag, depends on TagTypeID
+    dictTag = {0x4152: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4')]),
+               0x4142: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4'), ('PositionX', '<f8'), ('PositionY', '<f8')])}
 
-    def __init__(self, filename, emifile=None, verbose=False):
+    def __init__(self, filename, emifile=None, verbose=False, memmap=False, probe=False, cache=None):
         '''Init opening the file and reading in the header.
         
         input:
         - filename (string)     name of the SER file
         - verbose (bool)        True to get extensive output while reading the file
+        - memmap (bool)         True to map the file into memory, datasets are then returned as read-only views into the mapping
+        - probe (bool)          True to read only the fixed header and dimensions, datasets cannot be accessed then
+        - cache                 emt.io.cache.frameCache keeping datasets read by getDataset, they are returned read-only then
         '''
         # necessary declarations, if something fails
         self.file_hdl = None
         self.emi = None
+        self.memmap = None
+        self.cache = cache
 
         # check for string
         if not isinstance(filename, str):
@@ -51,8 +225,15 @@ class fileSER:
         except :
             raise
 
+        # cached datasets belong to this version of the file, a file rewritten at the same path gets new keys
+        self.cache_id = (os.path.abspath(filename), os.fstat(self.file_hdl.fileno()).st_mtime_ns)
+
         # read header
-        self.head = self.readHeader(verbose)
+        self.head = self.readHeader(verbose, offsets=not probe)
+        
+        # map the file, if requested
+        if memmap and not probe:
+            self.memmap = np.memmap(self.file_hdl, dtype='u1', mode='r')
         
         # read emi, if provided
         if emifile:
@@ -61,17 +242,37 @@ class fileSER:
 
     def __del__(self):
         '''Closing the file stream on del.'''
+        self.close()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''Close the file when leaving the with block.'''
+        self.close()
+    
+    
+    def close(self):
+        '''Close the file stream, datasets can no longer be read.'''
+        
+        # release the mapping, views handed out keep it alive as long as needed
+        self.memmap = None
+        
         # close the file
         if(self.file_hdl):
             self.file_hdl.close()
+        self.file_hdl = None
 
 
-    def readHeader(self, verbose=False):
+    def readHeader(self, verbose=False, offsets=True):
         '''
         Read and return the SER files header.
         
         input:
         - verbose (bool)        True to get extensive output while reading the file
+        - offsets (bool)        False to skip reading the offset arrays
 
         returns:
         - head		the header of the SER file as dict
@@ -116,8 +317,8 @@ class fileSER:
         data = np.fromfile(self.file_hdl, dtype='<i4', count=4)
 
         # DataTypeID
-        if not data[0] == 0x4122:
-            raise RuntimeError('Only 2D images implemented so far')
+        if not data[0] in self.dictDataTypeID:
+            raise RuntimeError('Unknown DataTypeID: "{:#06x}"'.format(data[0]))
         head['DataTypeID'] = data[0]
         if verbose:
             print('DataTypeID:\t"{:#06x}",\t{}'.format(data[0], self.dictDataTypeID[data[0]]))
@@ -218,18 +419,24 @@ class fileSER:
         head['Dimensions'] = tuple(dimensions)
         
         
-        # Offset array
+        # stop here if only probing
+        if not offsets:
+            return head
+        
+        # Offset arrays, each holding TotalNumberElements entries of which the first ValidNumberElements are used
         self.file_hdl.seek(head['OffsetArrayOffset'],0)
+        data = np.fromfile(self.file_hdl, dtype=offset_dtype, count=2*head['TotalNumberElements'])
+        if not data.shape[0] == 2*head['TotalNumberElements']:
+            raise RuntimeError('Could not read offset arrays')
+        data = data.astype('i8')
         
         # DataOffsetArray
-        data = np.fromfile(self.file_hdl, dtype=offset_dtype, count=head['ValidNumberElements'])
-        head['DataOffsetArray'] = data.tolist()
+        head['DataOffsetArray'] = data[:head['ValidNumberElements']]
         if verbose:
             print('reading in DataOffsetArray')
         
         # TagOffsetArray
-        data = np.fromfile(self.file_hdl, dtype=offset_dtype, count=head['ValidNumberElements'])
-        head['TagOffsetArray'] = data.tolist()
+        head['TagOffsetArray'] = data[head['TotalNumberElements']:head['TotalNumberElements']+head['ValidNumberElements']]
         if verbose:
             print('reading in TagOffsetArray')     
 
@@ -244,8 +451,12 @@ class fileSER:
         - i(int)        index
         '''
         
+        # check for offsets
+        if not 'DataOffsetArray' in self.head:
+            raise RuntimeError('Offset arrays not read, file was opened for probing only')
+        
         # check type
-        if not isinstance(i, int):
+        if not isinstance(i, (int, np.integer)):
             raise TypeError('index supposed to be integer')
 
         # check whether in range
@@ -275,7 +486,19 @@ class fileSER:
 
         if verbose:
             print('Getting dataset {} of {}.'.format(index, self.head['ValidNumberElements']))
-            
+        
+        # decode from the mapping, if available
+        if self.memmap is not None:
+            return self.getDatasetMemmap(index, verbose)
+        
+        # read before
+        if self.cache is not None:
+            key = self.cache_id + (int(index),)
+            item = self.cache.get(key)
+            if item is not None:
+                # the dataset is read-only, the meta data is copied for each caller
+                return item[0], copy.deepcopy(item[1])
+
         # go to dataset in file
         self.file_hdl.seek(self.head['DataOffsetArray'][index],0)
         
@@ -331,9 +554,8 @@ class fileSER:
         if verbose:
             print('DataType:\t{},\t{}'.format(data[0],self.dictDataType[data[0]]))
         
-        data = np.fromfile(self.file_hdl, dtype='<i4', count=2)
-        
-        # ArrayShape
+        # ArrayShape, ArrayLength for 1D and ArraySizeX, ArraySizeY for 2D
+        data = np.fromfile(self.file_hdl, dtype='<i4', count=n)
         data = data.tolist()
         meta['ArrayShape'] = data
         if verbose:
@@ -350,15 +572,355 @@ class fileSER:
         #    print('ArraySizeY:\t{}'.format(data[1]))
             
         # dataset
-        dataset = np.fromfile(self.file_hdl, dtype=self.dictDataType[meta['DataType']], count=meta['ArrayShape'][0]*meta['ArrayShape'][1])
+        dataset = np.fromfile(self.file_hdl, dtype=self.dictDataType[meta['DataType']], count=int(np.prod(meta['ArrayShape'])))
         dataset = dataset.reshape(meta['ArrayShape'])
         
         if self.head['DataTypeID'] == 0x4122:
             dataset = np.flipud(dataset)
+        
+        if self.cache is not None:
+            self.cache.put(key, (dataset, copy.deepcopy(meta)), dataset.nbytes)
+        
+        return dataset, meta
 
+
+    def getDatasetMemmap(self, index, verbose=False):
+        '''Retrieve dataset from the memory mapped data file.
+        
+        Element header and dataset are decoded from the mapping without copying.
+        Index is not checked, use getDataset.
+        
+        input:
+        - index (int)   index of dataset
+        - verbose (bool)        True to get extensive output while reading the file
+        
+        returns:
+        - dataset	dataset as read-only view into the mapping
+        - meta          metadata as dict
+        '''
+        
+        # number of calibrations depends on DataTypeID
+        if not self.head['DataTypeID'] in self.dictElementHeader:
+            raise RuntimeError('Unknown DataTypeID')
+        
+        # element header at the offset of this dataset
+        offset = self.head['DataOffsetArray'][index]
+        hdr = np.ndarray((), dtype=self.dictElementHeader[self.head['DataTypeID']], buffer=self.memmap, offset=offset)
+        
+        # read meta
+        meta = {}
+        
+        # calibrations
+        if self.head['DataTypeID'] == 0x4120:
+            axes = ('',)
+        else:
+            axes = ('X', 'Y')
+        cals = []
+        for ax in axes:
+            this_cal = {}
+            this_cal['CalibrationOffset'] = hdr['CalibrationOffset'+ax][()]
+            this_cal['CalibrationDelta'] = hdr['CalibrationDelta'+ax][()]
+            this_cal['CalibrationElement'] = hdr['CalibrationElement'+ax][()]
+            if verbose:
+                print('Calibration{}:\t{}'.format(ax, this_cal))
+            cals.append(this_cal)
+        meta['Calibration'] = tuple(cals)
+        
+        # DataType
+        meta['DataType'] = hdr['DataType'][()]
+        if not meta['DataType'] in self.dictDataType:
+            raise RuntimeError('Unknown DataType: "{}"'.format(meta['DataType']))
+        if verbose:
+            print('DataType:\t{},\t{}'.format(meta['DataType'],self.dictDataType[meta['DataType']]))
+        
+        # ArrayShape
+        if self.head['DataTypeID'] == 0x4120:
+            meta['ArrayShape'] = [int(hdr['ArrayLength'])]
+        else:
+            meta['ArrayShape'] = [int(hdr['ArraySizeX']), int(hdr['ArraySizeY'])]
+        if verbose:
+            print('ArrayShape:\t{}'.format(meta['ArrayShape']))
+        
+        # dataset as view into the mapping
+        dataset = np.ndarray(meta['ArrayShape'], dtype=self.dictDataType[meta['DataType']], buffer=self.memmap, offset=offset+hdr.itemsize)
+        
+        if self.head['DataTypeID'] == 0x4122:
+            dataset = np.flipud(dataset)
+        
         return dataset, meta
 
 
+    def getElementDtype(self, index=0):
+        '''Get the layout of a data element as structured dtype.
+        
+        The layout is read from the element header of dataset index.
+        
+        input:
+        - index (int)   index of dataset
+        
+        returns:
+        - dtype         structured dtype with fields head (element header) and data (dataset as stored)
+        '''
+        
+        # check index, will raise Exceptions if not
+        self.checkIndex(index)
+        
+        if not self.head['DataTypeID'] in self.dictElementHeader:
+            raise RuntimeError('Unknown DataTypeID')
+        hdr_dtype = self.dictElementHeader[self.head['DataTypeID']]
+        
+        # read the element header
+        offset = self.head['DataOffsetArray'][index]
+        if self.memmap is not None:
+            hdr = np.ndarray((), dtype=hdr_dtype, buffer=self.memmap, offset=offset)[()]
+        else:
+            self.file_hdl.seek(offset, 0)
+            hdr = np.fromfile(self.file_hdl, dtype=hdr_dtype, count=1)
+            if not hdr.shape[0] == 1:
+                raise RuntimeError('Could not read element header of dataset {}'.format(index))
+            hdr = hdr[0]
+        
+        if not hdr['DataType'] in self.dictDataType:
+            raise RuntimeError('Unknown DataType: "{}"'.format(hdr['DataType']))
+        
+        if self.head['DataTypeID'] == 0x4120:
+            shape = (int(hdr['ArrayLength']),)
+        else:
+            shape = (int(hdr['ArraySizeX']), int(hdr['ArraySizeY']))
+        
+        return np.dtype([('head', hdr_dtype), ('data', self.dictDataType[hdr['DataType']], shape)])
+        
+        
+    def getDatasets(self, indices, verbose=False, maxgap=1048576, maxread=67108864, out=None, native=False):
+        '''Retrieve several datasets from data file into one preallocated array.
+        
+        Datasets are read in the order of their position in the file. 
+        Neighbouring datasets are merged into single sequential reads, gaps of up to maxgap bytes between them are read and skipped.
+        All datasets are expected to share shape and type with the first one requested.
+        
+        input:
+        - indices       sequence of dataset indices
+        - verbose (bool)        True to get extensive output while reading the file
+        - maxgap (int)  maximum number of bytes to skip within a merged read
+        - maxread (int) maximum number of bytes in a merged read
+        - out           array of shape (len(indices), ...) to read into, may be a view, e.g. a transposed buffer
+        - native (bool) True to keep 2D datasets in the order stored in the file, without flipping them
+        
+        returns:
+        - datasets      array of shape (len(indices), ...), datasets in order of indices as returned by getDataset
+        '''
+        
+        # check indices
+        indices = np.asarray(indices)
+        if indices.ndim != 1 or (indices.size > 0 and not np.issubdtype(indices.dtype, np.integer)):
+            raise TypeError('indices supposed to be a sequence of integers')
+        indices = indices.astype('i8')
+        if np.any(indices < 0) or np.any(indices >= self.head['ValidNumberElements']):
+            raise IndexError('Index out of range, trying to access elements outside of {} valid elements'.format(self.head['ValidNumberElements']))
+        
+        # layout from first requested element
+        if indices.size > 0:
+            rec_dtype = self.getElementDtype(indices[0])
+        elif self.head['ValidNumberElements'] > 0:
+            rec_dtype = self.getElementDtype(0)
+        else:
+            return np.zeros((0,))
+        data_dtype, shape = rec_dtype['data'].subdtype
+        
+        # output buffer
+        if out is None:
+            datasets = np.empty((indices.size,)+shape, dtype=data_dtype)
+        else:
+            if not out.shape == (indices.size,)+shape:
+                raise TypeError('out needs to be of shape {}'.format((indices.size,)+shape))
+            datasets = out
+        
+        # sort by position in file
+        offsets = self.head['DataOffsetArray'][indices]
+        order = np.argsort(offsets, kind='stable')
+        offsets = offsets[order]
+        
+        # fields to check for consistency
+        expected = {'DataType': [k for k in self.dictDataType if np.dtype(self.dictDataType[k]) == data_dtype][0]}
+        if self.head['DataTypeID'] == 0x4120:
+            expected['ArrayLength'] = shape[0]
+        else:
+            expected['ArraySizeX'], expected['ArraySizeY'] = shape
+        
+        # merge into runs with constant stride
+        start = 0
+        while start < indices.size:
+            stop = start+1
+            stride = rec_dtype.itemsize
+            if stop < indices.size:
+                d = offsets[stop]-offsets[start]
+                if d >= rec_dtype.itemsize and d-rec_dtype.itemsize <= maxgap:
+                    stride = d
+                    while stop < indices.size and offsets[stop]-offsets[stop-1] == stride and (stop-start)*stride+rec_dtype.itemsize <= maxread:
+                        stop += 1
+            
+            n = stop-start
+            if verbose:
+                print('Reading {} datasets starting at offset {}.'.format(n, offsets[start]))
+            
+            # view the run as records
+            if self.memmap is not None:
+                recs = np.ndarray((n,), dtype=rec_dtype, buffer=self.memmap, offset=offsets[start], strides=(stride,))
+            else:
+                count = (n-1)*stride + rec_dtype.itemsize
+                self.file_hdl.seek(offsets[start], 0)
+                buf = np.fromfile(self.file_hdl, dtype='u1', count=count)
+                if not buf.shape[0] == count:
+                    raise RuntimeError('Unexpected end of file reading datasets at offset {}'.format(offsets[start]))
+                recs = np.ndarray((n,), dtype=rec_dtype, buffer=buf, strides=(stride,))
+            
+            for name in expected:
+                if not np.all(recs['head'][name] == expected[name]):
+                    raise RuntimeError('Datasets differ in shape or type, cannot read them into one array')
+            
+            # copy into output
+            if self.head['DataTypeID'] == 0x4122 and not native:
+                datasets[order[start:stop]] = recs['data'][:,::-1,:]
+            else:
+                datasets[order[start:stop]] = recs['data']
+            
+            start = stop
+        
+        return datasets
+        
+        
+    def __len__(self):
+        '''Number of valid datasets.'''
+        return int(self.head['ValidNumberElements'])
+        
+        
+    def __getitem__(self, key):
+        '''Retrieve datasets by index, slice or sequence of indices.
+        
+        A single index returns the dataset as getDataset, slices and sequences return an array as getDatasets.
+        '''
+        
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.head['ValidNumberElements']
+            return self.getDataset(key)[0]
+        elif isinstance(key, slice):
+            return self.getDatasets(range(*key.indices(self.head['ValidNumberElements'])))
+        else:
+            return self.getDatasets(key)
+
+
+    def refresh(self, verbose=False):
+        '''Check for elements written since the header was read, e.g. while TIA is still acquiring.
+
+        Only ValidNumberElements and the new entries of the offset arrays are read.
+        Elements are only taken as valid, once their offsets are written and their tag, which follows the data, is completely inside the file.
+
+        input:
+        - verbose (bool)        True to get extensive output while reading the file
+
+        returns:
+        - n (int)               number of new valid elements
+        '''
+
+        # check for offsets
+        if not 'DataOffsetArray' in self.head:
+            raise RuntimeError('Offset arrays not read, file was opened for probing only')
+
+        if self.head['SeriesVersion'] == 0x0210:
+            offset_dtype = np.dtype('<i4')
+        else:
+            offset_dtype = np.dtype('<i8')
+
+        # ValidNumberElements follows ByteOrder, SeriesID, SeriesVersion, DataTypeID, TagTypeID and TotalNumberElements
+        self.file_hdl.seek(18, 0)
+        valid = int(np.fromfile(self.file_hdl, dtype='<i4', count=1)[0])
+
+        old = int(self.head['ValidNumberElements'])
+        if valid <= old:
+            return 0
+
+        # read only the new entries of both offset arrays
+        total = int(self.head['TotalNumberElements'])
+        self.file_hdl.seek(self.head['OffsetArrayOffset'] + old*offset_dtype.itemsize, 0)
+        data_offsets = np.fromfile(self.file_hdl, dtype=offset_dtype, count=valid-old).astype('i8')
+        self.file_hdl.seek(self.head['OffsetArrayOffset'] + (total+old)*offset_dtype.itemsize, 0)
+        tag_offsets = np.fromfile(self.file_hdl, dtype=offset_dtype, count=valid-old).astype('i8')
+
+        # accept elements up to the first one not completely written
+        size = os.fstat(self.file_hdl.fileno()).st_size
+        tag_size = self.dictTag[self.head['TagTypeID']].itemsize
+        n = min(data_offsets.shape[0], tag_offsets.shape[0])
+        for i in range(n):
+            if data_offsets[i] <= 0 or tag_offsets[i] <= 0 or tag_offsets[i] + tag_size > size:
+                n = i
+                break
+        if n == 0:
+            return 0
+
+        self.head['DataOffsetArray'] = np.concatenate((self.head['DataOffsetArray'], data_offsets[:n]))
+        self.head['TagOffsetArray'] = np.concatenate((self.head['TagOffsetArray'], tag_offsets[:n]))
+        self.head['ValidNumberElements'] = np.int32(old+n)
+
+        # remap the grown file
+        if self.memmap is not None:
+            self.memmap = np.memmap(self.file_hdl, dtype='u1', mode='r')
+
+        if verbose:
+            print('Found {} new elements, {} of {} valid.'.format(n, old+n, total))
+
+        return n
+
+
+    def follow(self, start=None, interval=1.0, timeout=None, verbose=False):
+        '''Yield datasets as they are written to a SER file still being acquired.
+
+        Iteration stops when all TotalNumberElements are valid or no new element appeared within timeout.
+
+        input:
+        - start (int)           index of first dataset to yield, None for only new ones
+        - interval (float)      seconds to wait between checks for new elements
+        - timeout (float)       seconds without new elements to stop after, None to wait until complete
+        - verbose (bool)        True to get extensive output while reading the file
+
+        yields:
+        - (index, dataset)      index and dataset as by getDataset
+        '''
+
+        if start is None:
+            start = int(self.head['ValidNumberElements'])
+
+        index = start
+        last = time.monotonic()
+        while True:
+            # hand out all valid ones
+            while index < self.head['ValidNumberElements']:
+                yield index, self.getDataset(index, verbose)[0]
+                index += 1
+                last = time.monotonic()
+
+            if index >= self.head['TotalNumberElements']:
+                return
+
+            # wait for new ones
+            if self.refresh(verbose) == 0:
+                if timeout is not None and time.monotonic() - last > timeout:
+                    return
+                time.sleep(interval)
+
+
+    def as_array(self):
+        '''Get a lazy array view of the datasets, laid out as written by writeEMD.
+        
+        Slicing the view reads only the selected datasets and rows, e.g. arr[100:400, 100:400, ::10].
+        
+        returns:
+        - arr           serArray with shape, dtype and __getitem__
+        '''
+        
+        return serArray(self)
+
+
     def getTag(self, index, verbose=False):
         '''Retrieve tag from data file.
 
@@ -414,6 +976,80 @@ class fileSER:
         return tag
         
     
+    def getTags(self, indices=None, verbose=False, maxgap=4096):
+        '''Retrieve tags of several datasets from data file at once.
+        
+        If the tags are regularly spaced in the file, they are decoded from a single read (or a strided view into the mapping).
+        Otherwise each tag is read separately.
+        
+        input:
+        - indices       sequence of tag indices, None for all valid tags
+        - verbose (bool)        True to get extensive output while reading the file
+        - maxgap (int)  maximum number of bytes between regularly spaced tags to read them at once
+        
+        returns:
+        - tags          dict of arrays as keys of getTag, in order of indices
+        '''
+        
+        # check indices
+        if indices is None:
+            indices = np.arange(self.head['ValidNumberElements'])
+        indices = np.asarray(indices)
+        if indices.ndim != 1 or (indices.size > 0 and not np.issubdtype(indices.dtype, np.integer)):
+            raise TypeError('indices supposed to be a sequence of integers')
+        indices = indices.astype('i8')
+        if np.any(indices < 0) or np.any(indices >= self.head['ValidNumberElements']):
+            raise IndexError('Index out of range, trying to access elements outside of {} valid elements'.format(self.head['ValidNumberElements']))
+        
+        tag_dtype = self.dictTag[self.head['TagTypeID']]
+        offsets = self.head['TagOffsetArray'][indices]
+        
+        # check for regular spacing
+        stride = None
+        if indices.size > 1:
+            d = np.diff(offsets)
+            if d[0] >= tag_dtype.itemsize and np.all(d == d[0]):
+                stride = d[0]
+        elif indices.size == 1:
+            stride = tag_dtype.itemsize
+        
+        if not stride is None and self.memmap is not None:
+            if verbose:
+                print('Decoding {} tags from mapping with stride {}.'.format(indices.size, stride))
+            recs = np.ndarray((indices.size,), dtype=tag_dtype, buffer=self.memmap, offset=offsets[0], strides=(stride,))
+        
+        elif not stride is None and stride-tag_dtype.itemsize <= maxgap:
+            if verbose:
+                print('Reading {} tags at once with stride {}.'.format(indices.size, stride))
+            count = (indices.size-1)*stride + tag_dtype.itemsize
+            self.file_hdl.seek(offsets[0], 0)
+            buf = np.fromfile(self.file_hdl, dtype='u1', count=count)
+            if not buf.shape[0] == count:
+                raise RuntimeError('Unexpected end of file reading tags at offset {}'.format(offsets[0]))
+            recs = np.ndarray((indices.size,), dtype=tag_dtype, buffer=buf, strides=(stride,))
+        
+        else:
+            if verbose:
+                print('Reading {} tags separately.'.format(indices.size))
+            recs = np.zeros((indices.size,), dtype=tag_dtype)
+            for i in range(indices.size):
+                if self.memmap is not None:
+                    recs[i] = np.ndarray((), dtype=tag_dtype, buffer=self.memmap, offset=offsets[i])
+                else:
+                    self.file_hdl.seek(offsets[i], 0)
+                    recs[i:i+1] = np.fromfile(self.file_hdl, dtype=tag_dtype, count=1)
+        
+        if not np.all(recs['TagTypeID'] == self.head['TagTypeID']):
+            raise RuntimeError('Unexpected TagTypeID in tags')
+        
+        # copy out as typed arrays
+        tags = {}
+        for name in tag_dtype.names:
+            tags[name] = np.array(recs[name])
+        
+        return tags
+        
+    
     def createDim(self, size, offset, delta, element):
         '''Create dimension labels from SER information
         
@@ -428,9 +1064,6 @@ class fileSER:
         
         '''
         
-        #dim = np.zeros(size)
-        #dim[:] = np.nan
-        
         dim = np.array(range(size)).astype('f8')
         dim = dim*delta
         dim += (offset - dim[element])
@@ -461,11 +1094,15 @@ class fileSER:
         return p
         
     
-    def readEMI(self, filename):
+    def readEMI(self, filename, cache=False):
         '''Read the meta data from an EMI file.
         
+        Only the part from <ObjectInfo> to </ObjectInfo> is searched for in the file, the rest is never read.
+        
         input:
         - filename (string)     name of the EMI file
+        - cache (bool)          True to reuse metadata parsed before from the unchanged file (same size and modification time), 
+                                the last emi_cache_size files are kept
         
         return:
         - emi           dict of metadata
@@ -485,22 +1122,37 @@ class fileSER:
         except :
             raise
         
+        # check for a cached version
+        stat = os.fstat(f_emi.fileno())
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if cache:
+            with emi_cache_lock:
+                emi = emi_cache.get(key)
+                if emi is not None:
+                    emi_cache.move_to_end(key)
+            if emi is not None:
+                f_emi.close()
+                return dict(emi)
+        
         # dict to store emi stuff
         emi = {}
         
         # need anything readable from <ObjectInfo> to </ObjectInfo>
-        collect = False
         data = b''
-        for line in f_emi:
-            if b'<ObjectInfo>' in line:
-                collect = True
-            if collect:
-                data += line.strip()
-            if b'</ObjectInfo>' in line:
-                collect = False
+        if stat.st_size > 0:
+            mm = mmap.mmap(f_emi.fileno(), 0, access=mmap.ACCESS_READ)
+            start = mm.find(b'<ObjectInfo>')
+            if start >= 0:
+                end = mm.find(b'</ObjectInfo>', start)
+                if end >= 0:
+                    data = mm[start:end+len(b'</ObjectInfo>')]
+            mm.close()
 
         # close the file
         f_emi.close()
+        
+        # lines are stripped and concatenated
+        data = b''.join(line.strip() for line in data.splitlines())
             
         # strip of binary stuff still around
         data = data.decode('ascii', errors='ignore')
@@ -545,106 +1197,471 @@ class fileSER:
         
         for elem in grp:
             emi['DetectorRange_'+elem.tag] = self.parseEntryEMI(elem.text)
+        
+        if cache:
+            with emi_cache_lock:
+                emi_cache[key] = dict(emi)
+                emi_cache.move_to_end(key)
+                while len(emi_cache) > emi_cache_size:
+                    emi_cache.popitem(last=False)
 
         return emi
         
         
-    def writeEMD(self, filename):
+    def chunkShape4D(self, frame_shape, scan_shape, itemsize, tiles=4, maxbytes=4194304):
+        '''Chunk shape for a 4D dataset of 2D datasets on a 2D scan.
+        
+        Datasets are split into tiles x tiles parts and tiles x tiles scan positions are combined, 
+        so reading a single dataset or a small region of all datasets (virtual images) both touch a limited number of chunks.
+        
+        input:
+        - frame_shape           shape of the datasets
+        - scan_shape            shape of the scan
+        - itemsize              bytes per element
+        - tiles                 number of tiles along each axis
+        - maxbytes              upper limit for the chunk size
+        
+        return:
+        - chunks                chunk shape
+        '''
+        
+        # tiles of the datasets, not smaller than 16 elements
+        kx = max(min(16, frame_shape[0]), -(-frame_shape[0]//tiles))
+        ky = max(min(16, frame_shape[1]), -(-frame_shape[1]//tiles))
+        
+        # scan positions per chunk, reduced for large tiles
+        c = tiles
+        while c > 1 and kx*ky*c*c*itemsize > maxbytes:
+            c //= 2
+        
+        return (kx, ky, min(c, scan_shape[0]), min(c, scan_shape[1]))
+
+
+    def writeEMD(self, filename, batchsize=None, workers=1, native=False, compression=None):
         '''
         Write SER data to an EMD file.
         
+        2D images are written as (x, y, number) and 1D spectra as (energy, number). 
+        For mappings with two SER dimensions the series is laid out as (..., scan x, scan y), with the first SER dimension running fastest,
+        e.g. 4D datasets (x, y, scan x, scan y) for scans of 2D images.
+        Tags are written as additional dimension datasets, for mappings per scan position.
+        
+        The datasets are converted in batches of batchsize datasets, which limits the memory used to one batch.
+        Chunks hold complete datasets of about 1 MB, batches are rounded down to complete chunks where at least one fits.
+        With more than one worker, batches are read and reordered by reader threads while the previous ones are written, 
+        memory is then limited to workers+2 batches, workers+1 read ahead and the one being written.
+        
+        With native, datasets are written in the order stored in the SER file, without flipping and transposing them.
+        All axes are then reversed, e.g. (number, y, x) with y flipped, tags are written as without native, e.g. dim3_time.
+        The dims follow the stored axes and the group attributes axis_order and flip record how to get back to the layout above, 
+        which is done by fileEMD.get_emdgroup.
+        
         input:
         - filename (string)             name of the EMD file
+        - batchsize (int)               number of datasets converted at once, None for batches of about 128 MB
+        - workers (int)                 number of reader threads
+        - native (bool)                 True to write datasets in stored order
+        - compression                   name of a preset in emt.io.emd.compression_presets or dict of create_dataset options
         '''
         
+        # check input
+        if not batchsize is None and not batchsize > 0:
+            raise ValueError('batchsize needs to be positive')
+        if not workers > 0:
+            raise ValueError('workers needs to be positive')
+        if not compression is None:
+            emt.io.emd.get_filters(compression, self.getElementDtype(0)['data'].base)
+        
         # create the EMD file and set version attributes
         try:
             f = emt.io.emd.fileEMD(filename)
         except:
             raise IOError('Cannot write to file "{}"!'.format(filename))
+        
+        # the file is closed even if the conversion fails, leaving the datasets written so far
+        with f:
+            # use first dataset to layout memory
+            data, first_meta = self.getDataset(0)
+            
+            num = self.head['ValidNumberElements']
+            default_batch = batchsize is None
+            if default_batch:
+                batchsize = max(1, 134217728//data.nbytes)
+            
+            # create dimension datasets
+            dims = []
+            
+            if self.head['DataTypeID'] == 0x4122:
+                # 2d datasets
+                dim = self.createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'], first_meta['Calibration'][0]['CalibrationDelta'], first_meta['Calibration'][0]['CalibrationElement'])
+                dims.append( (dim, 'x', '[m]') )
+
+                dim = self.createDim(first_meta['ArrayShape'][1], first_meta['Calibration'][1]['CalibrationOffset'], first_meta['Calibration'][1]['CalibrationDelta'], first_meta['Calibration'][1]['CalibrationElement'])
+                dims.append( (dim, 'y', '[m]') )
+            elif self.head['DataTypeID'] == 0x4120:
+                # 1d datasets
+                dim = self.createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'], first_meta['Calibration'][0]['CalibrationDelta'], first_meta['Calibration'][0]['CalibrationElement'])
+                dims.append( (dim, 'energy', '[eV]') )
+            else:
+                raise RuntimeError('Unknown DataTypeID')
+            frame_shape = tuple(dim[0].shape[0] for dim in dims)
+            
+            if self.head['NumberDimensions'] == 1:
+                # first SER dimension is number, only the valid part is written
+                i = 0
+                if self.head['DataTypeID'] == 0x4122:
+                    assert self.head['Dimensions'][i]['Description'] == 'Number'
+                dim = self.createDim(self.head['Dimensions'][i]['DimensionSize'], self.head['Dimensions'][i]['CalibrationOffset'], self.head['Dimensions'][i]['CalibrationDelta'], self.head['Dimensions'][i]['CalibrationElement'])
+                dims.append( (dim[:num], self.head['Dimensions'][i]['Description'], '[{}]'.format(self.head['Dimensions'][i]['Units'])) )
+                series_shape = (num,)
+                
+            elif self.head['NumberDimensions'] == 2:
+                # mapping, the full scan is laid out
+                for i in range(2):
+                    dim = self.createDim(self.head['Dimensions'][i]['DimensionSize'], self.head['Dimensions'][i]['CalibrationOffset'], self.head['Dimensions'][i]['CalibrationDelta'], self.head['Dimensions'][i]['CalibrationElement'])
+                    dims.append( (dim, self.head['Dimensions'][i]['Description'], '[{}]'.format(self.head['Dimensions'][i]['Units'])) )
+                series_shape = (self.head['Dimensions'][0]['DimensionSize'], self.head['Dimensions'][1]['DimensionSize'])
+                if num > series_shape[0]*series_shape[1]:
+                    raise RuntimeError('More datasets than fit into the mapping')
+                
+            else:
+                raise RuntimeError('Only series and 2D mappings implemented so far!')
+            
+            # chunk layout depends on the datasets only, not on the batches they are converted in
+            shape = frame_shape + series_shape
+            if len(series_shape) == 1 or len(frame_shape) == 1:
+                # complete datasets of about 1 MB
+                chunks = emt.io.emd.frame_chunks(shape, data.itemsize, frame_ndim=len(frame_shape))
+            else:
+                chunks = self.chunkShape4D(frame_shape, series_shape, data.itemsize)
+                
+            # align batches to complete chunks, or complete rows of chunks for mappings, avoiding partially written chunks
+            if len(series_shape) == 1:
+                rows = chunks[-1]
+            else:
+                rows = series_shape[0]*chunks[-1]
+            if default_batch:
+                batchsize = max(1, batchsize//rows)*rows
+            elif batchsize >= rows:
+                batchsize = batchsize//rows*rows
+            
+            if native:
+                # all axes reversed, images flipped along y
+                axis_order = tuple(reversed(range(len(shape))))
+                flip = (1,) if self.head['DataTypeID'] == 0x4122 else ()
+                dims = [ (dims[j][0][::-1], dims[j][1], dims[j][2]) if j in flip else dims[j] for j in axis_order ]
+                shape = tuple(reversed(shape))
+                chunks = tuple(reversed(chunks))
+            
+            grp = f.create_emdgroup(os.path.basename(self.file_hdl.name), shape, data.dtype, dims, chunks=chunks, compression=compression)
+            if grp is None:
+                raise RuntimeError('Could not create dataset in "{}"'.format(filename))
+            dset = grp['data']
+            
+            if native:
+                grp.attrs['axis_order'] = np.array(axis_order, dtype='i4')
+                grp.attrs['flip'] = np.array(flip, dtype='i4')
+            
+            def write_batch_native(i0, i1, buf):
+                if len(series_shape) == 1:
+                    dset[i0:i1] = buf
+                    return
+                
+                # mappings are stored as (scan y, scan x, ...), which is the order of datasets in the SER file
+                n0 = series_shape[0]
+                i = i0
+                while i < i1:
+                    y, x = divmod(i, n0)
+                    if x == 0 and i1-i >= n0:
+                        # complete rows at once
+                        rows = (i1-i)//n0
+                        dset[y:y+rows] = buf[i-i0:i-i0+rows*n0].reshape((rows, n0)+buf.shape[1:])
+                        i += rows*n0
+                    else:
+                        # part of a row
+                        x1 = min(n0, x+i1-i)
+                        dset[y, x:x1] = buf[i-i0:i-i0+x1-x]
+                        i += x1-x
+            
+            def write_batch(i0, i1, buf):
+                if native:
+                    write_batch_native(i0, i1, buf)
+                    return
+                
+                if len(series_shape) == 1:
+                    dset[..., i0:i1] = buf
+                    return
+                
+                # mappings are written in segments of scan rows
+                n0 = series_shape[0]
+                i = i0
+                while i < i1:
+                    y, x = divmod(i, n0)
+                    if x == 0 and i1-i >= n0:
+                        # complete rows at once
+                        rows = (i1-i)//n0
+                        seg = buf[..., i-i0:i-i0+rows*n0].reshape(buf.shape[:-1]+(rows, n0))
+                        dset[..., :, y:y+rows] = np.swapaxes(seg, -1, -2)
+                        i += rows*n0
+                    else:
+                        # part of a row
+                        x1 = min(n0, x+i1-i)
+                        dset[..., x:x1, y] = buf[..., i-i0:i-i0+x1-x]
+                        i += x1-x
+            
+            # arrays to collect interesting meta data while looping images
+            times = np.zeros(num, dtype='i4')
+            if self.head['TagTypeID'] == 0x4142:
+                positionx = np.zeros(num, dtype='f8')
+                positionx[:] = np.nan
+                positiony = np.zeros(num, dtype='f8')
+                positiony[:] = np.nan
+            
+            # reader threads each get their own file handle, the file position is not shared
+            local = threading.local()
+            readers = []
+            
+            def read_batch(i0, i1):
+                if workers > 1:
+                    if not hasattr(local, 'fser'):
+                        local.fser = copy.copy(self)
+                        local.fser.file_hdl = open(self.file_hdl.name, 'rb')
+                        readers.append(local.fser)
+                    fser = local.fser
+                else:
+                    fser = self
+                
+                if native:
+                    # datasets as stored
+                    buf = fser.getDatasets(range(i0, i1), native=True)
+                else:
+                    # retrieve datasets directly into a transposed buffer
+                    buf = np.empty( frame_shape+(i1-i0,), dtype=data.dtype )
+                    fser.getDatasets(range(i0, i1), out=buf.T)
+                
+                # get tag data of the batch
+                tags = fser.getTags(range(i0, i1))
+                times[i0:i1] = tags['Time']
+                if self.head['TagTypeID'] == 0x4142:
+                    positionx[i0:i1] = tags['PositionX']
+                    positiony[i0:i1] = tags['PositionY']
+                
+                return i0, i1, buf
+            
+            # loop over batches of datasets in ser file to convert them
+            batches = [(i0, min(i0+batchsize, num)) for i0 in range(0, num, batchsize)]
+            
+            if workers > 1:
+                # read ahead, keeping workers+1 batches in flight besides the one written, and write in order
+                try:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                        todo = iter(batches)
+                        pending = collections.deque( executor.submit(read_batch, *b) for b in itertools.islice(todo, workers+1) )
+                        try:
+                            while pending:
+                                i0, i1, buf = pending.popleft().result()
+                                b = next(todo, None)
+                                if b:
+                                    pending.append(executor.submit(read_batch, *b))
+                                
+                                print('converting datasets {} to {} of {}'.format(i0+1, i1, num))
+                                write_batch(i0, i1, buf)
+                        finally:
+                            # do not read further batches after a failure
+                            for future in pending:
+                                future.cancel()
+                
+                finally:
+                    # close the readers' file handles, after the executor has waited for running reads
+                    for fser in readers:
+                        fser.close()
+                
+            else:
+                for b in batches:
+                    i0, i1, buf = read_batch(*b)
+                    print('converting datasets {} to {} of {}'.format(i0+1, i1, num))
+                    write_batch(i0, i1, buf)
+
+            # attempt to free memory asap
+            del buf, dims
             
+            # tags as additional dimension datasets of the series
+            tags = [ (times, 'time', 'timestamp', '[s]') ]
+            if self.head['TagTypeID'] == 0x4142:
+                tags.append( (positionx, 'positionx', 'Position X', '[m]') )
+                tags.append( (positiony, 'positiony', 'Position Y', '[m]') )
+            
+            for tag, label, name, units in tags:
+                # laid out after orientation, so native and oriented files carry the same tags
+                if len(series_shape) == 1:
+                    f.write_dim('dim{}_{}'.format(len(frame_shape)+1, label), (tag, name, units), grp)
+                else:
+                    # per scan position for mappings
+                    tag_map = np.zeros(series_shape[0]*series_shape[1], dtype=tag.dtype)
+                    if tag.dtype.kind == 'f':
+                        tag_map[:] = np.nan
+                    tag_map[:num] = tag
+                    f.write_dim(label, (tag_map.reshape(series_shape, order='F'), name, units), grp)
+            
+            # put meta information from EMI to Microscope group, if available
+            if self.emi:
+                for key in self.emi:
+                    f.microscope.attrs[key] = self.emi[key]
+                    
+            # write comment into Comment group
+            f.put_comment('Converted SER file "{}" to EMD using the emt library.'.format(self.file_hdl.name))
         
-        # use first dataset to layout memory
-        data, first_meta = self.getDataset(0)
+
+
+class serArray:
+    '''
+    Lazy array view of the datasets in a fileSER, laid out as written by writeEMD.
+    
+    Images are (x, y, number), spectra (energy, number), mappings have two scan axes instead of number.
+    Indexing with integers and slices reads only the selected datasets and, within those, only the touched rows.
+    Scan positions of mappings without valid dataset read as zeros.
+    '''
+    
+    def __init__(self, fser):
+        '''Init from the first dataset's layout.
         
-        if self.head['DataTypeID'] == 0x4122:
-            dset_buf = np.zeros( (first_meta['ArrayShape'][0], first_meta['ArrayShape'][1], self.head['ValidNumberElements']), dtype=self.dictDataType[first_meta['DataType']] )
+        input:
+        - fser          fileSER to read from
+        '''
+        
+        if not isinstance(fser, fileSER):
+            raise TypeError('fser needs to be a fileSER')
+        if fser.head['ValidNumberElements'] < 1:
+            raise RuntimeError('No valid datasets in SER file')
+        
+        self.fser = fser
+        self.num = int(fser.head['ValidNumberElements'])
+        
+        # layout of the elements
+        rec_dtype = fser.getElementDtype(0)
+        self.dtype = rec_dtype['data'].base
+        self.raw_shape = rec_dtype['data'].shape
+        self.data_offset = rec_dtype.fields['data'][1]
+        
+        # frame axes as transposed datasets
+        if fser.head['DataTypeID'] == 0x4122:
+            frame_shape = (self.raw_shape[1], self.raw_shape[0])
         else:
-            raise RuntimeError('Only 2D datasets implemented yet!')
-       
-        # arrays to collect interesting meta data while looping images
-        time = np.zeros(self.head['ValidNumberElements'], dtype='i4')
-        if self.head['TagTypeID'] == 0x4142:
-            positionx = np.zeros(self.head['ValidNumberElements'], dtype='f8')
-            positionx[:] = np.nan
-            positiony = np.zeros(self.head['ValidNumberElements'], dtype='f8')
-            positiony[:] = np.nan
-            
-        
-        # loop over datasets in ser file to retrieve them        
-        ### if series size is to large, this will lead to heavy swapping   
-        for i in range(self.head['ValidNumberElements']):
-            print('converting dataset {} of {}'.format(i+1, self.head['ValidNumberElements']))
-            
-            # retrieve dataset and put into buffer
-            data, meta = self.getDataset(i)
-            dset_buf[:,:,i] = data[:,:].transpose()
-            
-            # get tag data per image
-            tag = self.getTag(i)
-            time[i] = tag['Time']
-            if tag['TagTypeID'] == 0x4142:
-                positionx[i] = tag['PositionX']
-                positiony[i] = tag['PositionY']
-        
-        # create dimension datasets
-        dims = []
+            frame_shape = self.raw_shape
         
-        if self.head['DataTypeID'] == 0x4122:
-            # 2d datasets
-            dim = self.createDim(first_meta['ArrayShape'][0], first_meta['Calibration'][0]['CalibrationOffset'], first_meta['Calibration'][0]['CalibrationDelta'], first_meta['Calibration'][0]['CalibrationElement'])
-            dims.append( (dim, 'x', '[m]') )
-
-            dim = self.createDim(first_meta['ArrayShape'][1], first_meta['Calibration'][1]['CalibrationOffset'], first_meta['Calibration'][1]['CalibrationDelta'], first_meta['Calibration'][1]['CalibrationElement'])
-            dims.append( (dim, 'y', '[m]') )
+        if fser.head['NumberDimensions'] == 1:
+            series_shape = (self.num,)
+        elif fser.head['NumberDimensions'] == 2:
+            series_shape = (int(fser.head['Dimensions'][0]['DimensionSize']), int(fser.head['Dimensions'][1]['DimensionSize']))
         else:
-            raise RuntimeError('Only 2D datasets implemented so far!')
-            
-        # first SER dimension is number
-        i = 0
-        assert self.head['Dimensions'][i]['Description'] == 'Number'
-        dim = self.createDim(self.head['Dimensions'][i]['DimensionSize'], self.head['Dimensions'][i]['CalibrationOffset'], self.head['Dimensions'][i]['CalibrationDelta'], self.head['Dimensions'][i]['CalibrationElement'])
-        dims.append( (dim, self.head['Dimensions'][i]['Description'], '[{}]'.format(self.head['Dimensions'][i]['Units'])) )
-            
-        # for mappings there are additional spacial dimensions
-        # need to convert series to 4D beforehand    
-        
-        # dataset to file
-        grp = f.put_emdgroup(os.path.basename(self.file_hdl.name), dset_buf, dims)
-
-        # attempt to free memory asap
-        del dset_buf, dims
-        
-        # hardcoded dim3_ in here, need to adapt later
-        # and add additional dimension datasets
-        f.write_dim('dim3_time', (time, 'timestamp', '[s]'), grp)
-          
-        #if self.head['TagTypeID'] == 0x4142:
-        #    dim_hdl = grp.create_dataset('dim3_positionx', data=positionx)
-        #    dim_hdl.attrs['name']=np.string_('Position X')
-        #    dim_hdl.attrs['units']=np.string_('[m]')
-        # 
-        #    dim_hdl = grp.create_dataset('dim3_positiony', data=positiony)
-        #    dim_hdl.attrs['name']=np.string_('Position Y')
-        #    dim_hdl.attrs['units']=np.string_('[m]')
-            
-        
-        # put meta information from EMI to Microscope group, if available
-        if self.emi:
-            for key in self.emi:
-                f.microscope.attrs[key] = self.emi[key]
-                
-        # write comment into Comment group
-        f.put_comment('Converted SER file "{}" to EMD using the emt library.'.format(self.file_hdl.name))
+            raise RuntimeError('Only series and 2D mappings implemented so far!')
         
+        self.frame_ndim = len(frame_shape)
+        self.shape = tuple(frame_shape) + series_shape
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.nbytes = self.size*self.dtype.itemsize
+        
+        
+    def __len__(self):
+        return self.shape[0]
+    
+    
+    def __array__(self, dtype=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+    
+    
+    def readRows(self, index, r0, r1):
+        '''Read rows r0 to r1 (exclusive) of the dataset index as stored in the file.
+        
+        input:
+        - index (int)   index of dataset
+        - r0 (int)      first row
+        - r1 (int)      row after last one
+        
+        returns:
+        - rows          array of the raw rows
+        '''
+        
+        rowsize = int(np.prod(self.raw_shape[1:]))
+        count = (r1-r0)*rowsize
+        offset = int(self.fser.head['DataOffsetArray'][index]) + self.data_offset + r0*rowsize*self.dtype.itemsize
+        
+        if self.fser.memmap is not None:
+            rows = np.ndarray((count,), dtype=self.dtype, buffer=self.fser.memmap, offset=offset)
+        else:
+            self.fser.file_hdl.seek(offset, 0)
+            rows = np.fromfile(self.fser.file_hdl, dtype=self.dtype, count=count)
+            if not rows.shape[0] == count:
+                raise RuntimeError('Could not read dataset {}'.format(index))
+        
+        return rows.reshape((r1-r0,) + tuple(self.raw_shape[1:]))
+    
+    
+    def __getitem__(self, key):
+        '''Read the part of the datasets selected by integers and slices.'''
+        
+        # normalize key to one entry per axis
+        if not isinstance(key, tuple):
+            key = (key,)
+        if sum(1 for k in key if k is Ellipsis) > 1:
+            raise IndexError('Only a single ellipsis allowed')
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(self.ndim-len(key)+1) + key[i+1:]
+        if len(key) > self.ndim:
+            raise IndexError('Too many indices for array of {} dimensions'.format(self.ndim))
+        key = key + (slice(None),)*(self.ndim-len(key))
+        
+        ranges = []
+        squeeze = []
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(self.shape[axis])))
+                squeeze.append(slice(None))
+            elif isinstance(k, (int, np.integer)):
+                i = int(k)
+                if i < 0:
+                    i += self.shape[axis]
+                if i < 0 or i >= self.shape[axis]:
+                    raise IndexError('Index {} out of range for axis {} of size {}'.format(k, axis, self.shape[axis]))
+                ranges.append(range(i, i+1))
+                squeeze.append(0)
+            else:
+                raise TypeError('Only integers and slices are supported for indexing')
+        
+        out = np.zeros(tuple(len(r) for r in ranges), dtype=self.dtype)
+        if out.size == 0:
+            return out[tuple(squeeze)]
+        
+        # raw rows touched within each dataset
+        if self.frame_ndim == 2:
+            # frame[a, b] is raw[sizeX-1-b, a]
+            rows = np.array([self.raw_shape[0]-1-b for b in ranges[1]])
+            cols = np.array(ranges[0])
+        else:
+            rows = np.array(ranges[0])
+        r0 = int(rows.min())
+        r1 = int(rows.max())+1
+        
+        # datasets touched
+        series_ranges = ranges[self.frame_ndim:]
+        for pos in itertools.product(*[enumerate(r) for r in series_ranges]):
+            if len(pos) == 1:
+                index = pos[0][1]
+            else:
+                index = pos[0][1] + self.shape[self.frame_ndim]*pos[1][1]
+            if index >= self.num:
+                continue
             
+            block = self.readRows(index, r0, r1)
+            if self.frame_ndim == 2:
+                frame = block[np.ix_(rows-r0, cols)].T
+            else:
+                frame = block[rows-r0]
+            out[(Ellipsis,) + tuple(p[0] for p in pos)] = frame
+        
+        return out[tuple(squeeze)]
@@ -0,0 +1,126 @@
+'''
+Small synthetic SER files for the tests, written to resources/output.
+'''
+
+import numpy as np
+import os
+import struct
+
+def write_ser(filename, frames, dims, positions=None, total=None):
+    '''Write a SER file in version 0x0220.
+
+    1D frames are written as 0x4120 elements, 2D frames as 0x4122 elements.
+    Tags hold the time, and the position with positions given.
+
+    input:
+    - filename (string)     name of the SER file
+    - frames                list of numpy arrays, 2D frames in file order
+    - dims                  list of (size, offset, delta, element, description, units) for the dimensions
+    - positions             list of (x, y) for each frame, None for time tags only
+    - total (int)           total number of elements, the number of frames if None
+    '''
+
+    valid = len(frames)
+    if total is None:
+        total = valid
+
+    datatypeid = 0x4120 if frames[0].ndim == 1 else 0x4122
+    tagtypeid = 0x4152 if positions is None else 0x4142
+    dtypeids = {'u1': 1, 'u2': 2, 'u4': 3, 'i1': 4, 'i2': 5, 'i4': 6, 'f4': 7, 'f8': 8}
+
+    # header, offset of the offset arrays filled in below
+    head = struct.pack('<hhhiiii', 0x4949, 0x0197, 0x0220, datatypeid, tagtypeid, total, valid)
+    pos_arrays = len(head)
+    head += struct.pack('<q', 0) + struct.pack('<i', len(dims))
+    for size, offset, delta, element, description, units in dims:
+        head += struct.pack('<iddii', size, offset, delta, element, len(description)) + description.encode()
+        head += struct.pack('<i', len(units)) + units.encode()
+
+    body = bytearray(head)
+
+    # data elements with calibration
+    data_offsets = np.zeros(total, dtype='<i8')
+    for i in range(valid):
+        data_offsets[i] = len(body)
+        frame = np.ascontiguousarray(frames[i], dtype=frames[i].dtype.newbyteorder('<'))
+        dtypeid = dtypeids[frame.dtype.str[1:]]
+        if datatypeid == 0x4120:
+            body += struct.pack('<ddihi', 100.0, 0.5, 0, dtypeid, frame.shape[0])
+        else:
+            body += struct.pack('<ddiddihii', -1.0, 0.01, 0, -2.0, 0.02, 0, dtypeid, frame.shape[0], frame.shape[1])
+        body += frame.tobytes()
+
+    # tags
+    tag_offsets = np.zeros(total, dtype='<i8')
+    for i in range(valid):
+        tag_offsets[i] = len(body)
+        if positions is None:
+            body += struct.pack('<ii', tagtypeid, 1000+i)
+        else:
+            body += struct.pack('<iidd', tagtypeid, 1000+i, positions[i][0], positions[i][1])
+
+    body[pos_arrays:pos_arrays+8] = struct.pack('<q', len(body))
+    body += data_offsets.tobytes() + tag_offsets.tobytes()
+
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'wb') as f:
+        f.write(body)
+
+
+def image_series():
+    '''Write a time series of 23 images of 24x24 pixels.
+
+    return:
+    - filename (string)     name of the SER file
+    '''
+
+    rng = np.random.RandomState(2)
+    filename = 'resources/output/image_series/series01_1.ser'
+    write_ser(filename, [rng.randint(0, 999, (24,24)).astype('<u2') for i in range(23)], [(23, 0.0, 1.0, 0, 'Number', '')])
+
+    return filename
+
+
+def eels_series():
+    '''Write a time series of 17 spectra of 128 channels.
+
+    return:
+    - filename (string)     name of the SER file
+    '''
+
+    rng = np.random.RandomState(3)
+    filename = 'resources/output/EELS_series/eels01_1.ser'
+    write_ser(filename, [rng.randint(0, 999, 128).astype('<u4') for i in range(17)], [(17, 0.0, 1.0, 0, 'Number', '')])
+
+    return filename
+
+
+def spectrum_image():
+    '''Write a 6x4 spectrum image of 64 channels with the last spectrum missing.
+
+    return:
+    - filename (string)     name of the SER file
+    '''
+
+    rng = np.random.RandomState(4)
+    filename = 'resources/output/EDX_spectrum_image/si01_1.ser'
+    write_ser(filename, [rng.rand(64).astype('<f4') for i in range(23)], [(6, 0.0, 1e-9, 0, 'X', 'm'), (4, 0.0, 1e-9, 0, 'Y', 'm')],
+              positions=[(i%6*1e-9, i//6*1e-9) for i in range(23)], total=24)
+
+    return filename
+
+
+def scan_4d():
+    '''Write an 8x5 scan of 32x32 diffraction patterns.
+
+    return:
+    - filename (string)     name of the SER file
+    '''
+
+    rng = np.random.RandomState(5)
+    filename = 'resources/output/STEM_4D_scan/scan01_1.ser'
+    write_ser(filename, [rng.randint(0, 999, (32,32)).astype('<u2') for i in range(40)], [(8, 0.0, 1e-9, 0, 'Scan X', 'm'), (5, 0.0, 1e-9, 0, 'Scan Y', 'm')],
+              positions=[(i%8*1e-9, i//8*1e-9) for i in range(40)])
+
+    return filename
@@ -0,0 +1,116 @@
+'''
+Tests for the cache io module.
+'''
+
+import unittest
+import os
+import numpy as np
+import emt.io.cache
+import emt.io.ser
+import emt.io.emd
+
+class test_cache(unittest.TestCase):
+    '''
+    Test the cache io module
+    '''
+
+    def test_lru(self):
+
+        # wrong input
+        with self.assertRaises(TypeError):
+            emt.io.cache.frameCache(maxbytes=-1)
+
+        frame = np.zeros((16,16))
+        cache = emt.io.cache.frameCache(maxbytes=3*frame.nbytes)
+
+        for i in range(3):
+            cache.put(('file', i), np.ones((16,16))*i, frame.nbytes)
+        self.assertEqual(len(cache), 3)
+
+        # least recently used is dropped
+        self.assertEqual(cache.get(('file', 0))[0,0], 0)
+        cache.put(('file', 3), np.ones((16,16))*3, frame.nbytes)
+        self.assertTrue(('file', 0) in cache)
+        self.assertFalse(('file', 1) in cache)
+        self.assertIsNone(cache.get(('file', 1)))
+
+        # too large for the cache
+        cache.put(('file', 4), np.zeros((64,64)), 4*3*frame.nbytes)
+        self.assertFalse(('file', 4) in cache)
+
+        # frames are shared, so read-only
+        with self.assertRaises(ValueError):
+            cache.get(('file', 3))[0,0] = 42
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['nbytes'], 3*frame.nbytes)
+
+        cache.discard(('file',))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['nbytes'], 0)
+
+
+    def test_ser(self):
+
+        cache = emt.io.cache.frameCache()
+        fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_100x_at_RT/step_off_1.ser', cache=cache)
+        fser_uncached = emt.io.ser.fileSER('resources/Au_SAED_D910mm_100x_at_RT/step_off_1.ser')
+
+        for repeat in range(3):
+            for i in (0, 5, 17):
+                dataset, meta = fser.getDataset(i)
+                self.assertTrue(np.array_equal(dataset, fser_uncached.getDataset(i)[0]))
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.assertEqual(cache.stats()['hits'], 6)
+
+        # shared by other readers of the same file
+        fser2 = emt.io.ser.fileSER('resources/Au_SAED_D910mm_100x_at_RT/step_off_1.ser', cache=cache)
+        fser2.getDataset(5)
+        self.assertEqual(cache.stats()['hits'], 7)
+
+        # meta data is not shared between callers
+        dataset, meta = fser.getDataset(5)
+        meta['ArrayShape'] = None
+        self.assertIsNotNone(fser.getDataset(5)[1]['ArrayShape'])
+
+
+    def test_emd(self):
+
+        cache = emt.io.cache.frameCache()
+        femd = emt.io.emd.fileEMD('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd', readonly=True, cache=cache)
+        grp = femd.list_emds[0]
+        data, dims = femd.get_emdgroup(grp)
+
+        for repeat in range(2):
+            for i in range(data.shape[2]):
+                self.assertTrue(np.array_equal(femd.get_emdframe(grp, i), data[:,:,i]))
+        self.assertEqual(cache.stats()['hits'], data.shape[2])
+        with self.assertRaises(TypeError):
+            femd.get_emdframe(femd.file_hdl, 0)
+
+        # outdated frames dropped on overwrite
+        if os.path.isfile('resources/output/cache.emd'):
+            os.remove('resources/output/cache.emd')
+        femd2 = emt.io.emd.fileEMD('resources/output/cache.emd', cache=cache)
+        grp2 = femd2.put_emdgroup('frames', np.zeros(data.shape), dims)
+        self.assertEqual(femd2.get_emdframe(grp2, 1)[0,0], 0.0)
+        grp2 = femd2.put_emdgroup('frames', np.ones(data.shape), dims, overwrite=True)
+        self.assertEqual(femd2.get_emdframe(grp2, 1)[0,0], 1.0)
+        femd2.close()
+
+        # file rewritten at the same path, reopened with the same cache
+        os.remove('resources/output/cache.emd')
+        with emt.io.emd.fileEMD('resources/output/cache.emd') as femd2:
+            femd2.put_emdgroup('frames', np.ones(data.shape)*2, dims)
+        st = os.stat('resources/output/cache.emd')
+        os.utime('resources/output/cache.emd', ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+        with emt.io.emd.fileEMD('resources/output/cache.emd', readonly=True, cache=cache) as femd2:
+            self.assertEqual(femd2.get_emdframe(femd2.list_emds[0], 1)[0,0], 2.0)
+
+
+# to test with unittest runner
+if __name__ == '__main__':
+    unittest.main()
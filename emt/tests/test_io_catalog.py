@@ -0,0 +1,76 @@
+'''
+Tests for the catalog io module.
+'''
+
+import unittest
+import os
+import os.path
+import datetime
+import emt.io.catalog
+import emt.tests.ser_files
+
+class test_catalog(unittest.TestCase):
+    '''
+    Test the catalog io module
+    '''
+
+    def test_scan(self):
+
+        eels = os.path.dirname(emt.tests.ser_files.eels_series())
+
+        # wrong argument type
+        with self.assertRaises(TypeError):
+            cat = emt.io.catalog.fileCatalog(42)
+
+        # start from scratch
+        if os.path.isfile('resources/output/catalog.json'):
+            os.remove('resources/output/catalog.json')
+
+        cat = emt.io.catalog.fileCatalog('resources/output/catalog.json')
+
+        # non existing path
+        with self.assertRaises(IOError):
+            cat.scan('resources/doesnotexist')
+
+        n = cat.scan(['resources/Au_SAED_D910mm_20x_at_800', eels])
+        self.assertEqual(n, len(cat.entries))
+        cat.save()
+
+        # reload, unchanged files are not indexed again
+        cat = emt.io.catalog.fileCatalog('resources/output/catalog.json')
+        self.assertEqual(cat.scan(['resources/Au_SAED_D910mm_20x_at_800', eels]), 0)
+
+        # changed file is indexed again
+        path = os.path.abspath(os.path.join(eels, 'eels01_1.ser'))
+        cat.entries[path]['mtime'] = 0
+        self.assertEqual(cat.scan(eels), 1)
+
+
+    def test_query(self):
+
+        cat = emt.io.catalog.fileCatalog('resources/output/catalog.json')
+        cat.scan(['resources/Au_SAED_D910mm_20x_at_800', 'resources/Pt_SAED_D910mm_single', os.path.dirname(emt.tests.ser_files.eels_series())])
+
+        # by format
+        sers = cat.query(format='ser')
+        self.assertTrue(all(entry['format'] == 'ser' for entry in sers))
+        self.assertTrue(os.path.abspath('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser') in [entry['path'] for entry in sers])
+
+        # by shape, SER and EMD files of the series
+        found = cat.query(shape=(None, None, 20))
+        self.assertTrue(os.path.abspath('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser') in [entry['path'] for entry in found])
+        self.assertTrue(os.path.abspath('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd') in [entry['path'] for entry in found])
+
+        # by date
+        self.assertEqual(len(cat.query(before=datetime.datetime(1990,1,1))), 0)
+        self.assertEqual(len(cat.query(after='1990-01-01')), len(cat.entries))
+
+        # by microscope conditions
+        found = cat.query(format='ser', AcceleratingVoltage=lambda value: value > 0)
+        self.assertTrue(os.path.abspath('resources/Pt_SAED_D910mm_single/im01_1.ser') in [entry['path'] for entry in found])
+        self.assertEqual(len(cat.query(doesnotexist=42)), 0)
+
+
+# to test with unittest runner
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,21 @@ import unittest
 import os
 import os.path
 import numpy as np
+import multiprocessing
 import emt.io.emd
 
+
+def follow_frames(filename, started, followed):
+    '''Follow the first emdgroup of filename from another process, HDF5 shares files opened twice in one process.'''
+    reader = emt.io.emd.fileEMD(filename, readonly=True, swmr=True)
+    follow = reader.follow_emdgroup(reader.list_emds[0], interval=0.01, timeout=2.0)
+    indices = [next(follow)[0]]
+    started.set()
+    indices += [i for i, frame in follow]
+    followed.put(indices)
+    reader.close()
+
+
 class test_emd(unittest.TestCase):
     '''
     Test the EMD io module
@@ -86,8 +99,389 @@ class test_emd(unittest.TestCase):
         
         # try to overwrite
         self.assertIsNone(femd.put_emdgroup('dataset_1', data, dims))
-        
-        
+
+
+    def test_list_emds(self):
+
+        if os.path.isfile('resources/output/list_emds.emd'):
+            os.remove('resources/output/list_emds.emd')
+        femd = emt.io.emd.fileEMD('resources/output/list_emds.emd')
+        self.assertEqual(femd.list_emds, [])
+
+        # groups added while writing, in order of their path
+        dims = ( (np.array(range(3)), 'x', '[px]'), )
+        grp_eva = femd.file_hdl.create_group('evaluation')
+        for label in ('b', 'a', 'a-b'):
+            femd.put_emdgroup(label, np.zeros(3), dims)
+            femd.put_emdgroup(label, np.zeros(3), dims, parent=grp_eva.require_group(label))
+        femd.put_emdgroup('a', np.ones(3), dims, overwrite=True)
+        femd.put_emdgroup('a', np.ones(3), dims, parent=grp_eva, overwrite=True)
+        names = [grp.name for grp in femd.list_emds]
+        self.assertEqual(len(names), 6)
+        self.assertEqual(names[0], '/data/a')
+        self.assertTrue(np.array_equal(femd.list_emds[0]['data'][:], np.ones(3)))
+
+        # same as scanning the file
+        femd.rescan_emdgroups()
+        self.assertEqual([grp.name for grp in femd.list_emds], names)
+        del femd
+
+        femd = emt.io.emd.fileEMD('resources/output/list_emds.emd', readonly=True)
+        self.assertEqual([grp.name for grp in femd.list_emds], names)
+
+
+    def test_appendable(self):
+
+        if os.path.isfile('resources/output/appendable.emd'):
+            os.remove('resources/output/appendable.emd')
+        femd = emt.io.emd.fileEMD('resources/output/appendable.emd')
+        data = np.random.rand(32,16,25)
+        dims = ( (np.array(range(32)), 'x', '[px]'),
+                 (np.array(range(16)), 'y', '[px]'),
+                 (np.zeros(0), 'time', '[s]') )
+
+        # appended axis needs an empty dim
+        with self.assertRaises(TypeError):
+            femd.create_appendable('frames', data.dtype, dims[0:2] + ( (np.zeros(3), 'time', '[s]'), ))
+
+        app = femd.create_appendable('frames', data.dtype, dims, chunks=(32,16,4))
+        self.assertEqual(len(app), 0)
+        self.assertEqual(app.step, 4)
+
+        # single frames and stacks
+        self.assertEqual(app.append(data[:,:,0], values=0.0), 0)
+        self.assertEqual(app.append(data[:,:,1:10], values=np.arange(1,10)*0.5), 1)
+        with self.assertRaises(TypeError):
+            app.append(data[:16,:,0])
+        with self.assertRaises(TypeError):
+            app.append(data[:,:,10:12], values=[1.0])
+        for i in range(10, 25):
+            app.append(data[:,:,i], values=i*0.5)
+        self.assertEqual(len(app), 25)
+        self.assertEqual(app.data.shape[2] % 4, 0)
+
+        # cut to the appended frames
+        app.close()
+        data_read, dims_read = femd.get_emdgroup(app.group)
+        self.assertTrue(np.array_equal(data_read, data))
+        self.assertTrue(np.array_equal(dims_read[2][0], np.arange(25)*0.5))
+
+        # result rows counting up, e.g. of an evaluation
+        app = femd.create_appendable('rows', 'f8', ( (np.array(range(5)), 'parameters', '[]'), (np.zeros(0, dtype=int), 'number', '[]') ))
+
+        # small rows get small chunks, so short results stay small on disk
+        self.assertEqual(app.data.chunks, (5, emt.io.emd.append_frames))
+        self.assertEqual(app.dim.chunks, (emt.io.emd.append_frames,))
+        for i in range(7):
+            app.append(np.ones(5)*i)
+        del app
+        data_read, dims_read = femd.get_emdgroup(femd.list_emds[-1])
+        self.assertEqual(data_read.shape, (5,7))
+        self.assertTrue(np.array_equal(dims_read[1][0], np.arange(7)))
+
+
+    def test_swmr(self):
+
+        if os.path.isfile('resources/output/swmr.emd'):
+            os.remove('resources/output/swmr.emd')
+        frames = np.random.rand(16,16,10)
+
+        # only for files opened with swmr
+        femd = emt.io.emd.fileEMD('resources/output/test.emd')
+        with self.assertRaises(RuntimeError):
+            femd.start_swmr()
+        del femd
+
+        # writer creates its groups before switching
+        writer = emt.io.emd.fileEMD('resources/output/swmr.emd', swmr=True)
+        app = writer.create_appendable('frames', frames.dtype, ( (np.array(range(16)), 'x', '[px]'),
+                                                                 (np.array(range(16)), 'y', '[px]'),
+                                                                 (np.zeros(0, dtype=int), 'number', '[]') ), chunks=(16,16,4))
+        writer.start_swmr()
+        app.append(frames[:,:,0:3])
+        app.flush()
+        self.assertEqual(app.data.shape[2], 4)
+
+        reader = emt.io.emd.fileEMD('resources/output/swmr.emd', readonly=True, swmr=True)
+        grp = reader.list_emds[0]
+        self.assertEqual(reader.refresh_emdgroup(grp), 3)
+
+        # frames appended while following
+        follow = reader.follow_emdgroup(grp, start=1, interval=0.01, timeout=0.05)
+        followed = [next(follow)[0]]
+        for i in range(3, 10):
+            app.append(frames[:,:,i])
+        app.flush()
+        followed += [i for i, frame in follow]
+        self.assertEqual(followed, list(range(1, 10)))
+        for i, frame in reader.follow_emdgroup(grp, start=9, timeout=0.0):
+            self.assertTrue(np.array_equal(frame, frames[:,:,9]))
+
+        # cut when done
+        app.close()
+        self.assertEqual(reader.refresh_emdgroup(grp), 10)
+        self.assertEqual(grp['data'].shape, frames.shape)
+        reader.close()
+        writer.close()
+
+
+    def test_swmr_process(self):
+
+        if os.path.isfile('resources/output/swmr_process.emd'):
+            os.remove('resources/output/swmr_process.emd')
+        frames = np.random.rand(16,16,10)
+
+        writer = emt.io.emd.fileEMD('resources/output/swmr_process.emd', swmr=True)
+        app = writer.create_appendable('frames', frames.dtype, ( (np.array(range(16)), 'x', '[px]'),
+                                                                 (np.array(range(16)), 'y', '[px]'),
+                                                                 (np.zeros(0, dtype=int), 'number', '[]') ), chunks=(16,16,4))
+        writer.start_swmr()
+        app.append(frames[:,:,0:3])
+        app.flush()
+
+        # reader following in another process sees the frames appended after it started
+        ctx = multiprocessing.get_context('spawn')
+        started = ctx.Event()
+        followed = ctx.Queue()
+        proc = ctx.Process(target=follow_frames, args=('resources/output/swmr_process.emd', started, followed))
+        proc.start()
+        self.assertTrue(started.wait(30))
+        for i in range(3, 10):
+            app.append(frames[:,:,i])
+            app.flush()
+        self.assertEqual(followed.get(timeout=30), list(range(10)))
+        proc.join()
+
+        app.close()
+        writer.close()
+
+
+    def test_close(self):
+
+        # closed leaving the with block
+        with emt.io.emd.fileEMD('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd', readonly=True) as femd:
+            self.assertTrue(len(femd.list_emds) > 0)
+        self.assertIsNone(femd.file_hdl)
+        femd.close()
+
+        # one handle per file
+        with emt.io.emd.filePool() as pool:
+            with self.assertRaises(TypeError):
+                pool.get(42)
+            femd = pool.get('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd')
+            self.assertIs(pool.get(os.path.abspath('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd')), femd)
+            self.assertIs(pool.get('resources/../resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd'), femd)
+            self.assertTrue('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd' in pool)
+            self.assertEqual(len(pool), 1)
+
+            # reopened when closed by someone else
+            femd.close()
+            self.assertIsNot(pool.get('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd'), femd)
+            femd = pool.get('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd')
+        self.assertEqual(len(pool), 0)
+        self.assertIsNone(femd.file_hdl)
+
+
+    def test_linear_dims(self):
+
+        # computed elements, linear prefixes
+        dim = emt.io.emd.linearDim(-1.0, 0.25, 9)
+        self.assertEqual(dim.shape, (9,))
+        self.assertEqual(dim[4], 0.0)
+        self.assertEqual(dim[-1], 1.0)
+        self.assertIsInstance(dim[:5], emt.io.emd.linearDim)
+        self.assertTrue(np.array_equal(dim[::-2], np.linspace(-1.0, 1.0, 9)[::-2]))
+        with self.assertRaises(IndexError):
+            dim[9]
+
+        # works like the expanded array
+        vec = np.linspace(-1.0, 1.0, 9)
+        self.assertIsInstance(dim*2, np.ndarray)
+        self.assertTrue(np.array_equal(dim*2, vec*2))
+        self.assertTrue(np.array_equal(1.0-dim, 1.0-vec))
+        self.assertTrue(np.array_equal(np.sqrt(dim+1.0), np.sqrt(vec+1.0)))
+        self.assertEqual(dim.tolist(), vec.tolist())
+        self.assertEqual(dim.astype('f4').dtype, np.dtype('f4'))
+
+        # only exactly reproducible vectors are linear
+        self.assertIsNotNone(emt.io.emd.linearDim.from_vector(np.array(range(100))))
+        self.assertIsNone(emt.io.emd.linearDim.from_vector(np.array([0.0, 1.0, 3.0])))
+
+        if os.path.isfile('resources/output/linear_dims.emd'):
+            os.remove('resources/output/linear_dims.emd')
+        femd = emt.io.emd.fileEMD('resources/output/linear_dims.emd')
+        dims = ( (dim, 'x', '[nm]'),
+                 (np.array(range(4)), 'y', '[px]'),
+                 (np.array([0.0, 1.0, 3.0]), 'time', '[s]') )
+        grp = femd.put_emdgroup('linear', np.random.rand(9,4,3), dims)
+        self.assertEqual(grp['dim1'].attrs['delta'], 0.25)
+        self.assertEqual(grp['dim2'].attrs['offset'], 0)
+        self.assertFalse('offset' in grp['dim3'].attrs)
+
+        # vectors still stored, computed when read
+        self.assertTrue(np.array_equal(grp['dim1'][:], dim))
+        data, dims_read = femd.get_emdgroup(grp)
+        data_lazy, dims_lazy = femd.get_emdgroup(grp, lazy=True)
+        self.assertIsInstance(dims_lazy[0][0], emt.io.emd.linearDim)
+        self.assertIsInstance(dims_read[0][0], np.ndarray)
+        self.assertEqual(dims_read[1][0].dtype, np.array(range(4)).dtype)
+        for i in range(len(dims)):
+            self.assertTrue(np.array_equal(dims_read[i][0], dims[i][0]))
+            self.assertTrue(np.array_equal(dims_lazy[i][0], dims[i][0]))
+
+
+    def test_virtual(self):
+
+        # series split into several files
+        data = np.random.rand(32,32,12)
+        dims = [ (np.array(range(32)), 'x', '[px]'),
+                 (np.array(range(32)), 'y', '[px]'),
+                 None ]
+        files = []
+        groups = []
+        for k in range(3):
+            if os.path.isfile('resources/output/virtual_{}.emd'.format(k)):
+                os.remove('resources/output/virtual_{}.emd'.format(k))
+            femd = emt.io.emd.fileEMD('resources/output/virtual_{}.emd'.format(k))
+            dims[2] = (np.array(range(4))*0.1 + k, 'time', '[s]')
+            grp = femd.put_emdgroup('part', data[:,:,k*4:(k+1)*4], dims)
+            femd.write_dim('dim3_tag', (np.array(range(4)) + 100*k, 'tag', '[]'), grp)
+            files.append(femd)
+            groups.append(grp)
+
+        if os.path.isfile('resources/output/virtual.emd'):
+            os.remove('resources/output/virtual.emd')
+        femd = emt.io.emd.fileEMD('resources/output/virtual.emd')
+
+        # wrong input
+        with self.assertRaises(TypeError):
+            femd.put_virtual_emdgroup('stitched', [])
+        with self.assertRaises(TypeError):
+            femd.put_virtual_emdgroup('stitched', groups + [femd.put_emdgroup('other', np.zeros((16,16,2)), ( (np.array(range(16)), 'x', '[px]'),
+                                                                                                                (np.array(range(16)), 'y', '[px]'),
+                                                                                                                (np.array(range(2)), 'number', '[]') ))])
+
+        grp = femd.put_virtual_emdgroup('stitched', groups)
+        self.assertTrue(grp['data'].is_virtual)
+        self.assertEqual(grp['data'].id.get_storage_size(), 0)
+        del femd, groups, files
+
+        # read as one stack
+        femd = emt.io.emd.fileEMD('resources/output/virtual.emd', readonly=True)
+        data_read, dims_read = femd.get_emdgroup(femd.file_hdl['data/stitched'])
+        self.assertTrue(np.array_equal(data_read, data))
+        self.assertTrue(np.array_equal(dims_read[2][0], np.concatenate([np.array(range(4))*0.1 + k for k in range(3)])))
+        self.assertTrue(np.array_equal(femd.file_hdl['data/stitched/dim3_tag'][:], [0,1,2,3,100,101,102,103,200,201,202,203]))
+        self.assertTrue(np.array_equal(femd.get_emdframe(femd.file_hdl['data/stitched'], 5), data[:,:,5]))
+
+
+    def test_lazy(self):
+
+        femd = emt.io.emd.fileEMD('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd', readonly=True)
+        data, dims = femd.get_emdgroup(femd.list_emds[0])
+
+        # nothing read until sliced
+        data_lazy, dims_lazy = femd.get_emdgroup(femd.list_emds[0], lazy=True)
+        self.assertEqual(data_lazy.shape, data.shape)
+        self.assertTrue(np.array_equal(data_lazy[:,:,0], data[:,:,0]))
+        for i in range(len(dims)):
+            self.assertTrue(np.array_equal(dims[i][0], dims_lazy[i][0]))
+
+        # stored in reversed order with a flipped axis
+        if os.path.isfile('resources/output/oriented.emd'):
+            os.remove('resources/output/oriented.emd')
+        femd2 = emt.io.emd.fileEMD('resources/output/oriented.emd')
+        stored = np.flip(data, 1).transpose()
+        grp = femd2.put_emdgroup('oriented', np.ascontiguousarray(stored), tuple(reversed(dims)))
+        grp.attrs['axis_order'] = np.array([2, 1, 0])
+        grp.attrs['flip'] = np.array([1])
+
+        data_oriented, dims_oriented = femd2.get_emdgroup(grp, lazy=True)
+        self.assertIsInstance(data_oriented, emt.io.emd.orientedDataset)
+        self.assertEqual(data_oriented.shape, data.shape)
+        self.assertTrue(np.array_equal(data_oriented[...], data))
+        self.assertTrue(np.array_equal(data_oriented[5:30:3, ::-2, -1], data[5:30:3, ::-2, -1]))
+        self.assertTrue(np.array_equal(data_oriented[:, 7], data[:, 7]))
+        with self.assertRaises(IndexError):
+            data_oriented[0, 0, data.shape[2]]
+        with self.assertRaises(TypeError):
+            data_oriented[[0, 1]]
+
+        # read at once
+        data_read, dims_read = femd2.get_emdgroup(grp)
+        self.assertTrue(np.array_equal(data_read, data))
+
+        # read into buffers
+        out = np.empty(data.shape[0:2], dtype=data.dtype)
+        for i in (0, 7, -1):
+            self.assertIs(femd.read_into(femd.list_emds[0], out, i), out)
+            self.assertTrue(np.array_equal(out, data[:,:,i]))
+            femd2.read_into(grp, out, i)
+            self.assertTrue(np.array_equal(out, data[:,:,i]))
+            data_oriented.read_into(out, i)
+            self.assertTrue(np.array_equal(out, data[:,:,i]))
+        out = np.empty(data.shape[0:2], dtype='f8')
+        femd.read_into(femd.list_emds[0], out, 3)
+        self.assertTrue(np.array_equal(out, data[:,:,3]))
+        with self.assertRaises(TypeError):
+            femd.read_into(femd.list_emds[0], np.empty(data.shape[0:2], dtype='f8').T, 0)
+        with self.assertRaises(TypeError):
+            femd2.read_into(grp, np.empty(data.shape[1:3]), 0)
+        with self.assertRaises(IndexError):
+            femd.read_into(femd.list_emds[0], out, data.shape[2])
+
+
+    def test_compression(self):
+
+        # counting mode like data
+        data = np.random.poisson(0.1, size=(128,128,20)).astype('u2')
+        dims = ( (np.array(range(128)), 'x', '[px]'),
+                 (np.array(range(128)), 'y', '[px]'),
+                 (np.array(range(20)), 'number', '[]') )
+
+        if os.path.isfile('resources/output/compression.emd'):
+            os.remove('resources/output/compression.emd')
+        femd = emt.io.emd.fileEMD('resources/output/compression.emd')
+
+        # wrong presets
+        with self.assertRaises(ValueError):
+            femd.put_emdgroup('unknown', data, dims, compression='doesnotexist')
+        with self.assertRaises(ValueError):
+            femd.put_emdgroup('float_scaleoffset', data.astype('f4'), dims, compression='scaleoffset')
+
+        # chunks of complete frames
+        self.assertEqual(emt.io.emd.frame_chunks(data.shape, data.itemsize), (128,128,20))
+        self.assertEqual(emt.io.emd.frame_chunks((512,512,100), 8), (512,512,1))
+        # spectra are the frames of two axes, plain vectors are split
+        self.assertEqual(emt.io.emd.frame_chunks((2048,100000), 4), (2048,128))
+        self.assertEqual(emt.io.emd.frame_chunks((1000000,), 8), (131072,))
+
+        # spectrum series stored with a compression preset
+        spectra = np.random.poisson(5.0, size=(256,5000)).astype('u2')
+        grp = femd.put_emdgroup('spectra', spectra, ( (np.array(range(256)), 'energy', '[eV]'), (np.array(range(5000)), 'number', '[]') ), compression='lzf')
+        self.assertEqual(femd.get_storage(grp)['chunks'], (256,2048))
+
+        for preset in ('lzf', 'gzip', 'scaleoffset'):
+            grp = femd.put_emdgroup(preset, data, dims, compression=preset)
+            self.assertIsNotNone(grp)
+            self.assertTrue(np.array_equal(grp['data'][:], data))
+            storage = femd.get_storage(grp)
+            self.assertEqual(storage['chunks'][0:2], (128,128))
+            self.assertGreater(storage['ratio'], 2.0)
+
+        # explicit chunks without compression
+        grp = femd.put_emdgroup('chunked', data, dims, chunks=(128,128,1))
+        self.assertEqual(femd.get_storage(grp)['chunks'], (128,128,1))
+        self.assertIsNone(femd.get_storage(grp)['compression'])
+
+        # ratio and throughput
+        results = emt.io.emd.benchmark_compression(data, presets=['none', 'lzf'])
+        self.assertEqual(sorted(results), ['lzf', 'none'])
+        self.assertGreater(results['lzf']['ratio'], results['none']['ratio'])
+        self.assertGreater(results['lzf']['write'], 0.0)
+
+
+
     def test_comments(self):
     
         # create a file for comments
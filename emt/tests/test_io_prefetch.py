@@ -0,0 +1,123 @@
+'''
+Tests for the prefetch io module.
+'''
+
+import unittest
+import gc
+import numpy as np
+import emt.io.ser
+import emt.io.emd
+import emt.io.prefetch
+
+class test_prefetch(unittest.TestCase):
+    '''
+    Test the prefetch io module
+    '''
+
+    def test_ser(self):
+
+        fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_100x_at_RT/step_off_1.ser')
+
+        # wrong input
+        with self.assertRaises(TypeError):
+            emt.io.prefetch.framePrefetcher(42)
+        with self.assertRaises(ValueError):
+            emt.io.prefetch.framePrefetcher(fser, depth=0)
+        with self.assertRaises(IndexError):
+            emt.io.prefetch.framePrefetcher(fser, indices=[fser.head['ValidNumberElements']])
+
+        # all frames in order, single and batched reads
+        for batch in (1, 7):
+            prefetcher = emt.io.prefetch.framePrefetcher(fser, depth=3, batch=batch)
+            self.assertEqual(len(prefetcher), fser.head['ValidNumberElements'])
+            count = 0
+            for i, frame in prefetcher:
+                self.assertEqual(i, count)
+                if i % 17 == 0:
+                    self.assertTrue(np.array_equal(frame, fser.getDataset(i)[0]))
+                count += 1
+            self.assertEqual(count, fser.head['ValidNumberElements'])
+
+        # reused buffers
+        for i, frame in emt.io.prefetch.framePrefetcher(fser, batch=4, reuse=True):
+            if i % 13 == 0:
+                self.assertTrue(np.array_equal(frame, fser.getDataset(i)[0]))
+
+        # selected frames, abandoned early
+        for i, frame in emt.io.prefetch.framePrefetcher(fser, indices=[5, 3, 9]):
+            self.assertEqual(i, 5)
+            self.assertTrue(np.array_equal(frame, fser.getDataset(5)[0]))
+            break
+
+        # file handle of the reader closed with the prefetcher, not the one of fser
+        with emt.io.prefetch.framePrefetcher(fser, indices=[1, 2]) as prefetcher:
+            hdl = prefetcher.source.file_hdl
+            self.assertFalse(hdl is fser.file_hdl)
+        self.assertTrue(hdl.closed)
+        self.assertFalse(fser.file_hdl.closed)
+
+        # dropped without iterating, no reader left behind
+        prefetcher = emt.io.prefetch.framePrefetcher(fser, indices=[1, 2])
+        hdl = prefetcher.source.file_hdl
+        del prefetcher
+        gc.collect()
+        self.assertTrue(hdl.closed)
+
+        # abandoned iteration stops the reader
+        prefetcher = emt.io.prefetch.framePrefetcher(fser, depth=1)
+        frames = iter(prefetcher)
+        next(frames)
+        thread = prefetcher.thread
+        del frames, prefetcher
+        gc.collect()
+        thread.join(timeout=5.0)
+        self.assertFalse(thread.is_alive())
+
+        # any error in the reader reaches the consumer
+        class readError(BaseException):
+            pass
+        def failing_read(indices):
+            raise readError()
+        prefetcher = emt.io.prefetch.framePrefetcher(fser, indices=[1, 2])
+        prefetcher.read = failing_read
+        with self.assertRaises(readError):
+            for i, frame in prefetcher:
+                pass
+        with self.assertRaises(RuntimeError):
+            for i, frame in prefetcher:
+                pass
+
+
+    def test_emd(self):
+
+        femd = emt.io.emd.fileEMD('resources/Au_SAED_D910mm_20x_at_800/Au_SAED_D910mm_20x_at_800.emd', readonly=True)
+        grp = femd.list_emds[0]
+        data, dims = femd.get_emdgroup(grp)
+
+        # dims without data
+        dims_only = femd.get_emddims(grp)
+        self.assertEqual(len(dims_only), len(dims))
+        self.assertTrue(np.array_equal(dims_only[2][0], dims[2][0]))
+
+        # frames along the last axis
+        for batch in (1, 4):
+            count = 0
+            for i, frame in emt.io.prefetch.framePrefetcher(grp, batch=batch):
+                self.assertTrue(np.array_equal(frame, data[:,:,i]))
+                count += 1
+            self.assertEqual(count, data.shape[2])
+
+        # reused buffers
+        for batch in (1, 3):
+            prefetcher = emt.io.prefetch.framePrefetcher(grp, depth=2, batch=batch, reuse=True)
+            buffers = set()
+            for i, frame in prefetcher:
+                self.assertTrue(np.array_equal(frame, data[:,:,i]))
+                buffers.add(frame.__array_interface__['data'][0])
+            self.assertEqual(len(buffers), prefetcher.pool.shape[0])
+            self.assertLess(prefetcher.pool.shape[0], data.shape[2])
+
+
+# to test with unittest runner
+if __name__ == '__main__':
+    unittest.main()
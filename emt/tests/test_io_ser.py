@@ -4,7 +4,10 @@ Tests for the ser io module.
 
 import unittest
 import emt.io.ser
+import emt.io.emd
+import emt.tests.ser_files
 import numpy as np
+import h5py
 import os
 import os.path
 
@@ -40,13 +43,49 @@ class test_ser(unittest.TestCase):
         fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', verbose=True)
         fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser','resources/Au_SAED_D910mm_20x_at_800/pos01.emi', verbose=True)
         
-        # single 1D dataset
         # time series of 1D datasets
-        # 2D mapping of 2D datasets
-        # 2D mapping of 1D dataset
-        ## not implemented yet
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.eels_series(), verbose=True)
+        dataset, meta = fser.getDataset(0, verbose=True)
+        self.assertEqual(len(dataset.shape), 1)
+        self.assertEqual(len(meta['Calibration']), 1)
         
+        # 2D mapping of 1D dataset
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.spectrum_image(), verbose=True)
+        self.assertEqual(fser.head['NumberDimensions'], 2)
         
+        # 2D mapping of 2D datasets
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.scan_4d(), verbose=True)
+        self.assertEqual(fser.head['TagTypeID'], 0x4142)
+
+
+    def test_probe(self):
+        '''
+        Test probing the header only.
+        '''
+
+        # wrong argument type
+        with self.assertRaises(TypeError):
+            head = emt.io.ser.probe(42)
+
+        fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser')
+        head = emt.io.ser.probe('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', verbose=True)
+
+        self.assertFalse('DataOffsetArray' in head)
+        self.assertFalse('TagOffsetArray' in head)
+        for key in head:
+            self.assertEqual(head[key], fser.head[key])
+
+        # offset arrays are numpy arrays
+        self.assertIsInstance(fser.head['DataOffsetArray'], np.ndarray)
+        self.assertEqual(fser.head['DataOffsetArray'].dtype, np.dtype('i8'))
+        self.assertEqual(fser.head['TagOffsetArray'].shape[0], fser.head['ValidNumberElements'])
+
+        # no datasets when probing
+        fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', probe=True)
+        with self.assertRaises(RuntimeError):
+            fser.getDataset(0)
+
+
     def test_read_emi(self):
         '''
         Test the emi reading functionality.
@@ -69,7 +108,29 @@ class test_ser(unittest.TestCase):
         self.assertIsInstance(fser.parseEntryEMI('forty two'), np.string_)
         
         # read 
-        fser.readEMI('resources/Pt_SAED_D910mm_single/im01.emi')
+        emi = fser.readEMI('resources/Pt_SAED_D910mm_single/im01.emi')
+        
+        # read with cache
+        emi_cached = fser.readEMI('resources/Pt_SAED_D910mm_single/im01.emi', cache=True)
+        self.assertEqual(emi, emi_cached)
+        emi_cached = fser.readEMI('resources/Pt_SAED_D910mm_single/im01.emi', cache=True)
+        self.assertEqual(emi, emi_cached)
+
+        # cache is bounded, least recently used files are dropped
+        size = emt.io.ser.emi_cache_size
+        try:
+            emt.io.ser.emi_cache_size = 1
+            emt.io.ser.emi_cache.clear()
+            fser.readEMI('resources/Pt_SAED_D910mm_single/im01.emi', cache=True)
+            fser.readEMI('resources/Au_SAED_D910mm_20x_at_800/pos01.emi', cache=True)
+            self.assertEqual(len(emt.io.ser.emi_cache), 1)
+            self.assertEqual(list(emt.io.ser.emi_cache)[0][0], os.path.abspath('resources/Au_SAED_D910mm_20x_at_800/pos01.emi'))
+        finally:
+            emt.io.ser.emi_cache_size = size
+        
+        # no metadata in file
+        with self.assertRaises(RuntimeError):
+            fser.readEMI('resources/Pt_SAED_D910mm_single/im01_1.ser')
         
         
     def test_read_dataset(self):
@@ -93,8 +154,212 @@ class test_ser(unittest.TestCase):
         
         # try tag
         tag = fser.getTag(0, verbose=True)
-        
-        
+
+
+    def test_read_memmap(self):
+        '''
+        Test retrieving datasets from the memory mapped file.
+        '''
+
+        # same file read conventionally and mapped
+        fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser')
+        fser_mm = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', memmap=True)
+
+        # wrong index
+        with self.assertRaises(IndexError):
+            fser_mm.getDataset(fser_mm.head['ValidNumberElements'])
+
+        for i in range(fser.head['ValidNumberElements']):
+            dataset, meta = fser.getDataset(i)
+            dataset_mm, meta_mm = fser_mm.getDataset(i, verbose=(i==0))
+
+            self.assertTrue(np.array_equal(dataset, dataset_mm))
+            self.assertEqual(meta, meta_mm)
+
+            # views are read only
+            self.assertFalse(dataset_mm.flags.writeable)
+
+
+    def test_close(self):
+        '''
+        Test closing the file in a with block.
+        '''
+
+        with emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', memmap=True) as fser:
+            dataset, meta = fser.getDataset(0)
+        self.assertIsNone(fser.file_hdl)
+        self.assertIsNone(fser.memmap)
+
+        # views handed out stay valid
+        with emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser') as fser2:
+            self.assertTrue(np.array_equal(dataset, fser2.getDataset(0)[0]))
+        fser.close()
+
+
+    def test_read_datasets(self):
+        '''
+        Test retrieving several datasets at once.
+        '''
+
+        for memmap in (False, True):
+            fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', memmap=memmap)
+
+            # wrong index
+            with self.assertRaises(IndexError):
+                fser.getDatasets([0, fser.head['ValidNumberElements']])
+
+            # wrong index type
+            with self.assertRaises(TypeError):
+                fser.getDatasets(['foo'])
+
+            # unsorted with duplicates, forcing several reads
+            indices = [5, 3, 4, 3, 0, 19]
+            datasets = fser.getDatasets(indices, verbose=True)
+            self.assertEqual(datasets.shape[0], len(indices))
+            for i in range(len(indices)):
+                self.assertTrue(np.array_equal(datasets[i], fser.getDataset(indices[i])[0]))
+
+            # slicing
+            self.assertEqual(len(fser), fser.head['ValidNumberElements'])
+            datasets = fser[2:15:3]
+            for i, j in enumerate(range(2, 15, 3)):
+                self.assertTrue(np.array_equal(datasets[i], fser.getDataset(j)[0]))
+            self.assertTrue(np.array_equal(fser[-1], fser.getDataset(len(fser)-1)[0]))
+            self.assertEqual(fser[5:5].shape[0], 0)
+
+
+    def test_read_tags(self):
+        '''
+        Test retrieving tags at once.
+        '''
+
+        for memmap in (False, True):
+            fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', memmap=memmap)
+
+            # wrong index
+            with self.assertRaises(IndexError):
+                fser.getTags([-1])
+
+            # all tags, regularly spaced
+            tags = fser.getTags(verbose=True)
+            self.assertEqual(tags['Time'].shape[0], fser.head['ValidNumberElements'])
+            for i in range(fser.head['ValidNumberElements']):
+                tag = fser.getTag(i)
+                for key in tag:
+                    self.assertEqual(tags[key][i], tag[key])
+
+            # irregular
+            tags = fser.getTags([7, 2, 3], verbose=True)
+            for i, j in enumerate([7, 2, 3]):
+                self.assertEqual(tags['Time'][i], fser.getTag(j)['Time'])
+
+
+    def test_as_array(self):
+        '''
+        Test the lazy array view.
+        '''
+
+        for memmap in (False, True):
+            fser = emt.io.ser.fileSER('resources/Au_SAED_D910mm_100x_at_RT/step_off_1.ser', memmap=memmap)
+            arr = fser.as_array()
+            self.assertEqual(arr.shape[2], fser.head['ValidNumberElements'])
+            self.assertEqual(arr.dtype, fser.getDataset(0)[0].dtype)
+
+            # crops of selected frames
+            crop = arr[10:40, 5:50, ::10]
+            self.assertEqual(crop.shape, (30, 45, 10))
+            for i in range(10):
+                self.assertTrue(np.array_equal(crop[:,:,i], fser.getDataset(10*i)[0].T[10:40, 5:50]))
+
+            # single frame, negative and reversed indices
+            self.assertTrue(np.array_equal(arr[..., -1], fser.getDataset(fser.head['ValidNumberElements']-1)[0].T))
+            self.assertTrue(np.array_equal(arr[::-3, 7, 2], fser.getDataset(2)[0].T[::-3, 7]))
+
+            # wrong indices
+            with self.assertRaises(IndexError):
+                arr[0, 0, fser.head['ValidNumberElements']]
+            with self.assertRaises(TypeError):
+                arr[[0, 1]]
+
+        # mapping as written by writeEMD
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.scan_4d())
+        arr = fser.as_array()
+        self.assertEqual(len(arr.shape), 4)
+        if os.path.isfile('resources/output/STEM_4D_scan_array.emd'):
+            os.remove('resources/output/STEM_4D_scan_array.emd')
+        fser.writeEMD('resources/output/STEM_4D_scan_array.emd')
+        femd = emt.io.emd.fileEMD('resources/output/STEM_4D_scan_array.emd', readonly=True)
+        data, dims = femd.get_emdgroup(femd.list_emds[0])
+        self.assertTrue(np.array_equal(arr[...], data))
+        self.assertTrue(np.array_equal(arr[4:20, ::3, 1:, 2], data[4:20, ::3, 1:, 2]))
+
+
+    def test_follow(self):
+        '''
+        Test following a SER file still being written.
+        '''
+
+        # simulate an acquisition by copying a complete series step by step
+        ref = emt.io.ser.fileSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser')
+        with open('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', 'rb') as f:
+            raw = bytearray(f.read())
+        total = int(ref.head['TotalNumberElements'])
+        arr_off = int(ref.head['OffsetArrayOffset'])
+
+        def write_partial(valid, cut_tag=False):
+            part = bytearray(raw)
+            part[18:22] = np.array([valid], dtype='<i4').tobytes()
+            offsets = np.frombuffer(bytes(raw[arr_off:arr_off+16*total]), dtype='<i8').copy()
+            offsets[valid:total] = 0
+            offsets[total+valid:] = 0
+            if cut_tag:
+                # last tag only partly written
+                offsets[total+valid-1] = len(part)-4
+            part[arr_off:arr_off+16*total] = offsets.tobytes()
+            with open('resources/output/follow_1.ser', 'wb') as f:
+                f.write(part)
+
+        for memmap in (False, True):
+            write_partial(5)
+            fser = emt.io.ser.fileSER('resources/output/follow_1.ser', memmap=memmap)
+            self.assertEqual(len(fser), 5)
+
+            # nothing new
+            self.assertEqual(fser.refresh(), 0)
+
+            # new elements
+            write_partial(12)
+            self.assertEqual(fser.refresh(verbose=True), 7)
+            self.assertEqual(len(fser), 12)
+            self.assertTrue(np.array_equal(fser.getDataset(11)[0], ref.getDataset(11)[0]))
+            self.assertEqual(fser.getTag(11)['Time'], ref.getTag(11)['Time'])
+
+            # tag not completely written yet
+            write_partial(13, cut_tag=True)
+            self.assertEqual(fser.refresh(), 0)
+            self.assertEqual(len(fser), 12)
+
+            # follow until complete, yielding only new ones
+            write_partial(total)
+            indices = []
+            for i, dataset in fser.follow(interval=0.01, timeout=1.0):
+                self.assertTrue(np.array_equal(dataset, ref.getDataset(i)[0]))
+                indices.append(i)
+            self.assertEqual(indices, list(range(12, total)))
+
+            # incomplete acquisition stops after timeout
+            write_partial(3)
+            fser = emt.io.ser.fileSER('resources/output/follow_1.ser', memmap=memmap)
+            self.assertEqual([i for i, dataset in fser.follow(start=0, interval=0.01, timeout=0.05)], [0, 1, 2])
+
+            del fser
+
+        # probing only
+        fser = emt.io.ser.fileSER('resources/output/follow_1.ser', probe=True)
+        with self.assertRaises(RuntimeError):
+            fser.refresh()
+
+
     def test_write_emd(self):
         '''
         Test the emd writing functionality.
@@ -124,12 +389,278 @@ class test_ser(unittest.TestCase):
         if os.path.isfile('resources/output/Au_SAED_D910mm_100x_at_RT.emd'):
             os.remove('resources/output/Au_SAED_D910mm_100x_at_RT.emd')
         fser.writeEMD('resources/output/Au_SAED_D910mm_100x_at_RT.emd')
-        
-        # single 1D dataset
-        # time series of 1D datasets
+
+
+    def test_write_emd_linear_dims(self):
+        '''
+        Test that calibrated dims are written as linear dims.
+        '''
+
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.image_series())
+        if os.path.isfile('resources/output/image_series.emd'):
+            os.remove('resources/output/image_series.emd')
+        fser.writeEMD('resources/output/image_series.emd')
+
+        # calibrated dims are plain arrays
+        dim = fser.createDim(16, 1.0, 0.5, 2)
+        self.assertIsInstance(dim, np.ndarray)
+        self.assertEqual(dim[2], 1.0)
+
+        with emt.io.emd.fileEMD('resources/output/image_series.emd', readonly=True) as femd:
+            self.assertTrue('delta' in femd.list_emds[0]['dim1'].attrs)
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            self.assertTrue(np.allclose(dims[0][0], -1.0 + 0.01*np.arange(24)))
+        fser.close()
+
+
+    def test_write_emd_batches(self):
+        '''
+        Test writing in batches.
+        '''
+
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.image_series())
+        for name in ('image_series', 'image_series_batches'):
+            if os.path.isfile('resources/output/{}.emd'.format(name)):
+                os.remove('resources/output/{}.emd'.format(name))
+
+        with self.assertRaises(ValueError):
+            fser.writeEMD('resources/output/image_series_batches.emd', batchsize=0)
+        fser.writeEMD('resources/output/image_series.emd')
+        fser.writeEMD('resources/output/image_series_batches.emd', batchsize=7)
+
+        with emt.io.emd.fileEMD('resources/output/image_series.emd', readonly=True) as femd, \
+             emt.io.emd.fileEMD('resources/output/image_series_batches.emd', readonly=True) as femd_batches:
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            data_batches, dims_batches = femd_batches.get_emdgroup(femd_batches.list_emds[0])
+            self.assertTrue(np.array_equal(data, fser.as_array()[...]))
+            self.assertTrue(np.array_equal(data, data_batches))
+            for i in range(len(dims)):
+                self.assertTrue(np.array_equal(dims[i][0], dims_batches[i][0]))
+            self.assertTrue(np.array_equal(femd.list_emds[0]['dim3_time'], femd_batches.list_emds[0]['dim3_time']))
+            self.assertTrue(np.array_equal(femd.list_emds[0]['dim3_time'], fser.getTags()['Time']))
+        fser.close()
+
+
+    def test_write_emd_workers(self):
+        '''
+        Test writing with reader threads.
+        '''
+
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.image_series())
+        if os.path.isfile('resources/output/image_series_workers.emd'):
+            os.remove('resources/output/image_series_workers.emd')
+
+        with self.assertRaises(ValueError):
+            fser.writeEMD('resources/output/image_series_workers.emd', batchsize=7, workers=0)
+        fser.writeEMD('resources/output/image_series_workers.emd', batchsize=7, workers=3)
+
+        with emt.io.emd.fileEMD('resources/output/image_series_workers.emd', readonly=True) as femd:
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            self.assertTrue(np.array_equal(data, fser.as_array()[...]))
+            self.assertTrue(np.array_equal(femd.list_emds[0]['dim3_time'], fser.getTags()['Time']))
+        fser.close()
+
+
+    def test_write_emd_failed(self):
+        '''
+        Test that a failing conversion releases the output and the readers' file handles.
+        '''
+
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.image_series())
+        getTags = fser.getTags
+        def failing_tags(indices):
+            if indices[0] >= 14:
+                raise RuntimeError('failing read')
+            return getTags(indices)
+        fser.getTags = failing_tags
+        if os.path.isfile('resources/output/image_series_failed.emd'):
+            os.remove('resources/output/image_series_failed.emd')
+
+        error = None
+        try:
+            fser.writeEMD('resources/output/image_series_failed.emd', batchsize=7, workers=3)
+        except RuntimeError as e:
+            # keeps the frames of writeEMD alive
+            error = e
+        self.assertIsNotNone(error)
+        open_files = [os.path.abspath(fid.name.decode('utf-8')) for fid in h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE)]
+        self.assertFalse(os.path.abspath('resources/output/image_series_failed.emd') in open_files)
+
+        # datasets written so far are kept
+        with emt.io.emd.fileEMD('resources/output/image_series_failed.emd', readonly=True) as femd:
+            self.assertTrue(np.array_equal(femd.list_emds[0]['data'][..., :14], fser.as_array()[..., :14]))
+        fser.close()
+
+
+    def test_write_emd_spectra(self):
+        '''
+        Test writing a time series of 1D datasets.
+        '''
+
+        filename = emt.tests.ser_files.eels_series()
+        for memmap in (False, True):
+            fser = emt.io.ser.fileSER(filename, memmap=memmap)
+            if os.path.isfile('resources/output/EELS_series.emd'):
+                os.remove('resources/output/EELS_series.emd')
+            fser.writeEMD('resources/output/EELS_series.emd', batchsize=5)
+
+            with emt.io.emd.fileEMD('resources/output/EELS_series.emd', readonly=True) as femd:
+                data, dims = femd.get_emdgroup(femd.list_emds[0])
+                self.assertTrue(np.array_equal(data, fser[:].transpose()))
+                self.assertTrue('dim2_time' in femd.list_emds[0])
+            fser.close()
+
+
+    def test_write_emd_mapping(self):
+        '''
+        Test writing 2D mappings of 1D and 2D datasets.
+        '''
+
+        # 2D mapping of 1D dataset, the last scan position is missing
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.spectrum_image())
+        if os.path.isfile('resources/output/EDX_spectrum_image.emd'):
+            os.remove('resources/output/EDX_spectrum_image.emd')
+        fser.writeEMD('resources/output/EDX_spectrum_image.emd', batchsize=3)
+
+        with emt.io.emd.fileEMD('resources/output/EDX_spectrum_image.emd', readonly=True) as femd:
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            self.assertEqual(data.shape[1:], (fser.head['Dimensions'][0]['DimensionSize'], fser.head['Dimensions'][1]['DimensionSize']))
+            for i in range(fser.head['ValidNumberElements']):
+                self.assertTrue(np.array_equal(data[:, i%data.shape[1], i//data.shape[1]], fser[i]))
+            self.assertTrue(np.isnan(femd.list_emds[0]['positionx'][-1, -1]))
+        fser.close()
+
         # 2D mapping of 2D datasets
-        # 2D mapping of 1D dataset
-        ## not implemented yet
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.scan_4d())
+        if os.path.isfile('resources/output/STEM_4D_scan.emd'):
+            os.remove('resources/output/STEM_4D_scan.emd')
+        fser.writeEMD('resources/output/STEM_4D_scan.emd')
+
+        with emt.io.emd.fileEMD('resources/output/STEM_4D_scan.emd', readonly=True) as femd:
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            self.assertEqual(len(data.shape), 4)
+            self.assertEqual(data.shape[2:], (fser.head['Dimensions'][0]['DimensionSize'], fser.head['Dimensions'][1]['DimensionSize']))
+            tags = fser.getTags()
+            for i in range(fser.head['ValidNumberElements']):
+                self.assertTrue(np.array_equal(data[:, :, i%data.shape[2], i//data.shape[2]], fser[i].transpose()))
+                self.assertEqual(femd.list_emds[0]['positionx'][i%data.shape[2], i//data.shape[2]], tags['PositionX'][i])
+        fser.close()
+
+
+    def test_write_emd_native(self):
+        '''
+        Test writing in native order, oriented on reading.
+        '''
+
+        for filename, label in ((emt.tests.ser_files.image_series(), 'image_series'),
+                                (emt.tests.ser_files.spectrum_image(), 'EDX_spectrum_image'),
+                                (emt.tests.ser_files.scan_4d(), 'STEM_4D_scan')):
+            fser = emt.io.ser.fileSER(filename)
+            for name in (label, label+'_native'):
+                if os.path.isfile('resources/output/{}.emd'.format(name)):
+                    os.remove('resources/output/{}.emd'.format(name))
+            fser.writeEMD('resources/output/{}.emd'.format(label))
+            fser.writeEMD('resources/output/{}_native.emd'.format(label), batchsize=7, native=True)
+
+            femd = emt.io.emd.fileEMD('resources/output/{}.emd'.format(label), readonly=True)
+            femd_native = emt.io.emd.fileEMD('resources/output/{}_native.emd'.format(label), readonly=True)
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            data_native, dims_native = femd_native.get_emdgroup(femd_native.list_emds[0])
+            self.assertTrue(np.array_equal(data, data_native))
+            for i in range(len(dims)):
+                self.assertTrue(np.array_equal(dims[i][0], dims_native[i][0]))
+                self.assertEqual(dims[i][1:], dims_native[i][1:])
+
+            # same tags
+            tags = [name for name in femd.list_emds[0] if name.endswith('_time') or name in ('time', 'positionx', 'positiony')]
+            self.assertTrue(len(tags) > 0)
+            for name in tags:
+                self.assertTrue(np.array_equal(femd.list_emds[0][name], femd_native.list_emds[0][name], equal_nan=True))
+
+            # stored order
+            data_native, dims_native = femd_native.get_emdgroup(femd_native.list_emds[0], orient=False)
+            self.assertEqual(data_native.shape, data.shape[::-1])
+            first = fser.getDatasets([0], native=True)[0]
+            self.assertTrue(np.array_equal(data_native[(0,)*(data_native.ndim-first.ndim)], first))
+            femd.close()
+            femd_native.close()
+            fser.close()
+
+
+    def test_write_emd_compression(self):
+        '''
+        Test writing compressed datasets.
+        '''
+
+        fser = emt.io.ser.fileSER(emt.tests.ser_files.image_series())
+        if os.path.isfile('resources/output/image_series_lzf.emd'):
+            os.remove('resources/output/image_series_lzf.emd')
+        with self.assertRaises(ValueError):
+            fser.writeEMD('resources/output/image_series_lzf.emd', compression='doesnotexist')
+        fser.writeEMD('resources/output/image_series_lzf.emd', compression='lzf')
+
+        with emt.io.emd.fileEMD('resources/output/image_series_lzf.emd', readonly=True) as femd:
+            data, dims = femd.get_emdgroup(femd.list_emds[0])
+            self.assertTrue(np.array_equal(data, fser.as_array()[...]))
+            self.assertEqual(femd.get_storage(femd.list_emds[0])['compression'], 'lzf')
+        fser.close()
+
+
+    def test_write_emd_chunks(self):
+        '''
+        Test that the chunk layout does not depend on the batches.
+        '''
+
+        for filename in (emt.tests.ser_files.eels_series(), emt.tests.ser_files.spectrum_image(), emt.tests.ser_files.scan_4d()):
+            fser = emt.io.ser.fileSER(filename)
+            chunks = []
+            for batchsize in (None, 3):
+                if os.path.isfile('resources/output/chunks.emd'):
+                    os.remove('resources/output/chunks.emd')
+                fser.writeEMD('resources/output/chunks.emd', batchsize=batchsize)
+                with emt.io.emd.fileEMD('resources/output/chunks.emd', readonly=True) as femd:
+                    chunks.append(femd.list_emds[0]['data'].chunks)
+                    data = femd.list_emds[0]['data'][...]
+            self.assertEqual(chunks[0], chunks[1])
+
+            # complete datasets of about 1 MB
+            if fser.head['NumberDimensions'] == 1 or fser.head['DataTypeID'] == 0x4120:
+                self.assertEqual(chunks[0], emt.io.emd.frame_chunks(data.shape, data.itemsize, frame_ndim=data.ndim-fser.head['NumberDimensions']))
+            fser.close()
+
+
+
+    def test_convert(self):
+        '''
+        Test finding and converting several SER files.
+        '''
+
+        # directories, patterns and files, without duplicates
+        filenames = emt.io.ser.findSER(['resources/Au_SAED_D910mm_20x_at_800', 'resources/*/im01_1.ser', 'resources/Pt_SAED_D910mm_single/im01_1.ser'])
+        self.assertEqual(filenames, sorted([os.path.normpath('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser'), os.path.normpath('resources/Pt_SAED_D910mm_single/im01_1.ser')]))
+        self.assertTrue(os.path.normpath(emt.tests.ser_files.scan_4d()) in emt.io.ser.findSER('resources', recursive=True))
+
+        if os.path.isfile('resources/output/pos01_1.emd'):
+            os.remove('resources/output/pos01_1.emd')
+        result = emt.io.ser.convertSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', 'resources/output/pos01_1.emd', batchsize=7)
+        self.assertEqual(result['status'], 'converted')
+        self.assertGreater(result['nbytes'], 0)
+
+        # EMI file found
+        femd = emt.io.emd.fileEMD('resources/output/pos01_1.emd', readonly=True)
+        self.assertTrue('AcquireDate' in femd.microscope.attrs)
+        del femd
+
+        # up to date
+        result = emt.io.ser.convertSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', 'resources/output/pos01_1.emd')
+        self.assertEqual(result['status'], 'skipped')
+        result = emt.io.ser.convertSER('resources/Au_SAED_D910mm_20x_at_800/pos01_1.ser', 'resources/output/pos01_1.emd', overwrite=True)
+        self.assertEqual(result['status'], 'converted')
+
+        # errors are returned
+        result = emt.io.ser.convertSER('resources/Pt_SAED_D910mm_single/im01.emi', 'resources/output/im01.emd')
+        self.assertEqual(result['status'], 'failed')
+        self.assertFalse(os.path.isfile('resources/output/im01.emd.tmp'))
 
 
 # to test with unittest runner